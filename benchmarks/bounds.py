@@ -0,0 +1,62 @@
+"""
+Benchmark the GrADS `bounds` function on sequences of positions.
+
+Compares sequences stored as structured arrays, which are filtered with a
+single scan, with `ColumnData`, which use spatial and time indexes.
+
+Usage: python benchmarks/bounds.py [number of rows ...]
+
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from pydap.model import *
+from pydap.handlers.lib import ColumnData
+from pydap.wsgi.functions import bounds
+
+
+ARGS = (10, 20, -5, 5, 0, 5000, '00Z01JAN1970', '00Z01JAN1971')
+
+
+def dataset(n, columnar):
+    columns = [
+        ('lon', np.random.uniform(0, 360, n)),
+        ('lat', np.random.uniform(-90, 90, n)),
+        ('depth', np.random.uniform(0, 5000, n)),
+        ('time', np.linspace(0, 2 * 365 * 86400, n)),
+    ]
+    dataset = DatasetType('positions')
+    seq = dataset['cast'] = SequenceType('cast')
+    for name, axis in [('lon', 'X'), ('lat', 'Y'), ('depth', 'Z'), ('time', 'T')]:
+        seq[name] = BaseType(name, axis=axis)
+    seq.time.attributes['units'] = 'seconds since 1970-01-01'
+    if columnar:
+        seq.data = ColumnData(columns)
+    else:
+        seq.data = np.rec.fromarrays([col for name, col in columns],
+                names=[name for name, col in columns])
+    return dataset
+
+
+def query(dataset):
+    out = dataset.clone()
+    bounds(out, *ARGS)
+    return np.asarray(out.cast.lat.data).sum()
+
+
+def main(sizes):
+    for n in sizes:
+        for columnar in [False, True]:
+            data = dataset(n, columnar)
+            query(data)  # build the indexes
+            number = max(1, 10000000 // n)
+            elapsed = timeit.timeit(lambda: query(data), number=number)
+            print '%8d rows, %s: %8.2f ms' % (n,
+                    'columns' if columnar else 'records',
+                    1000 * elapsed / number)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100000, 1000000, 5000000])
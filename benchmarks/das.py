@@ -0,0 +1,44 @@
+"""
+Benchmark the DAS parser on large synthetic documents.
+
+Usage: python benchmarks/das.py [number of values ...]
+
+"""
+import sys
+import timeit
+
+from pydap.parsers.das import parse_das
+
+
+def synthetic_das(n):
+    """
+    Build a DAS with about `n` numeric attribute values.
+
+    """
+    lines = ['Attributes {']
+    for i in xrange(max(1, n // 1000)):
+        lines.extend([
+            '    var_%d {' % i,
+            '        String units "degrees_north";',
+            '        Float32 valid_range -90.0, 90.0;',
+            '        Int16 flag_values %s;' % ', '.join(
+                str(j % 100) for j in xrange(500)),
+            '        Float64 coordinates %s;' % ', '.join(
+                repr(j * 0.25) for j in xrange(496)),
+            '    }',
+        ])
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def main(sizes):
+    for n in sizes:
+        das = synthetic_das(n)
+        number = max(1, 100000 // n)
+        elapsed = timeit.timeit(lambda: parse_das(das), number=number)
+        print '%8d values, %8d bytes: %8.2f ms' % (
+                n, len(das), 1000 * elapsed / number)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,53 @@
+"""
+Benchmark the DDS parser on large synthetic documents.
+
+Usage: python benchmarks/dds.py [number of variables ...]
+
+"""
+import sys
+import timeit
+
+from pydap.parsers.dds import build_dataset
+
+
+def synthetic_dds(n):
+    """
+    Build a DDS with about `n` variables of all types.
+
+    """
+    lines = ['Dataset {']
+    for i in xrange(n // 10):
+        lines.extend([
+            '    Float32 temp_%d[time = 365][lat = 180][lon = 360];' % i,
+            '    Int16 mask_%d[lat = 180][lon = 360];' % i,
+            '    String name_%d;' % i,
+            '    Grid {',
+            '      Array:',
+            '        Float64 salt_%d[time = 365][depth = 40];' % i,
+            '      Maps:',
+            '        Float64 time[time = 365];',
+            '        Float64 depth[depth = 40];',
+            '    } salt_%d;' % i,
+            '    Sequence {',
+            '        Int32 index;',
+            '        Float64 pressure;',
+            '        Structure {',
+            '            String station;',
+            '        } meta;',
+            '    } cast_%d;' % i,
+        ])
+    lines.append('} synthetic;')
+    return '\n'.join(lines)
+
+
+def main(sizes):
+    for n in sizes:
+        dds = synthetic_dds(n)
+        number = max(1, 10000 // n)
+        elapsed = timeit.timeit(lambda: build_dataset(dds), number=number)
+        print '%8d variables, %8d bytes: %8.2f ms' % (
+                n, len(dds), 1000 * elapsed / number)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,63 @@
+"""
+Benchmark the time to first byte of grid requests.
+
+The grid data is read through a wrapper that simulates disk or network
+throughput, so the benchmark shows how long a response takes to start.
+
+Usage: python benchmarks/grid.py [number of rows ...]
+
+"""
+import sys
+import time
+
+import numpy as np
+from webob import Request
+
+from pydap.model import *
+from pydap.handlers.lib import BaseHandler
+
+
+# simulated throughput, in bytes per second
+THROUGHPUT = 2**30
+
+
+class SlowArray(object):
+    def __init__(self, data):
+        self.data = data
+
+    dtype = property(lambda self: self.data.dtype)
+    shape = property(lambda self: self.data.shape)
+
+    def __getitem__(self, key):
+        out = self.data[key]
+        time.sleep(out.nbytes / float(THROUGHPUT))
+        return out
+
+
+def grid_dataset(n):
+    dataset = DatasetType('test')
+    grid = dataset['temp'] = GridType('temp')
+    grid['temp'] = BaseType('temp', SlowArray(np.zeros((n, 1000), 'f')),
+            dimensions=('time', 'x'))
+    grid['time'] = BaseType('time', np.arange(n, dtype='d'))
+    grid['x'] = BaseType('x', np.arange(1000, dtype='d'))
+    return dataset
+
+
+def main(sizes):
+    for n in sizes:
+        app = BaseHandler(grid_dataset(n))
+        req = Request.blank('/.dods?temp[0:1:%d][0:1:999]' % (n - 1))
+        start = time.time()
+        body = iter(req.get_response(app).app_iter)
+        next(body)
+        first = time.time() - start
+        for block in body:
+            pass
+        total = time.time() - start
+        print '%8d rows: first byte %8.2f ms, total %8.2f ms' % (
+                n, 1000 * first, 1000 * total)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,78 @@
+"""
+Benchmark the memory use and construction time of wide datasets.
+
+Usage: python benchmarks/model.py [number of variables ...]
+
+Each size is measured in a separate process, so that the memory reported is
+the growth of the resident set while building the dataset.
+
+"""
+import sys
+import timeit
+import resource
+import subprocess
+
+from pydap.model import *
+
+
+def wide_dataset(n):
+    """
+    Build a dataset with `n` variables, a tenth of them with attributes.
+
+    """
+    dataset = DatasetType('wide')
+    for i in xrange(n // 10):
+        structure = dataset['group_%d' % i] = StructureType('group_%d' % i)
+        for j in xrange(8):
+            name = 'var_%d' % j
+            structure[name] = BaseType(name, dimensions=('time',))
+        structure['time'] = BaseType('time', units='days since 1970-01-01')
+    return dataset
+
+
+def deep_dataset(depth, width=100):
+    """
+    Build nested structures bottom up, the way the DDS parser does.
+
+    """
+    child = None
+    for i in xrange(depth):
+        structure = StructureType('level_%d' % i)
+        for j in xrange(width):
+            name = 'var_%d' % j
+            structure[name] = BaseType(name)
+        if child is not None:
+            structure[child.name] = child
+        child = structure
+    dataset = DatasetType('deep')
+    dataset[child.name] = child
+    return dataset
+
+
+def measure(n):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    dataset = wide_dataset(n)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed = timeit.timeit(lambda: wide_dataset(n), number=1)
+    cloning = timeit.timeit(dataset.clone, number=1)
+    print ('%8d variables: build %8.2f ms, clone %8.2f ms, '
+            '%8.1f MB, %6d bytes per variable' % (
+            n, 1000 * elapsed, 1000 * cloning, (after - before) / 1024.,
+            (after - before) * 1024. / n))
+
+    depth = max(1, n // 1000)
+    elapsed = timeit.timeit(lambda: deep_dataset(depth), number=1)
+    print '%8d levels of 100 variables: build %8.2f ms' % (
+            depth, 1000 * elapsed)
+
+
+def main(sizes):
+    for n in sizes:
+        subprocess.check_call([sys.executable, __file__, '--measure', str(n)])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(int(sys.argv[2]))
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
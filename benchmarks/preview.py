@@ -0,0 +1,48 @@
+"""
+Benchmark preview requests on a large grid.
+
+Compares downloading the full grid with server-side decimation and block
+averaging, reporting the time and size of the DODS responses.
+
+Usage: python benchmarks/preview.py [number of latitudes]
+
+"""
+import sys
+import time
+
+import numpy as np
+from webtest import TestApp
+
+from pydap.model import *
+from pydap.handlers.lib import BaseHandler
+from pydap.wsgi.ssf import ServerSideFunctions
+from pydap.wsgi.functions import decimate, coarsen
+
+
+QUERIES = ['sst', 'decimate(sst,10,10)', 'coarsen(sst,10,10)']
+
+
+def dataset(n):
+    dataset = DatasetType('global')
+    sst = dataset['sst'] = GridType('sst')
+    sst['sst'] = BaseType('sst', np.random.uniform(size=(n, 2 * n)).astype('f4'),
+            dimensions=('lat', 'lon'))
+    sst['lat'] = BaseType('lat', np.linspace(-90, 90, n))
+    sst['lon'] = BaseType('lon', np.linspace(0, 360, 2 * n, endpoint=False))
+    return dataset
+
+
+def main(n):
+    app = ServerSideFunctions(BaseHandler(dataset(n)))
+    app.functions = dict(ServerSideFunctions.functions,
+            decimate=decimate, coarsen=coarsen)
+    app = TestApp(app)
+    for query in QUERIES:
+        start = time.time()
+        body = app.get('/.dods?' + query).body
+        print '%8d x %d, %-20s %8.2f ms, %10d bytes' % (
+                n, 2 * n, query, 1000 * (time.time() - start), len(body))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else 2000)
@@ -0,0 +1,90 @@
+"""
+Benchmark server-side reductions on data read from disk.
+
+Compares reading the whole array with `np.mean`, as the `mean` function
+used to do, with the block reductions over the time axis. Each case is measured in a separate
+process, so that the memory reported is the growth of the resident set.
+
+Usage: python benchmarks/reductions.py [number of time steps]
+
+"""
+import os
+import sys
+import timeit
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+
+from pydap.model import *
+from pydap.wsgi import functions
+
+
+SHAPE = (360, 720)
+
+
+class FileArray(object):
+    """
+    A float32 array in a file, reading only the slices requested.
+
+    Unlike a memmap, the data read is not kept mapped in memory.
+
+    """
+    def __init__(self, filename, shape):
+        self.filename = filename
+        self.shape = shape
+        self.dtype = np.dtype('f4')
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key += (slice(None),) * (len(self.shape) - len(key))
+        # read the span of the second axis needed from each step
+        start, stop, step = key[1].indices(self.shape[1])
+        rowsize = int(np.prod(self.shape[2:]))
+        rest = (slice(None, None, step),) + key[2:]
+        out = []
+        with open(self.filename, 'rb') as fp:
+            for i in xrange(*key[0].indices(self.shape[0])):
+                fp.seek((i * self.shape[1] + start) * rowsize * self.dtype.itemsize)
+                span = np.fromfile(fp, self.dtype, (stop - start) * rowsize)
+                out.append(span.reshape((stop - start,) + self.shape[2:])[rest])
+        return np.array(out)
+
+
+def measure(filename, steps, method, threads):
+    data = FileArray(filename, (steps,) + SHAPE)
+    var = BaseType('sst', data, dimensions=('time', 'lat', 'lon'))
+    functions.REDUCTION_THREADS = threads
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if method == 'full':
+        reduce = lambda: np.mean(var.data[:], axis=0)
+    else:
+        reduce = lambda: getattr(functions, method)(None, var, 0).data
+    elapsed = timeit.timeit(reduce, number=1)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%8d steps, %-6s %d thread(s): %8.2f ms, %8.1f MB' % (
+            steps, method, threads, 1000 * elapsed, (after - before) / 1024.)
+
+
+def main(steps):
+    fd, filename = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for i in xrange(steps):
+                fp.write(np.random.uniform(size=SHAPE).astype('f4').tostring())
+        for method, threads in [('full', 1), ('mean', 1), ('mean', 4),
+                ('std', 1), ('count', 1)]:
+            subprocess.check_call([sys.executable, __file__, '--measure',
+                    filename, str(steps), method, str(threads)])
+    finally:
+        os.unlink(filename)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]))
+    else:
+        main(int(sys.argv[1]) if sys.argv[1:] else 365)
@@ -0,0 +1,64 @@
+"""
+Benchmark selections on sequences with and without indexes.
+
+The sequence has a sorted `time` column, and a `depth` column that is only
+roughly sorted, so that its zone map skips most chunks. Scans are
+measured by disabling the indexes with `pydap.indexes.attach`.
+
+Usage: python benchmarks/selection.py [number of rows ...]
+
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from pydap.model import *
+from pydap.handlers.lib import BaseHandler, ColumnData
+from pydap.parsers import parse_ce
+from pydap.indexes import attach
+
+
+QUERIES = [
+    'cast.time,cast.depth&cast.time>=%(start)d&cast.time<%(stop)d',
+    'cast.time,cast.depth&cast.depth>%(stop)d',
+    'cast.time,cast.depth&cast.time>%(start)d&cast.depth>%(stop)d',
+]
+
+
+def dataset(n):
+    time = np.arange(n, dtype='d')
+    depth = time + np.random.uniform(0, 10, n)
+    dataset = DatasetType('profiles')
+    dataset['cast'] = SequenceType('cast')
+    dataset['cast']['time'] = BaseType('time')
+    dataset['cast']['depth'] = BaseType('depth')
+    dataset.cast.data = ColumnData([('time', time), ('depth', depth)])
+    return dataset
+
+
+def query(handler, ce):
+    dataset = handler.parse(*parse_ce(ce))
+    return np.asarray(dataset.cast.depth.data).sum()
+
+
+def main(sizes):
+    for n in sizes:
+        for indexed in [False, True]:
+            data = dataset(n)
+            if not indexed:
+                for name in data.cast.keys():
+                    attach(data.cast.data.columns, None, name)
+            handler = BaseHandler(data)
+            for ce in QUERIES:
+                ce = ce % {'start': n * 0.9, 'stop': n * 0.99}
+                query(handler, ce)  # build the indexes
+                number = max(1, 10000000 // n)
+                elapsed = timeit.timeit(lambda: query(handler, ce), number=number)
+                print '%8d rows, %s: %8.2f ms  %s' % (n,
+                        'index' if indexed else 'scan ',
+                        1000 * elapsed / number, ce.split('&', 1)[1])
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100000, 1000000, 5000000])
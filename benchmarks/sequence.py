@@ -0,0 +1,56 @@
+"""
+Benchmark constraint expressions on wide sequences.
+
+Compares sequences stored as structured arrays with `ColumnData`, for a
+query that touches only two of the columns.
+
+Usage: python benchmarks/sequence.py [number of rows ...]
+
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from pydap.model import *
+from pydap.handlers.lib import BaseHandler, ColumnData
+from pydap.parsers import parse_ce
+
+
+COLUMNS = 50
+
+
+def wide_dataset(n, columnar):
+    columns = [('var_%d' % i, np.arange(n, dtype='d')) for i in range(COLUMNS)]
+    dataset = DatasetType('wide')
+    dataset['cast'] = SequenceType('cast')
+    for name, col in columns:
+        dataset['cast'][name] = BaseType(name)
+    if columnar:
+        dataset.cast.data = ColumnData(columns)
+    else:
+        dataset.cast.data = np.rec.fromarrays(
+            [col for name, col in columns], names=[name for name, col in columns])
+    return dataset
+
+
+def query(handler, n):
+    projection, selection = parse_ce(
+        'cast.var_1,cast.var_2&cast.var_1>%d' % (n // 2))
+    dataset = handler.parse(projection, selection)
+    return np.asarray(dataset.cast.var_2.data).sum()
+
+
+def main(sizes):
+    for n in sizes:
+        for columnar in [False, True]:
+            handler = BaseHandler(wide_dataset(n, columnar))
+            number = max(1, 1000000 // n)
+            elapsed = timeit.timeit(lambda: query(handler, n), number=number)
+            print '%8d rows, %s: %8.2f ms' % (n,
+                    'columns' if columnar else 'records',
+                    1000 * elapsed / number)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 100000, 1000000])
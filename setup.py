@@ -68,9 +68,19 @@ setup(name='pydap_pdp',
         [pydap.function]
         bounds = pydap.wsgi.functions:bounds
         mean = pydap.wsgi.functions:mean
+        min = pydap.wsgi.functions:min_
+        max = pydap.wsgi.functions:max_
+        sum = pydap.wsgi.functions:sum_
+        std = pydap.wsgi.functions:std
+        count = pydap.wsgi.functions:count
+        decimate = pydap.wsgi.functions:decimate
+        coarsen = pydap.wsgi.functions:coarsen
+        overview = pydap.overviews:overview
+        subset = pydap.wsgi.functions:subset
 
         [console_scripts]
         pydap = pydap.wsgi.app:main
         dods = pydap.handlers.dap:dump
+        overviews = pydap.overviews:main
     """,
 )
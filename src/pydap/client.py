@@ -1,26 +1,67 @@
+import sys
+import mmap
+import itertools
 from urlparse import urlsplit, urlunsplit
+from multiprocessing.pool import ThreadPool
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from pydap.model import DapType
-from pydap.lib import encode
-from pydap.handlers.dap import DAPHandler, unpack_data
+from pydap.model import DapType, SequenceType
+from pydap.lib import (encode, combine_slices, fix_slice, hyperslab, get_var,
+        coalesce, subslab)
+from pydap.exceptions import ClientError
+from pydap.handlers.dap import (DAPHandler, BaseProxy, SequenceProxy,
+        MetadataCache, unpack_data, map_data, concurrent_get, prefetch)
 from pydap.parsers.dds import build_dataset
 from pydap.parsers.das import parse_das, add_attributes
 
 
-def open_url(url):
-    dataset = DAPHandler(url).dataset
+# maximum length of the URLs built when combining requests
+MAX_URL_LENGTH = 2000
+
+
+def open_url(url, cache=None, session=None):
+    """
+    Open a remote dataset.
+
+    Metadata is optionally stored in a `MetadataCache`, so that datasets can
+    be reopened without downloading and parsing the DDS and DAS again. All
+    requests are sent through `session`, if given.
+
+    """
+    dataset = DAPHandler(url, cache, session).dataset
 
     # attach server-side functions
-    dataset.functions = Functions(url)
+    dataset.functions = Functions(url, session)
 
     return dataset
 
 
-def open_file(dods, das=None):
-    with open(dods) as f:
-        dds, data = f.read().split('\nData:\n', 1)
+def open_file(dods, das=None, lazy=False):
+    """
+    Open a file with a DODS response, and optionally the DAS.
+
+    If `lazy` is true the file is memory-mapped instead of read, and data is
+    only read from disk when accessed. Arrays are exposed as big endian views
+    of the file.
+
+    """
+    marker = '\nData:\n'
+    if lazy:
+        with open(dods, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = buf.find(marker)
+        if pos == -1:
+            raise ClientError('File "%s" is not a DODS response.' % dods)
+        dataset = build_dataset(buf[:pos])
+        map_data(buf, pos + len(marker), dataset)
+    else:
+        with open(dods) as f:
+            content = f.read()
+        if marker not in content:
+            raise ClientError('File "%s" is not a DODS response.' % dods)
+        dds, data = content.split(marker, 1)
         dataset = build_dataset(dds)
         dataset.data = unpack_data(data, dataset)
 
@@ -31,8 +72,9 @@ def open_file(dods, das=None):
     return dataset
 
 
-def open_dods(url, metadata=False):
-    r = requests.get(url)
+def open_dods(url, metadata=False, session=None):
+    session = session or requests
+    r = session.get(url)
     dds, data = r.content.split('\nData:\n', 1)
     dataset = build_dataset(dds)
     dataset.data = unpack_data(data, dataset)
@@ -40,22 +82,295 @@ def open_dods(url, metadata=False):
     if metadata:
         scheme, netloc, path, query, fragment = urlsplit(url)
         dasurl = urlunsplit((scheme, netloc, path[:-4] + 'das', query, fragment))
-        das = requests.get(dasurl).text.encode('utf-8')
+        das = session.get(dasurl).text.encode('utf-8')
         add_attributes(dataset, parse_das(das))
 
     return dataset
 
 
+def fetch(dataset, reads):
+    """
+    Read data from several variables using as few requests as possible.
+
+    `reads` is a dictionary mapping variables (or their ids) to the index that
+    should be read from each one. The requests are combined in constraint
+    expressions with several variables, eg, `a[0:9],b[0:9],c`, limited by
+    `MAX_URL_LENGTH`, and downloaded concurrently. Returns a dictionary with
+    the data, using the same keys as `reads`::
+
+        >>> data = fetch(dataset, {
+        ...     dataset.temp: (0, slice(None)),
+        ...     'salt': (0, slice(None)),
+        ... })  # doctest: +SKIP
+
+    """
+    keys, slabs = [], []
+    for key, index in reads.items():
+        var = get_var(dataset, key) if isinstance(key, basestring) else key
+        if not isinstance(var.data, BaseProxy):
+            raise ClientError('Variable "%s" is not a remote array.' % var.id)
+        proxy = var.data
+        keys.append(key)
+        slabs.append(
+                (proxy, combine_slices(proxy.slice, fix_slice(index, proxy.shape))))
+
+    return dict(zip(keys, fetch_slabs(slabs)))
+
+
+def fetch_slabs(slabs):
+    """
+    Download hyperslabs from remote arrays.
+
+    `slabs` is a list of `(proxy, index)` pairs, with indexes relative to the
+    full arrays. Returns a list with the data for each hyperslab.
+
+    """
+    if not slabs:
+        return []
+
+    # build the projection for each variable, grouped by their base url and
+    # the session used to open them
+    projections = {}
+    for i, (proxy, index) in enumerate(slabs):
+        projections.setdefault((proxy.baseurl, proxy.session), []).append(
+                (i, proxy.id, proxy.id + hyperslab(index)))
+
+    # group projections in as few requests as possible; the same variable
+    # can't be requested twice in a single request
+    requests_ = []
+    for (baseurl, session), projection in projections.items():
+        scheme, netloc, path, query, fragment = urlsplit(baseurl)
+        groups = []
+        for i, id_, ce in projection:
+            for group in groups:
+                length = len(','.join([ce] + [p[2] for p in group]))
+                if (id_ not in [p[1] for p in group] and
+                        len(baseurl) + len('.dods?&') + length <= MAX_URL_LENGTH):
+                    group.append((i, id_, ce))
+                    break
+            else:
+                groups.append([(i, id_, ce)])
+
+        for group in groups:
+            url = urlunsplit((
+                    scheme, netloc, path + '.dods',
+                    ','.join(p[2] for p in group) + '&' + query,
+                    fragment)).rstrip('&')
+            requests_.append((url, session, group))
+
+    # download and unpack data
+    out = [None] * len(slabs)
+    responses = concurrent_get([url for url, session, group in requests_],
+            sessions=[session for url, session, group in requests_])
+    for (url, session, group), r in zip(requests_, responses):
+        r.raise_for_status()
+        dds, xdrdata = r.content.split('\nData:\n', 1)
+        result = build_dataset(dds)
+        result.data = unpack_data(xdrdata, result)
+        for i, id_, ce in group:
+            out[i] = get_var(result, id_).data
+
+    return out
+
+
+class Batch(object):
+    """
+    Coalesce reads from remote arrays into fewer, larger requests.
+
+    Reads are deferred until the batch is flushed, when leaving the `with`
+    block or when the first result is accessed. Identical, overlapping and
+    nearby hyperslabs from the same variable are merged into a bounding
+    hyperslab while the fraction of downloaded values that were not
+    requested is at most `waste`; each read then gets a view of the merged
+    data::
+
+        >>> with Batch(waste=0.5) as batch:  # doctest: +SKIP
+        ...     rows = [batch.read(dataset.temp, i) for i in range(10)]
+        >>> rows[0].get()  # doctest: +SKIP
+
+    Merged hyperslabs from different variables are combined in requests
+    with several variables, like `fetch`.
+
+    """
+    def __init__(self, waste=0.5):
+        self.waste = waste
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.flush()
+
+    def read(self, var, index=Ellipsis):
+        """
+        Schedule a read from a variable, returning a `BatchResult`.
+
+        """
+        proxy = var.data if isinstance(var, DapType) else var
+        if not isinstance(proxy, BaseProxy):
+            raise ClientError('Variable "%s" is not a remote array.' %
+                    getattr(var, 'id', repr(var)))
+        index = combine_slices(proxy.slice, fix_slice(index, proxy.shape))
+        result = BatchResult(self)
+        self.pending.append((proxy, index, result))
+        return result
+
+    def flush(self):
+        """
+        Download all pending reads.
+
+        """
+        pending, self.pending = self.pending, []
+
+        # group reads by variable
+        variables = {}
+        for proxy, index, result in pending:
+            variables.setdefault((proxy.baseurl, proxy.id), []).append(
+                    (proxy, index, result))
+
+        slabs, members = [], []
+        for reads in variables.values():
+            for box, positions in coalesce([index for proxy, index, result
+                    in reads], self.waste):
+                slabs.append((reads[0][0], box))
+                members.append([reads[i] for i in positions])
+
+        try:
+            downloaded = fetch_slabs(slabs)
+        except Exception:
+            # keep the error, so that results raise it when accessed
+            for proxy, index, result in pending:
+                result.error = sys.exc_info()
+            raise
+
+        for (proxy, box), reads, data in zip(slabs, members, downloaded):
+            for proxy, index, result in reads:
+                result.value = data[subslab(box, index)]
+
+
+class BatchResult(object):
+    """
+    The result of a read scheduled in a `Batch`.
+
+    """
+    def __init__(self, batch):
+        self.batch = batch
+
+    def get(self):
+        """
+        Return the data, flushing the batch if necessary.
+
+        """
+        if not hasattr(self, 'value') and not hasattr(self, 'error'):
+            self.batch.flush()
+        if hasattr(self, 'error'):
+            type_, value, traceback = self.error
+            raise type_, value, traceback
+        return self.value
+
+
+class AsyncClient(object):
+    """
+    Concurrent access to remote datasets.
+
+    Datasets are opened and read from a pool of `max_connections` threads,
+    sharing a `requests.Session` so that connections are reused. Methods
+    return immediately with an `AsyncResult`, whose `get` method waits for
+    the result::
+
+        >>> with AsyncClient(max_connections=8) as client:  # doctest: +SKIP
+        ...     datasets = [client.open_url(url) for url in urls]
+        ...     data = [client.read(result.get().temp, 0) for result in datasets]
+        ...     data = [result.get() for result in data]
+
+    """
+    def __init__(self, max_connections=10, session=None, cache=None):
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                    pool_connections=max_connections, pool_maxsize=max_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.cache = cache
+        self.pool = ThreadPool(max_connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open_url(self, url, callback=None):
+        """
+        Open a remote dataset.
+
+        """
+        return self.pool.apply_async(
+                open_url, (url, self.cache, self.session), callback=callback)
+
+    def read(self, var, index=Ellipsis, callback=None):
+        """
+        Read data from a variable.
+
+        Arrays return the data for a given index; sequences return a list with
+        all the records, optionally sliced. Use `iterate` to process records
+        while they're downloaded.
+
+        """
+        return self.pool.apply_async(read, (var, index), callback=callback)
+
+    def iterate(self, var, index=Ellipsis):
+        """
+        Iterate over the records of a sequence, optionally sliced.
+
+        Records are yielded while the rest of the sequence is downloaded and
+        decoded by one of the threads of the pool.
+
+        """
+        if not isinstance(var, SequenceType):
+            raise ClientError('Variable "%s" is not a sequence.' % var.id)
+        if index is not Ellipsis:
+            var = var[index]
+        if not isinstance(var.data, SequenceProxy):
+            return iter(var.data)
+        return itertools.chain.from_iterable(
+                prefetch(var.data.batches(), pool=self.pool))
+
+    def close(self):
+        """
+        Wait for all pending requests and stop the threads.
+
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+def read(var, index=Ellipsis):
+    """
+    Read data from an array or sequence.
+
+    """
+    if isinstance(var, SequenceType):
+        if index is not Ellipsis:
+            var = var[index]
+        return list(var)
+    return var[index]
+
+
 class Functions(object):
     """
     Proxy for server-side functions.
 
     """
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, session=None):
         self.baseurl = baseurl
+        self.session = session
 
     def __getattr__(self, attr):
-        return ServerFunction(self.baseurl, attr)
+        return ServerFunction(self.baseurl, attr, self.session)
 
 
 class ServerFunction(object):
@@ -66,9 +381,10 @@ class ServerFunction(object):
     allowing nested requests to be performed on the server.
 
     """
-    def __init__(self, baseurl, name):
+    def __init__(self, baseurl, name, session=None):
         self.baseurl = baseurl
         self.name = name
+        self.session = session
 
     def __call__(self, *args):
         params = []
@@ -78,7 +394,7 @@ class ServerFunction(object):
             else:
                 params.append(encode(arg))
         id_ = self.name + '(' + ','.join(params) + ')'
-        return ServerFunctionResult(self.baseurl, id_)
+        return ServerFunctionResult(self.baseurl, id_, self.session)
 
 
 class ServerFunctionResult(object):
@@ -86,21 +402,22 @@ class ServerFunctionResult(object):
     A proxy for the result from a server-side function call.
 
     """
-    def __init__(self, baseurl, id_):
+    def __init__(self, baseurl, id_, session=None):
         self.id = id_
         self.dataset = None
+        self.session = session
 
         scheme, netloc, path, query, fragment = urlsplit(baseurl)
         self.url = urlunsplit((scheme, netloc, path + '.dods', id_, None))
 
     def __getattr__(self, name):
         if self.dataset is None:
-            self.dataset = open_dods(self.url, True)
+            self.dataset = open_dods(self.url, True, self.session)
         return getattr(self.dataset, name)
 
     def __getitem__(self, key):
         if self.dataset is None:
-            self.dataset = open_dods(self.url, True)
+            self.dataset = open_dods(self.url, True, self.session)
         return self.dataset[key]
         
 
@@ -1,3 +1,14 @@
+import os
+import sys
+import time
+import struct
+import itertools
+import marshal
+from hashlib import sha1
+from collections import deque
+from threading import Thread, Event, current_thread
+from Queue import Queue, Full
+from multiprocessing.pool import ThreadPool
 from urlparse import urlsplit, urlunsplit
 
 import numpy as np
@@ -5,31 +16,37 @@ import requests
 
 from pydap.model import *
 from pydap.lib import encode, combine_slices, fix_slice, hyperslab, START_OF_SEQUENCE, END_OF_SEQUENCE, walk
-from pydap.handlers.lib import ConstraintExpression, BaseHandler
+from pydap.handlers.lib import ConstraintExpression, BaseHandler, IterData
+from pydap import skeleton
 from pydap.parsers.dds import build_dataset
 from pydap.parsers.das import parse_das, add_attributes
 from pydap.parsers import parse_ce
+from pydap.exceptions import ClientError
 
 
 BLOCKSIZE = 512
 
+# size in bytes of the buffer window used when decoding fixed-width sequences
+BATCH_SIZE = 2**20
+
+# size in bytes of the windows downloaded when iterating over arrays, and how
+# many windows or sequence batches are downloaded ahead of the consumer
+WINDOW_SIZE = 2**24
+READ_AHEAD = 2
+
+# number of records per request, and concurrent requests, when reading
+# sequences in pages
+PAGE_SIZE = 2**16
+PAGE_WORKERS = 4
+
 
 class DAPHandler(BaseHandler):
-    def __init__(self, url):
-        # download DDS/DAS
+    def __init__(self, url, cache=None, session=None):
+        # download DDS/DAS, or load them from the cache
         scheme, netloc, path, query, fragment = urlsplit(url)
         ddsurl = urlunsplit((scheme, netloc, path + '.dds', query, fragment))
-        r = requests.get(ddsurl)
-        r.raise_for_status()
-        dds = r.text.encode('utf-8')
         dasurl = urlunsplit((scheme, netloc, path + '.das', query, fragment))
-        r = requests.get(dasurl)
-        r.raise_for_status()
-        das = r.text.encode('utf-8')
-
-        # build the dataset from the DDS and add attributes from the DAS
-        self.dataset = build_dataset(dds)
-        add_attributes(self.dataset, parse_das(das))
+        self.dataset = get_metadata(ddsurl, dasurl, cache, session)
 
         # remove any projection from the url, leaving selections
         projection, selection = parse_ce(query)
@@ -37,9 +54,9 @@ class DAPHandler(BaseHandler):
 
         # now add data proxies
         for var in walk(self.dataset, BaseType):
-            var.data = BaseProxy(url, var.id, var.descr)
+            var.data = BaseProxy(url, var.id, var.descr, session=session)
         for var in walk(self.dataset, SequenceType):
-            var.data = SequenceProxy(url, var.id, var.descr)
+            var.data = SequenceProxy(url, var.id, var.descr, session=session)
 
         # apply projections
         for var in projection:
@@ -51,13 +68,163 @@ class DAPHandler(BaseHandler):
                     target.data.slice = fix_slice(index, target.shape)
 
 
+def get_metadata(ddsurl, dasurl, cache=None, session=None):
+    """
+    Build a dataset from the DDS and the DAS.
+
+    Both responses are downloaded concurrently. If a `MetadataCache` is given
+    the dataset is returned from it while fresh, and revalidated with
+    conditional requests when stale.
+
+    """
+    entry = cache.load(ddsurl) if cache is not None else None
+    if entry is not None and time.time() - entry['time'] < cache.ttl:
+        return entry['dataset']
+
+    urls = [ddsurl, dasurl]
+    if entry is not None:
+        responses = concurrent_get(urls, entry['validators'], session)
+        if all(r.status_code == 304 for r in responses):
+            entry['time'] = time.time()
+            cache.save(ddsurl, entry)
+            return entry['dataset']
+
+        # if only one response was modified we need the other one in full
+        retry = [url for url, r in zip(urls, responses) if r.status_code == 304]
+        retried = iter(concurrent_get(retry, session=session))
+        responses = [next(retried) if r.status_code == 304 else r
+                for r in responses]
+    else:
+        responses = concurrent_get(urls, session=session)
+
+    for r in responses:
+        r.raise_for_status()
+    dds, das = [r.text.encode('utf-8') for r in responses]
+
+    # build the dataset from the DDS and add attributes from the DAS
+    dataset = build_dataset(dds)
+    add_attributes(dataset, parse_das(das))
+
+    if cache is not None:
+        cache.save(ddsurl, {
+            'time': time.time(),
+            'validators': [validators(r) for r in responses],
+            'dataset': dataset,
+        })
+
+    return dataset
+
+
+def validators(response):
+    """
+    Return headers for a conditional request, based on a previous response.
+
+    """
+    headers = {}
+    if response.headers.get('ETag'):
+        headers['If-None-Match'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        headers['If-Modified-Since'] = response.headers['Last-Modified']
+    return headers
+
+
+def concurrent_get(urls, headers=None, session=None, sessions=None):
+    """
+    Download several URLs concurrently, one thread per URL.
+
+    Requests are sent through `session`, if given, so that they can reuse its
+    connections, or through the session for each URL in `sessions`.
+
+    Returns the responses in the same order as `urls`. If any of the requests
+    fails the first exception is raised again.
+
+    """
+    headers = headers or [{}] * len(urls)
+    responses = [None] * len(urls)
+    errors = []
+
+    def get(i, url, headers):
+        try:
+            client = sessions[i] if sessions else session
+            responses[i] = (client or requests).get(url, headers=headers)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [Thread(target=get, args=args)
+            for args in zip(range(len(urls)), urls, headers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        type_, value, traceback = errors[0]
+        raise type_, value, traceback
+
+    return responses
+
+
+class MetadataCache(object):
+    """
+    A persistent cache for datasets built from the DDS and DAS.
+
+    Datasets are stored as skeletons in the directory `path`, keyed by the
+    URL of their DDS. Entries are used without any requests for `ttl` seconds;
+    after that they are revalidated using the ETag and Last-Modified headers
+    sent by the server::
+
+        >>> cache = MetadataCache('/tmp/pydap')  # doctest: +SKIP
+        >>> dataset = open_url('http://example.com/dataset', cache=cache)  # doctest: +SKIP
+
+    """
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def filename(self, url):
+        return os.path.join(self.path, sha1(url).hexdigest())
+
+    def load(self, url):
+        """
+        Return the cached entry for a given URL, or None.
+
+        """
+        try:
+            with open(self.filename(url), 'rb') as fp:
+                entry = marshal.load(fp)
+            if entry.get('url') != url:
+                return None
+            entry['dataset'] = skeleton.loads(entry['dataset'])
+        except Exception:
+            # missing, invalid or outdated entry
+            return None
+        return entry
+
+    def save(self, url, entry):
+        """
+        Store an entry atomically.
+
+        """
+        entry['url'] = url
+        data = dict(entry, dataset=skeleton.dumps(entry['dataset']))
+        filename = self.filename(url)
+        tmp = '%s.%d.%s' % (filename, os.getpid(), current_thread().ident)
+        with open(tmp, 'wb') as fp:
+            marshal.dump(data, fp, 2)
+        os.rename(tmp, filename)
+
+
 class BaseProxy(object):
-    def __init__(self, baseurl, id, descr, slice_=None):
+    def __init__(self, baseurl, id, descr, slice_=None, session=None):
         self.baseurl = baseurl
         self.id = id
         self.dtype = np.dtype(descr[1])
         self.shape = descr[2]
         self.slice = slice_ or tuple(slice(None) for s in self.shape) 
+        self.session = session
 
     def __repr__(self):
         return 'BaseProxy(%s)' % ', '.join(map(repr,
@@ -72,40 +239,57 @@ class BaseProxy(object):
                 self.id + hyperslab(index) + '&' + query,
                 fragment)).rstrip('&')
 
-        # download and unpack data
-        r = requests.get(url)
-        r.raise_for_status()
-        dds, data = r.content.split('\nData:\n', 1)
-        
-        if self.shape:
-            # skip size packing
+        # download and unpack data, streaming it directly to the output
+        r = (self.session or requests).get(url, stream=True)
+        try:
+            r.raise_for_status()
+            stream = StreamReader(r.iter_content(BLOCKSIZE))
+            stream.read_until('\nData:\n')
+
+            if self.shape:
+                # skip size packing
+                if self.dtype.char == 'S':
+                    stream.read(4)
+                else:
+                    stream.read(8)
+
+            # calculate array shape
+            shape = tuple(len(xrange(*s.indices(n))) for s, n in zip(index, self.shape))
+
             if self.dtype.char == 'S':
-                data = data[4:]
+                out = []
+                for word in range(np.prod(shape, dtype=int)):
+                    n = np.fromstring(stream.read(4), '>I')[0]  # read length
+                    out.append(stream.read(n))
+                    stream.read(-n % 4)
+                return np.array(out, 'S').reshape(shape)
             else:
-                data = data[8:]
-
-        # calculate array size
-        shape = tuple((s.stop-s.start)/s.step for s in index)
-        size = np.prod(shape)
-
-        if self.dtype == np.byte:
-            return np.fromstring(data[:size], 'B')
-        elif self.dtype.char == 'S':
-            out = []
-            for word in range(size):
-                n = np.fromstring(data[:4], '>I')  # read length
-                data = data[4:]
-                out.append(data[:n])
-                data = data[n + (-n % 4):]
-            return np.array(out, 'S')
-        else:
-            return np.fromstring(data, self.dtype).reshape(shape)
+                # data is kept big endian, as sent by the server; bytes are padded
+                # to 4n, but the padding is never read
+                out = np.empty(shape, self.dtype)
+                size = stream.readinto(out.reshape(-1).view('B'))
+                if size < out.nbytes:
+                    raise ClientError('Incomplete response for %s: expected %d '
+                            'bytes, got %d.' % (self.id, out.nbytes, size))
+                return out
+        finally:
+            # release the connection back to the pool, even if the payload
+            # was not fully read
+            r.close()
 
     def __len__(self):
         return self.shape[0]
 
     def __iter__(self):
-        return iter(self[:])
+        if not self.shape:
+            return iter(self[:])
+
+        # download windows along the first axis in the background
+        count = [len(xrange(*s.indices(n))) for s, n in zip(self.slice, self.shape)]
+        size = max(1, self.dtype.itemsize * int(np.prod(count[1:])))
+        step = max(1, WINDOW_SIZE // size)
+        windows = (self[i:i+step] for i in xrange(0, count[0], step))
+        return itertools.chain.from_iterable(prefetch(windows))
 
     # Comparisons return a boolean array
     def __eq__(self, other): return self[:] == other
@@ -120,45 +304,103 @@ class SequenceProxy(object):
 
     shape = ()
 
-    def __init__(self, baseurl, id, descr, selection=None, slice_=None):
+    def __init__(self, baseurl, id, descr, selection=None, slice_=None,
+            session=None):
         self.baseurl = baseurl
         self.id = id
         self.descr = descr
-        self.dtype = np.dtype(descr[1])
+        self.dtype = np.dtype(fix(descr[1]))
         self.selection = selection or []
         self.slice = slice_ or (slice(None),)
+        self.session = session
 
     def __repr__(self):
         return 'SequenceProxy(%s)' % ', '.join(map(repr,
             [self.baseurl, self.id, self.descr, self.selection, self.slice]))
 
     def __iter__(self):
+        # download and decode records in the background
+        return itertools.chain.from_iterable(prefetch(self.batches()))
+
+    def paged(self, size=PAGE_SIZE, workers=PAGE_WORKERS):
+        """
+        Iterate over records, downloading pages of `size` records concurrently.
+
+        Up to `workers` pages are downloaded and decoded in parallel, each in
+        its own request, while records are yielded in order. No more pages are
+        requested once a page comes back short.
+
+        """
+        count = None
+        if self.slice[0].stop is not None:
+            count = len(xrange(
+                    self.slice[0].start or 0, self.slice[0].stop,
+                    self.slice[0].step or 1))
+
+        def download(page):
+            return list(page.batches())
+
+        def windows():
+            for i in itertools.count():
+                if count is not None and i*size >= count:
+                    return
+                yield self[i*size:(i+1)*size]
+
+        pool = ThreadPool(workers)
+        try:
+            pending = deque()
+            pages = windows()
+            for page in itertools.islice(pages, workers):
+                pending.append(pool.apply_async(download, (page,)))
+
+            while pending:
+                batches = pending.popleft().get()
+                for batch in batches:
+                    for record in batch:
+                        yield record
+
+                if sum(len(batch) for batch in batches) < size:
+                    return
+                for page in itertools.islice(pages, 1):
+                    pending.append(pool.apply_async(download, (page,)))
+        finally:
+            # don't wait for pages still pending if the consumer stops early
+            pool.terminate()
+
+    def batches(self):
+        """
+        Download the sequence, yielding batches of records.
+
+        """
         scheme, netloc, path, query, fragment = urlsplit(self.baseurl)
         if isinstance(self.descr[1], list):
-            id = ','.join('%s.%s' % (self.id, d[0]) for d in self.descr[1])
+            sequence, children = self.id, [d[0] for d in self.descr[1]]
         else:
-            id = self.id
+            sequence, child = self.id.rsplit('.', 1)
+            children = [child]
+
+        # the hyperslab applies to the sequence, not to the children
+        projection = ','.join('%s%s.%s' % (sequence, hyperslab(self.slice), child)
+                for child in children)
         url = urlunsplit((
                 scheme, netloc, path + '.dods',
-                id + hyperslab(self.slice) + '&' + '&'.join(self.selection),
+                projection + '&' + '&'.join(self.selection),
                 fragment)).rstrip('&')
 
         # download and unpack data
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
-        stream = StreamReader(r.iter_content(BLOCKSIZE))
+        r = (self.session or requests).get(url, stream=True)
+        try:
+            r.raise_for_status()
+            stream = StreamReader(r.iter_content(BLOCKSIZE))
 
-        # strip dds response
-        marker = '\nData:\n'
-        buf = []
-        while ''.join(buf) != marker:
-            chunk = stream.read(1)
-            if not chunk:
-                break
-            buf.append(chunk)
-            buf = buf[-len(marker):]
+            # strip dds response
+            stream.read_until('\nData:\n')
 
-        return unpack_sequence(stream, self.descr)
+            for batch in unpack_batches(stream, self.descr):
+                yield batch
+        finally:
+            # release the connection back to the pool
+            r.close()
 
     def __getitem__(self, key):
         out = self.clone()
@@ -192,7 +434,7 @@ class SequenceProxy(object):
 
     def clone(self):
         return self.__class__(self.baseurl, self.id, self.descr,
-                self.selection[:], self.slice[:])
+                self.selection[:], self.slice[:], self.session)
 
     def __eq__(self, other): return ConstraintExpression('%s=%s' % (self.id, encode(other)))
     def __ne__(self, other): return ConstraintExpression('%s!=%s' % (self.id, encode(other)))
@@ -202,6 +444,62 @@ class SequenceProxy(object):
     def __lt__(self, other): return ConstraintExpression('%s<%s' % (self.id, encode(other)))
 
 
+def prefetch(iterable, size=READ_AHEAD, pool=None):
+    """
+    Iterate over `iterable` in a background thread, or in a `pool` of threads.
+
+    Up to `size` items are kept in a queue, so that the consumer can process
+    an item while the next ones are being downloaded. Exceptions raised in the
+    thread are raised again in the consumer.
+
+        >>> list(prefetch(xrange(5)))
+        [0, 1, 2, 3, 4]
+
+    """
+    queue = Queue(size)
+    done = Event()
+    end = object()
+
+    def put(item):
+        # stop waiting if the consumer has gone away
+        while not done.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((end, sys.exc_info()))
+        else:
+            put((end, None))
+
+    if pool is None:
+        thread = Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+    else:
+        pool.apply_async(worker)
+
+    try:
+        while True:
+            item, error = queue.get()
+            if item is end:
+                if error is not None:
+                    type_, value, traceback = error
+                    raise type_, value, traceback
+                return
+            yield item
+    finally:
+        done.set()
+
+
 class StreamReader(object):
     """
     Class to allow reading and peeking a `urllib3.HTTPResponse`.
@@ -227,12 +525,64 @@ class StreamReader(object):
 
         """
         if n > len(self.buf):
+            # accumulate chunks in a list, since concatenating strings is
+            # quadratic when reading large windows
+            chunks = [self.buf]
+            size = len(self.buf)
             for chunk in self.stream:
-                self.buf += chunk
-                if len(self.buf) >= n:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= n:
                     break
+            self.buf = ''.join(chunks)
         return self.buf[:n]
 
+    def read_until(self, marker):
+        """
+        Read the stream up to `marker`, consuming it.
+
+        Returns the data before the marker, or everything left in the stream
+        if the marker is not found.
+
+        """
+        pos = self.buf.find(marker)
+        while pos == -1:
+            n = len(self.buf)
+            if len(self.peek(n + BLOCKSIZE)) == n:
+                # stream is exhausted
+                out, self.buf = self.buf, ''
+                return out
+            pos = self.buf.find(marker, max(0, n - len(marker) + 1))
+
+        out = self.buf[:pos]
+        self.buf = self.buf[pos+len(marker):]
+        return out
+
+    def readinto(self, out):
+        """
+        Read bytes from the stream directly into the Numpy byte array `out`.
+
+        Returns the number of bytes read, which is smaller than the size of
+        `out` only if the stream is exhausted.
+
+        """
+        n = len(out)
+        pos = min(n, len(self.buf))
+        out[:pos] = np.frombuffer(self.buf, 'B', pos)
+        self.buf = self.buf[pos:]
+
+        if pos < n:
+            for chunk in self.stream:
+                size = min(len(chunk), n - pos)
+                out[pos:pos+size] = np.frombuffer(chunk, 'B', size)
+                pos += size
+                if size < len(chunk):
+                    self.buf = chunk[size:]
+                if pos == n:
+                    break
+
+        return pos
+
 
 def apply_to_list(func, descr):
     """
@@ -251,25 +601,33 @@ def unpack_sequence(buf, descr):
     """
     Unpack data from a sequence.
 
+    """
+    for batch in unpack_batches(buf, descr):
+        for rec in batch:
+            yield rec
+
+
+def unpack_batches(buf, descr):
+    """
+    Unpack data from a sequence in batches of records.
+
+    Fixed-width sequences are decoded in bulk by `unpack_records`, yielding
+    Numpy arrays; other sequences are decoded record by record, yielding lists
+    with a single record.
+
     """
     name, dtype, shape = descr
 
     # is this a sequence or a sequence child?
     sequence = isinstance(dtype, list)
 
-    # if there are no strings and no nested sequences we can
-    # unpack record by record easily
-    simple = all(isinstance(d, basestring) and 'S' not in d for d in dtype)
-
-    if simple:
+    # records with a fixed width can be unpacked in bulk
+    if fixed_width(dtype if sequence else [dtype]):
         dtype = np.dtype(fix(dtype))
-        marker = buf.read(4)
-        while marker == START_OF_SEQUENCE:
-            rec = np.fromstring(buf.read(dtype.itemsize), dtype=dtype)[0]
+        for batch in unpack_records(buf, dtype):
             if not sequence:
-                rec = rec[0]
-            yield rec
-            marker = buf.read(4)
+                batch = batch[dtype.names[0]]
+            yield batch
     else:
         marker = buf.read(4)
         while marker == START_OF_SEQUENCE:
@@ -278,10 +636,67 @@ def unpack_sequence(buf, descr):
                 rec = rec[0]
             else:
                 rec = tuple(rec)
-            yield rec
+            yield [rec]
             marker = buf.read(4)
 
 
+def fixed_width(fields):
+    """
+    Check if sequence records with the given fields have a fixed width.
+
+    This is the case if there are no strings, bytes or nested sequences; bytes
+    are excluded because XDR pads them to 4 bytes.
+
+    """
+    return all(isinstance(d[1], basestring) and
+            np.dtype(d[1]).char not in 'SB' and not d[2] for d in fields)
+
+
+def unpack_records(buf, dtype, size=BATCH_SIZE):
+    """
+    Unpack fixed-width sequence records in bulk.
+
+    Each record is preceded by a 4 byte marker, so records are found at a
+    fixed stride in the stream. The function reads windows of `size` bytes,
+    checks the markers using a strided view and yields arrays with all the
+    records found before the `END_OF_SEQUENCE` marker.
+
+        >>> data = ''.join(START_OF_SEQUENCE + np.array(i, '>i').tostring()
+        ...     for i in range(5)) + END_OF_SEQUENCE
+        >>> buf = StreamReader(iter(data))
+        >>> dtype = np.dtype([('a', '>i')])
+        >>> for batch in unpack_records(buf, dtype, size=16):
+        ...     print batch['a']
+        [0 1]
+        [2 3]
+        [4]
+
+    """
+    record = np.dtype([('marker', '>I'), ('data', dtype)])
+    start = np.fromstring(START_OF_SEQUENCE, '>I')[0]
+    count = max(1, size // record.itemsize)
+    while True:
+        window = buf.peek(count * record.itemsize)
+        n = len(window) // record.itemsize
+        if n == 0:
+            # the last marker; this should be `END_OF_SEQUENCE`
+            buf.read(4)
+            return
+
+        records = np.frombuffer(window, record, n)
+        valid = records['marker'] == start
+        if valid.all():
+            buf.read(n * record.itemsize)
+            yield records['data'].copy()
+        else:
+            # only the records before the end marker are valid
+            n = valid.argmin()
+            buf.read(n * record.itemsize + 4)
+            if n:
+                yield records['data'][:n].copy()
+            return
+
+
 def unpack_children(buf, descr):
     """
     Unpack sequence children.
@@ -332,7 +747,164 @@ def unpack_data(xdrdata, dataset):
     Unpack a string of encoded data.
 
     """
-    return unpack_children(StreamReader(iter(xdrdata)), dataset.descr)
+    return unpack_children(StreamReader(iter([xdrdata])), dataset.descr)
+
+
+def map_data(buf, offset, dataset):
+    """
+    Map data from a buffer, like a memory-mapped file, to a dataset.
+
+    The XDR layout of the data starting at `offset` is scanned once, and each
+    variable gets its data as a lazy view of the buffer: numeric arrays are
+    big endian Numpy arrays sharing the buffer memory, fixed-width sequences
+    are strided record arrays, and other sequences and string arrays are
+    decoded only when accessed.
+
+    """
+    map_var(buf, offset, dataset)
+    return dataset
+
+
+def map_var(buf, pos, var, assign=True):
+    """
+    Scan the data for a variable starting at `pos`, returning its end.
+
+    If `assign` is true data views are assigned to the variable; this is not
+    done for sequence children, since sequences set the data of children.
+
+    """
+    if isinstance(var, SequenceType):
+        start = pos
+        if fixed_width(var.descr[1]):
+            dtype = np.dtype(fix(var.descr[1]))
+            n, pos = map_records(buf, pos, dtype)
+            record = np.dtype([('marker', '>I'), ('data', dtype)])
+            data = np.ndarray((n,), record, buf, start)['data']
+        else:
+            while buf[pos:pos+4] == START_OF_SEQUENCE:
+                pos += 4
+                for child in var.children():
+                    pos = map_var(buf, pos, child, False)
+            pos += 4
+            data = MappedSequence(var.id, var.keys(), buf, start, pos, var.descr,
+                    tuple(var.keys()))
+        if assign:
+            var.data = data
+        return pos
+
+    elif isinstance(var, StructureType):
+        for child in var.children():
+            pos = map_var(buf, pos, child, assign)
+        return pos
+
+    name, dtype, shape = var.descr
+    dtype = np.dtype(dtype)
+    if dtype.char == 'S':
+        if shape:
+            pos += 4  # skip size packing
+        size = int(np.prod(shape))
+        offsets = np.empty(size, int)
+        lengths = np.empty(size, int)
+        for i in xrange(size):
+            lengths[i], = struct.unpack_from('>I', buf, pos)
+            offsets[i] = pos + 4
+            pos += 4 + lengths[i] + (-lengths[i] % 4)
+        data = MappedStrings(buf, offsets.reshape(shape), lengths.reshape(shape))
+    elif dtype.char == 'B' and not shape:
+        data = np.ndarray((), dtype, buf, pos)
+        pos += 4
+    else:
+        if shape:
+            pos += 8  # skip size packing
+        data = np.ndarray(shape, dtype, buf, pos)
+        pos += data.nbytes + (-data.nbytes % 4)
+
+    if assign:
+        var.data = data
+    return pos
+
+
+def map_records(buf, pos, dtype, size=BATCH_SIZE):
+    """
+    Find fixed-width sequence records starting at `pos`.
+
+    Returns the number of records and the position after the sequence.
+
+    """
+    record = np.dtype([('marker', '>I'), ('data', dtype)])
+    start = np.fromstring(START_OF_SEQUENCE, '>I')[0]
+    count = max(1, size // record.itemsize)
+    n = 0
+    while True:
+        offset = pos + n * record.itemsize
+        window = min(count, (len(buf) - offset) // record.itemsize)
+        markers = np.ndarray((window,), record, buf, offset)['marker']
+        valid = markers == start
+        if valid.all() and window:
+            n += window
+        else:
+            n += valid.argmin() if window else 0
+            return n, pos + n * record.itemsize + 4
+
+
+class MappedStrings(object):
+    """
+    A lazy array of strings stored in a buffer.
+
+    Strings are decoded only when the array is indexed or iterated.
+
+    """
+    def __init__(self, buf, offsets, lengths):
+        self.buf = buf
+        self.offsets = offsets
+        self.lengths = lengths
+        self.shape = offsets.shape
+
+    @property
+    def dtype(self):
+        return np.dtype('S%d' % max(1, self.lengths.max() if self.lengths.size else 1))
+
+    def __getitem__(self, index):
+        offsets = self.offsets[index]
+        lengths = self.lengths[index]
+        words = [self.buf[i:i+n] for i, n in zip(offsets.flat, lengths.flat)]
+        if not offsets.shape:
+            return words[0]
+        return np.array(words, self.dtype).reshape(offsets.shape)
+
+    def __array__(self, dtype=None):
+        return self[...] if self.shape else np.array(self[...])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self[...])
+
+
+class MappedSequence(IterData):
+    """
+    Sequence data stored in a buffer, decoded when iterated.
+
+    """
+    def __init__(self, id, vars, buf, start, end, descr, cols=None,
+            selection=None, slice_=None):
+        IterData.__init__(self, id, vars, cols, selection, slice_)
+        self.buf = buf
+        self.start = start
+        self.end = end
+        self.descr = descr
+
+    def gen(self):
+        chunks = (self.buf[i:min(i+BATCH_SIZE, self.end)]
+                for i in xrange(self.start, self.end, BATCH_SIZE))
+        for record in unpack_sequence(StreamReader(chunks), self.descr):
+            yield list(record)
+
+    def clone(self):
+        return self.__class__(self.id, self.vars[:], self.buf, self.start,
+            self.end, self.descr, self.cols[:], self.selection[:],
+            self.slice[:])
 
 
 def fix(descr):
@@ -350,16 +922,282 @@ def fix(descr):
         return descr
 
 
-def dump():
-    import sys
-    import pprint
+def dump(argv=None):
+    """
+    Print the data from a DODS response read from stdin or a file.
 
-    dods = sys.stdin.read()
-    dds, xdrdata = dods.split('\nData:\n', 1)
-    dataset = build_dataset(dds)
-    data = unpack_data(xdrdata, dataset)
+    The response is decoded while it's read, so that large responses can be
+    inspected or converted in constant memory.
 
-    pprint.pprint(data)
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Decode the data from a DODS response.')
+    parser.add_argument('input', nargs='?', type=argparse.FileType('rb'),
+        default=sys.stdin, help='file with the response (default: stdin)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-s', '--summary', action='store_true',
+        help='print shapes, ranges and record counts instead of the data')
+    group.add_argument('-o', '--output',
+        help='write the data to a .npy or .npz file')
+    args = parser.parse_args(argv)
+
+    buf = StreamReader(iter(lambda: args.input.read(BATCH_SIZE), ''))
+    dataset = build_dataset(buf.read_until('\nData:\n'))
+    variables = iter_data(buf, dataset)
+
+    if args.output is None:
+        for var, data in variables:
+            if args.summary:
+                print summarize(var, data)
+            else:
+                print_data(var, data)
+    elif args.output.endswith('.npy'):
+        if len(list(leaves(dataset))) != 1:
+            parser.error('a .npy file holds a single variable; use .npz')
+        var, data = next(variables)
+        if npy_descr(var) is None:
+            parser.error('%s cannot be stored in a .npy file' % var.id)
+        with open(args.output, 'wb') as fp:
+            write_npy(fp, var, data)
+    elif args.output.endswith('.npz'):
+        for id_ in write_npz(args.output, variables):
+            sys.stderr.write('Skipping %s: not supported in .npz files\n' % id_)
+    else:
+        parser.error('the output must be a .npy or .npz file')
+
+
+def leaves(var):
+    """
+    Yield the variables holding data, in the order they are encoded.
+
+    """
+    if isinstance(var, SequenceType) or not isinstance(var, StructureType):
+        yield var
+    else:
+        for child in var.children():
+            for leaf in leaves(child):
+                yield leaf
+
+
+def iter_data(buf, dataset):
+    """
+    Decode the data of a dataset progressively from a stream.
+
+    Yields pairs of variables and iterators over their data: flat blocks of
+    values for arrays, and batches of records for sequences. Data left
+    unread by the consumer is skipped before moving to the next variable.
+
+    """
+    for var in leaves(dataset):
+        if isinstance(var, SequenceType):
+            data = unpack_batches(buf, var.descr)
+        else:
+            data = iter_blocks(buf, var)
+        yield var, data
+        for block in data:
+            pass
+
+
+def iter_blocks(buf, var, size=BATCH_SIZE):
+    """
+    Decode the data of a `BaseType` in blocks of about `size` bytes.
+
+    Blocks are flat Numpy arrays holding a whole number of rows along the
+    last axis.
+
+    """
+    name, dtype, shape = var.descr
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+
+    if dtype.char == 'S':
+        if shape:
+            buf.read(4)  # skip size packing
+        row = shape[-1] if shape else 1
+        block, nbytes = [], 0
+        for i in xrange(count):
+            n, = struct.unpack('>I', buf.read(4))
+            block.append(buf.read(n))
+            buf.read(-n % 4)
+            nbytes += n
+            if nbytes >= size and len(block) % row == 0:
+                yield np.array(block)
+                block, nbytes = [], 0
+        if block:
+            yield np.array(block)
+
+    elif dtype.char == 'B' and not shape:
+        data = np.fromstring(buf.read(1), dtype)
+        buf.read(3)
+        yield data
+
+    else:
+        if shape:
+            buf.read(8)  # skip size packing
+        row = shape[-1] if shape else 1
+        step = max(1, size // max(1, row * dtype.itemsize)) * row
+        for start in xrange(0, count, step):
+            out = np.empty(min(step, count - start), dtype)
+            if buf.readinto(out.view('B')) < out.nbytes:
+                raise ClientError('Incomplete response for %s.' % var.id)
+            yield out
+        buf.read(-count * dtype.itemsize % 4)
+
+
+def print_data(var, data):
+    """
+    Print the data of a variable, one row or record per line.
+
+    """
+    print var.id
+    if isinstance(var, SequenceType):
+        for batch in data:
+            for record in batch:
+                print '   ', tuple(record)
+    else:
+        name, dtype, shape = var.descr
+        row = shape[-1] if shape else 1
+        for block in data:
+            for values in block.reshape(-1, row).tolist():
+                print '   ', ', '.join(map(repr, values))
+
+
+def summarize(var, data):
+    """
+    Return a one line summary of the data of a variable.
+
+    """
+    if isinstance(var, SequenceType):
+        count, ranges = 0, {}
+        for batch in data:
+            count += len(batch)
+            if isinstance(batch, np.ndarray) and batch.dtype.names:
+                for name in batch.dtype.names:
+                    update_range(ranges, name, batch[name])
+        fields = ['%s %s..%s' % ((name,) + ranges[name])
+                for name in var.keys() if name in ranges]
+        return '%s: %d records%s' % (
+                var.id, count, ''.join('; ' + field for field in fields))
+
+    ranges = {}
+    for block in data:
+        if block.dtype.char != 'S':
+            update_range(ranges, var.id, block)
+    name, dtype, shape = var.descr
+    dtype = np.dtype(dtype)
+    out = '%s: shape %s, %s' % (
+            var.id, shape, 'string' if dtype.char == 'S' else dtype.str)
+    if var.id in ranges:
+        out += ', range %s..%s' % ranges[var.id]
+    return out
+
+
+def update_range(ranges, key, values):
+    """
+    Update the (min, max) pair stored in `ranges[key]` with new values.
+
+    """
+    if not len(values) or values.dtype.shape:
+        return
+    low, high = values.min(), values.max()
+    if key in ranges:
+        low, high = min(low, ranges[key][0]), max(high, ranges[key][1])
+    ranges[key] = low, high
+
+
+def npy_descr(var):
+    """
+    Return the dtype and shape of a variable in a .npy file.
+
+    Returns `None` if the variable has no fixed-width representation, like
+    strings and sequences with strings or nested sequences.
+
+    """
+    if isinstance(var, SequenceType):
+        if not fixed_width(var.descr[1]):
+            return None
+        return np.dtype(fix(var.descr[1])), (0,)
+
+    name, dtype, shape = var.descr
+    dtype = np.dtype(dtype)
+    if dtype.char == 'S':
+        return None
+    return dtype, shape
+
+
+def write_npy(fp, var, data):
+    """
+    Write the data of a variable to an open file in the .npy format.
+
+    Returns false if the variable can't be stored, see `npy_descr`.
+
+    """
+    descr = npy_descr(var)
+    if descr is None:
+        return False
+    dtype, shape = descr
+
+    start = fp.tell()
+    length = write_npy_header(fp, dtype, shape)
+    count = 0
+    for block in data:
+        fp.write(block.tostring())
+        count += len(block)
+
+    # the number of records is only known at the end
+    if isinstance(var, SequenceType):
+        end = fp.tell()
+        fp.seek(start)
+        write_npy_header(fp, dtype, (count,), length)
+        fp.seek(end)
+
+    return True
+
+
+def write_npy_header(fp, dtype, shape, length=None):
+    """
+    Write a version 1.0 .npy header, returning its length.
+
+    By default the header is padded so it can be rewritten later with a
+    larger shape.
+
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(dtype), tuple(shape))
+    if length is None:
+        length = (len(header) + 11 + 20 + 15) // 16 * 16
+    fp.write(np.lib.format.magic(1, 0))
+    fp.write(struct.pack('<H', length - 10))
+    fp.write(header.ljust(length - 11) + '\n')
+    return length
+
+
+def write_npz(path, variables):
+    """
+    Write variables to a .npz file, yielding the ids of those skipped.
+
+    Each array is written to a temporary file before being added to the
+    archive, so only one block of data is held in memory.
+
+    """
+    import zipfile
+    import tempfile
+    from contextlib import closing
+
+    with closing(zipfile.ZipFile(path, 'w', allowZip64=True)) as archive:
+        for var, data in variables:
+            fd, tmp = tempfile.mkstemp(suffix='.npy')
+            try:
+                with os.fdopen(fd, 'w+b') as fp:
+                    written = write_npy(fp, var, data)
+                if written:
+                    archive.write(tmp, var.id + '.npy')
+                else:
+                    yield var.id
+            finally:
+                os.unlink(tmp)
 
 
 if __name__ == '__main__':
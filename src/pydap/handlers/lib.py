@@ -5,8 +5,10 @@ import re
 import operator
 import itertools
 import ast
+import weakref
 from logging import debug
 from copy import copy
+from collections import OrderedDict
 
 import numpy as np
 from webob import Request
@@ -18,13 +20,29 @@ from pydap.responses.lib import load_responses
 from pydap.responses.error import ErrorResponse
 from pydap.parsers import parse_ce
 from pydap.exceptions import ConstraintExpressionError, ExtensionNotSupportedError
-from pydap.lib import walk, fix_shorthand, get_var, encode, combine_slices
+from pydap.lib import (walk, fix_shorthand, get_var, encode, combine_slices,
+        field_view, lazy_slice, LRUCache)
 from pydap.model import *
+from pydap.indexes import find_index, intersect, relative_rows
 
 
 # buffer size in bytes, for streaming data
 BUFFER_SIZE = 2**27
 
+# number of parsed constraint expressions and selections kept in memory
+CE_CACHE_SIZE = 512
+ce_cache = LRUCache(CE_CACHE_SIZE)
+selection_cache = LRUCache(CE_CACHE_SIZE)
+
+OPERATORS = {
+    '<=': operator.le,
+    '>=': operator.ge,
+    '!=': operator.ne,
+    '=': operator.eq,
+    '>': operator.gt, 
+    '<': operator.lt,
+}
+
 
 def load_handlers():
     return [ep.load() for ep in iter_entry_points("pydap.handler")]
@@ -63,7 +81,8 @@ class BaseHandler(object):
         path, response = req.path.rsplit('.', 1)
         if response == 'das':
             req.query_string = ''
-        projection, selection = parse_ce(req.query_string)
+        ce = compile_ce(req.query_string, self.dataset)
+        projection, selection = ce.projection(), ce.selection[:]
         buffer_size = environ.get('pydap.buffer_size', BUFFER_SIZE)
 
         try:
@@ -110,10 +129,10 @@ class BaseHandler(object):
         #dataset = wrap_arrayterator(dataset, buffer_size)
 
         # fix projection
-        if projection:
-            projection = fix_shorthand(projection, dataset)
-        else:
+        if not projection:
             projection = [[(key, ())] for key in dataset.keys()]
+        elif not isinstance(projection, ResolvedProjection):
+            projection = fix_shorthand(projection, dataset)
         dataset = apply_projection(projection, dataset)
 
         return dataset
@@ -122,6 +141,65 @@ class BaseHandler(object):
         pass
 
 
+class CompiledCE(object):
+    """
+    A parsed constraint expression.
+
+    The projection has shorthand names resolved against `dataset`, when
+    given, so that they're not resolved again for each request. Since
+    applying a projection consumes it, `projection()` returns a new copy on
+    each call.
+
+        >>> dataset = DatasetType('test')
+        >>> dataset['seq'] = SequenceType('seq')
+        >>> dataset['seq']['a'] = BaseType('a')
+        >>> ce = CompiledCE('a&seq.a>1', dataset)
+        >>> ce.projection()
+        [[('seq', ()), ('a', ())]]
+        >>> ce.selection
+        ['seq.a>1']
+
+    """
+    def __init__(self, query_string, dataset=None):
+        projection, self.selection = parse_ce(query_string)
+        if projection and dataset is not None:
+            projection = fix_shorthand(projection, dataset)
+        self._projection = projection
+
+        # keep a weak reference to the dataset, so that the cache doesn't
+        # keep it alive and a new dataset with the same id is detected
+        if dataset is None:
+            self.dataset = lambda: None
+        else:
+            self.dataset = weakref.ref(dataset)
+
+    def projection(self):
+        projection = [var if isinstance(var, basestring) else list(var)
+                for var in self._projection]
+        if self.dataset() is not None:
+            return ResolvedProjection(projection)
+        return projection
+
+
+class ResolvedProjection(list):
+    """
+    A projection with the shorthand notation already resolved.
+
+    """
+
+
+def compile_ce(query_string, dataset=None):
+    """
+    Return a `CompiledCE`, reusing a cached one for the same dataset.
+
+    """
+    key = id(dataset), query_string
+    ce = ce_cache.get(key)
+    if ce is None or ce.dataset() is not dataset:
+        ce = ce_cache[key] = CompiledCE(query_string, dataset)
+    return ce
+
+
 def wrap_arrayterator(dataset, size):
     """
     Wrap `BaseType` objects in an Arrayterator.
@@ -142,16 +220,61 @@ def apply_selection(selection, dataset):
     Apply a given selection to a dataset, modifying it inplace.
 
     """
+    # group conditions by the sequence they apply to
+    conditions = {}
+    for condition in selection:
+        tokens = split_selection(condition)
+        if tokens is not None and '.' in tokens[0]:
+            conditions.setdefault(tokens[0].rsplit('.', 1)[0], []).append(condition)
+
     for seq in walk(dataset, SequenceType):
-        # apply only relevant selections
-        conditions = [condition for condition in selection
-                if re.match('%s\.[^\.]+(<=|<|>=|>|=|!=)' % re.escape(seq.id), condition)]
-        for condition in conditions:
+        # apply only relevant selections, starting with those answered by
+        # indexes on the original data
+        rows, remaining = None, []
+        for condition in conditions.get(seq.id, []):
             id1, op, id2 = parse_selection(condition, dataset)
+            found = indexed_rows(seq, id1, op, id2)
+            if found is None:
+                remaining.append((id1, op, id2))
+            else:
+                rows = found if rows is None else intersect(rows, found)
+
+        if rows is not None:
+            seq.data = seq[rows].data
+        for id1, op, id2 in remaining:
             seq.data = seq[ op(id1, id2) ].data
     return dataset
 
 
+def indexed_rows(seq, id1, op, id2):
+    """
+    Find the rows of a sequence matching a selection, using an index.
+
+    Returns `None` unless the selection compares a child of the sequence to
+    a constant, and the data has an index for it; see `pydap.indexes`.
+
+    """
+    if (isinstance(id2, DapType) or not isinstance(id1, BaseType) or
+            id1.name not in seq or seq[id1.name] is not id1):
+        return None
+
+    data = seq.data
+    if isinstance(data, ColumnData) and isinstance(data.cols, tuple):
+        columns, names, current = data.columns, data.columns, data.index
+    elif isinstance(data, np.ndarray) and data.dtype.names:
+        columns, names, current = data, data.dtype.names, None
+    else:
+        return None
+    if id1.name not in names:
+        return None
+
+    index = find_index(columns, id1.name)
+    rows = index and index.rows(columns[id1.name], op, id2)
+    if rows is None:
+        return None
+    return relative_rows(rows, current)
+
+
 def apply_projection(projection, dataset):
     """
     Apply a given projection to a dataset.
@@ -161,6 +284,7 @@ def apply_projection(projection, dataset):
 
     """
     out = DatasetType(name=dataset.name, attributes=dataset.attributes)
+    slices = {}
 
     debug('in apply_projection')
     for var in projection:
@@ -175,40 +299,66 @@ def apply_projection(projection, dataset):
             if slice_:
                 debug("Slicing %s with slice %s", name, slice_)
                 if isinstance(candidate, BaseType):
-                    candidate.data = candidate[slice_]
+                    candidate.data = lazy_slice(candidate.data, slice_)
                 elif isinstance(candidate, SequenceType):
                     candidate = candidate[slice_[0]]
+                    slices[candidate.id] = slice_[0]
                 elif isinstance(candidate, GridType):
                     if len(candidate.maps) != len(slice_):
                         raise HTTPBadRequest("Attempt to slice grid with %d maps with slice (%s) of length %d" %
                                          (len(candidate.maps), slice_, len(slice_)))
-                    candidate = candidate[slice_]
+                    candidate = lazy_grid(candidate, slice_)
 
             # handle structures
             if isinstance(candidate, StructureType):
                 debug("instance is a StructureType")
                 # add variable to target
-                if name not in target.keys():
+                if name not in target:
                     if var:
-                        # if there are more children to add we need to clear the
-                        # candidate so it has only explicitly added children; 
-                        # also, Grids are degenerated into Structures
+                        # if there are more children to add we need an empty
+                        # copy of the candidate, so it has only explicitly added
+                        # children; also, Grids are degenerated into Structures
+                        descr = candidate.descr
                         if isinstance(candidate, GridType):
                             candidate = StructureType(candidate.name, candidate.attributes)
-                        candidate._keys = []
+                        elif isinstance(candidate, SequenceType):
+                            candidate = SequenceType(candidate.name,
+                                candidate.data, candidate.attributes)
+                        else:
+                            candidate = candidate.__class__(candidate.name,
+                                candidate.attributes)
+                        candidate.descr = descr
                     target[name] = candidate
                 target, template = target[name], template[name]
             else:
                 target[name] = candidate
 
     # fix sequence data, including only variables that are in the sequence
+    # and keeping the requested rows
     for seq in walk(out, SequenceType):
-        seq.data = get_var(dataset, seq.id)[tuple(seq.keys())].data
+        data = field_view(get_var(dataset, seq.id).data, seq.keys())
+        if seq.id in slices:
+            data = data[slices[seq.id]]
+        seq.data = data
 
     debug('out of apply_projection()')
     return out
 
 
+def lazy_grid(grid, slice_):
+    """
+    Return a copy of a grid sliced with `lazy_slice`.
+
+    Unlike `grid[slice_]` the data is only read when encoded, so this is
+    used for grids that are sent in responses.
+
+    """
+    out = grid.clone()
+    for var, s in zip(out.children(), [slice_] + list(slice_)):
+        var.data = lazy_slice(var.data, s)
+    return out
+
+
 def parse_selection(expression, dataset):
     """
     Parse a selection expression into its elements.
@@ -219,16 +369,11 @@ def parse_selection(expression, dataset):
     `ast.literal_eval`.
 
     """
-    id1, op, id2 = re.split('(<=|>=|!=|=~|>|<|=)', expression, 1)
-
-    op = {
-        '<=': operator.le,
-        '>=': operator.ge,
-        '!=': operator.ne,
-        '=': operator.eq,
-        '>': operator.gt, 
-        '<': operator.lt,
-    }[op]
+    tokens = split_selection(expression)
+    if tokens is None:
+        raise ConstraintExpressionError(
+                'Invalid selection expression: %s' % expression)
+    id1, op, id2 = tokens
 
     try:
         id1 = get_var(dataset, id1)
@@ -243,6 +388,31 @@ def parse_selection(expression, dataset):
     return id1, op, id2
 
 
+def split_selection(expression):
+    """
+    Split a selection expression into two tokens and a comparison operator.
+
+    Returns `None` if the expression is not a supported comparison, like
+    function calls. Results are cached, since the same selections are
+    usually repeated.
+
+        >>> split_selection('seq.a>=1')
+        ('seq.a', <built-in function ge>, '1')
+        >>> print split_selection('bounds(0,360)')
+        None
+
+    """
+    tokens = selection_cache.get(expression, False)
+    if tokens is False:
+        tokens = re.split('(<=|>=|!=|=~|>|<|=)', expression, 1)
+        if len(tokens) != 3 or tokens[1] not in OPERATORS:
+            tokens = None
+        else:
+            tokens = tokens[0], OPERATORS[tokens[1]], tokens[2]
+        selection_cache[expression] = tokens
+    return tokens
+
+
 class ConstraintExpression(object):
     """
     An object representing a selection on a constraint expression.
@@ -350,6 +520,175 @@ class IterData(object):
     def __lt__(self, other): return ConstraintExpression('%s<%s' % (self.id, encode(other)))
 
 
+class ColumnData(object):
+    """
+    Sequence data stored as one array per column.
+
+    Columns are shared between copies, which only track the requested columns
+    and the selected rows, either as a slice or as an array of row indexes.
+    Filters, projections and slices compose without copying any data until
+    it's read::
+
+        >>> data = ColumnData([('a', np.arange(5)), ('b', np.arange(5) * 10.)])
+        >>> subset = data[ data['a'] > 1 ]['b'][::2]
+        >>> subset.index
+        array([2, 4])
+        >>> list(subset)
+        [20.0, 40.0]
+        >>> list(data[['b', 'a']][3:])
+        [(30.0, 3), (40.0, 4)]
+
+    Only flat sequences are supported.
+
+    """
+    def __init__(self, columns, cols=None, index=None):
+        if not isinstance(columns, OrderedDict):
+            columns = OrderedDict(columns)
+        self.columns = columns
+        self.cols = tuple(columns) if cols is None else cols
+
+        # `None` for all rows, a normalized `(start, stop, step)` tuple for
+        # a slice, or an array of row indexes
+        self.index = index
+
+    @property
+    def nrows(self):
+        return len(next(self.columns.itervalues()))
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def dtype(self):
+        if isinstance(self.cols, tuple):
+            return np.dtype([(col, self.columns[col].dtype) for col in self.cols])
+        return self.columns[self.cols].dtype
+
+    def __len__(self):
+        if self.index is None:
+            return self.nrows
+        elif isinstance(self.index, tuple):
+            return len(xrange(*self.index))
+        return len(self.index)
+
+    def take(self, start, stop):
+        """
+        Return a key selecting rows `start` to `stop` from the columns.
+
+        """
+        if self.index is None:
+            return slice(start, stop)
+        elif isinstance(self.index, tuple):
+            first, last, step = self.index
+            start, stop = first + start*step, first + stop*step
+            return slice(start, stop if stop >= 0 else None, step)
+        return self.index[start:stop]
+
+    def blocks(self):
+        """
+        Iterate over the selected data, a few rows at a time.
+
+        """
+        cols = self.cols if isinstance(self.cols, tuple) else (self.cols,)
+        rowsize = sum(self.columns[col].dtype.itemsize for col in cols)
+        size = max(1, BUFFER_SIZE // max(1, rowsize))
+        length = len(self)
+        for start in xrange(0, length, size):
+            key = self.take(start, min(start + size, length))
+            yield [self.columns[col][key] for col in cols]
+
+    def __iter__(self):
+        for block in self.blocks():
+            if isinstance(self.cols, tuple):
+                rows = itertools.izip(*block)
+            else:
+                rows = block[0]
+            for row in rows:
+                yield row
+
+    def __array__(self, dtype=None):
+        key = self.take(0, len(self))
+        if isinstance(self.cols, tuple):
+            out = np.empty(len(self), self.dtype)
+            for col in self.cols:
+                out[col] = self.columns[col][key]
+        else:
+            out = self.columns[self.cols][key]
+        return out if dtype is None else out.astype(dtype)
+
+    def __getitem__(self, key):
+        # return the data for a children
+        if isinstance(key, basestring):
+            return self.__class__(self.columns, key, self.index)
+
+        # return a new object with requested columns
+        elif isinstance(key, list):
+            return self.__class__(self.columns, tuple(key), self.index)
+
+        # return a single row
+        elif isinstance(key, (int, long, np.integer)):
+            length = len(self)
+            if key < 0:
+                key += length
+            if not 0 <= key < length:
+                raise IndexError('Row index out of range.')
+            if isinstance(self.cols, tuple):
+                return tuple(self.columns[col][self.take(key, key+1)][0]
+                        for col in self.cols)
+            return self.columns[self.cols][self.take(key, key+1)][0]
+
+        return self.__class__(self.columns, self.cols, self.select(key))
+
+    def select(self, key):
+        """
+        Compose the current row selection with a slice, mask or indexes.
+
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if self.index is None:
+                return start, stop, step
+            elif isinstance(self.index, tuple):
+                first, last, stride = self.index
+                length = len(xrange(start, stop, step))
+                start = first + start*stride
+                return start, start + length*step*stride, step*stride
+            return self.index[key]
+
+        key = np.asarray(key)
+        if key.dtype == np.bool_:
+            key = np.flatnonzero(key)
+        if self.index is None:
+            return key
+        elif isinstance(self.index, tuple):
+            first, last, stride = self.index
+            return first + np.where(key < 0, key + len(self), key) * stride
+        return self.index[key]
+
+    def clone(self):
+        return self.__class__(self.columns, self.cols, self.index)
+
+    def __eq__(self, other): return np.asarray(self) == column_values(other)
+    def __ne__(self, other): return np.asarray(self) != column_values(other)
+    def __ge__(self, other): return np.asarray(self) >= column_values(other)
+    def __le__(self, other): return np.asarray(self) <= column_values(other)
+    def __gt__(self, other): return np.asarray(self) > column_values(other)
+    def __lt__(self, other): return np.asarray(self) < column_values(other)
+
+
+def column_values(value):
+    """
+    Return the values of a variable, for comparisons between columns.
+
+    """
+    if isinstance(value, BaseType):
+        value = value.data
+    if isinstance(value, ColumnData):
+        value = np.asarray(value)
+    return value
+
+
 def build_filter(selection, cols):                                              
     filters = [bool]                                                          
                                                                                 
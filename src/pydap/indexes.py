@@ -0,0 +1,390 @@
+"""
+Indexes for range selections on sequence columns.
+
+Two kinds of indexes are available. A `SortedIndex` answers range
+predicates by binary search, either directly on a sorted column or through
+a permutation that sorts it::
+
+    >>> import operator
+    >>> column = np.array([3, 1, 4, 1, 5, 9, 2, 6])
+    >>> index = SortedIndex.build(column)
+    >>> index.rows(column, operator.gt, 3)
+    array([2, 4, 5, 7])
+
+A `ZoneMap` stores the minimum and maximum of each chunk of rows, so that
+chunks that can't match are skipped, and chunks where all rows match are
+not scanned::
+
+    >>> zones = ZoneMap.build(np.arange(10), chunk=4)
+    >>> zones.rows(np.arange(10), operator.le, 5)
+    array([0, 1, 2, 3, 4, 5])
+
+A `GridIndex` groups rows by the cell of a uniform grid over two columns,
+for box queries on positions.
+
+Handlers can `attach` indexes to their data, eg, after loading them from
+files saved beside the data. Otherwise `find_index` builds them lazily: a
+`SortedIndex` for sorted columns, and a `ZoneMap` for the others.
+
+"""
+
+import operator
+import weakref
+
+import numpy as np
+
+from pydap.lib import LRUCache
+
+
+# number of rows summarized by each zone; columns smaller than this are
+# simply scanned
+CHUNK_ROWS = 2**16
+
+# average number of rows in each cell of a `GridIndex`
+BUCKET_ROWS = 256
+
+# number of columns whose indexes are kept in memory
+INDEX_CACHE_SIZE = 1024
+
+# indexes keyed by the id of the data and the column name
+indexes = LRUCache(INDEX_CACHE_SIZE)
+
+
+class SortedIndex(object):
+    """
+    Answers range predicates on a column by binary search.
+
+    For columns that are not sorted the index stores the permutation that
+    sorts them, and the sorted values.
+
+    """
+    def __init__(self, order=None, values=None):
+        self.order = order
+        self.values = values
+
+    @classmethod
+    def build(cls, column):
+        if is_sorted(column):
+            return cls()
+        order = np.argsort(column, kind='mergesort')
+        return cls(order, column[order])
+
+    def save(self, filename):
+        np.savez(filename, order=self.order, values=self.values)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(data['order'], data['values'])
+
+    def rows(self, column, op, value):
+        """
+        Return the rows where `op(column, value)` holds, or None.
+
+        Rows are returned as a slice for sorted columns, and as a sorted array
+        of indexes otherwise.
+
+        """
+        values = column if self.values is None else self.values
+        left = lambda: values.searchsorted(value, 'left')
+        right = lambda: values.searchsorted(value, 'right')
+        if op is operator.gt:
+            start, stop = right(), self._stop(values)
+        elif op is operator.ge:
+            start, stop = left(), self._stop(values)
+        elif op is operator.lt:
+            start, stop = 0, left()
+        elif op is operator.le:
+            start, stop = 0, right()
+        elif op is operator.eq:
+            start, stop = left(), right()
+        else:
+            return None
+
+        return self._rows(start, stop)
+
+    def between(self, column, low, high, closed=True):
+        """
+        Return the rows with values from `low` up to, and including if
+        `closed`, `high`.
+
+        """
+        values = column if self.values is None else self.values
+        start = values.searchsorted(low, 'left')
+        stop = values.searchsorted(high, 'right' if closed else 'left')
+        return self._rows(start, max(start, stop))
+
+    def _stop(self, values):
+        # NaNs are sorted last, and never match
+        if values.dtype.kind in 'fc':
+            return values.searchsorted(np.nan, 'left')
+        return len(values)
+
+    def _rows(self, start, stop):
+        if self.order is None:
+            return slice(start, stop)
+        return np.sort(self.order[start:stop])
+
+
+class ZoneMap(object):
+    """
+    The minimum and maximum values of each chunk of rows in a column.
+
+    """
+    def __init__(self, minimum, maximum, chunk=CHUNK_ROWS, complete=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.chunk = chunk
+        # chunks without NaNs, which never match
+        if complete is None:
+            complete = np.ones(len(minimum), bool)
+        self.complete = complete
+
+    @classmethod
+    def build(cls, column, chunk=CHUNK_ROWS):
+        starts = np.arange(0, len(column), chunk)
+        complete = None
+        if column.dtype.kind in 'fc':
+            complete = ~np.logical_or.reduceat(np.isnan(column), starts)
+        return cls(np.fmin.reduceat(column, starts),
+                np.fmax.reduceat(column, starts), chunk, complete)
+
+    def save(self, filename):
+        np.savez(filename, minimum=self.minimum, maximum=self.maximum,
+                chunk=self.chunk, complete=self.complete)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(data['minimum'], data['maximum'], int(data['chunk']),
+                data['complete'])
+
+    def rows(self, column, op, value):
+        """
+        Return the rows where `op(column, value)` holds, or None.
+
+        """
+        with np.errstate(invalid='ignore'):
+            return self._rows(column, op, value)
+
+    def _rows(self, column, op, value):
+        low, high = self.minimum, self.maximum
+        if op is operator.gt:
+            some, all_ = high > value, low > value
+        elif op is operator.ge:
+            some, all_ = high >= value, low >= value
+        elif op is operator.lt:
+            some, all_ = low < value, high < value
+        elif op is operator.le:
+            some, all_ = low <= value, high <= value
+        elif op is operator.eq:
+            some, all_ = (low <= value) & (high >= value), (low == high) & (low == value)
+        else:
+            return None
+        all_ &= self.complete
+
+        out = []
+        for i in np.flatnonzero(some):
+            start = i * self.chunk
+            stop = min(start + self.chunk, len(column))
+            if all_[i]:
+                out.append(np.arange(start, stop))
+            else:
+                out.append(start + np.flatnonzero(op(column[start:stop], value)))
+        if not out:
+            return np.array([], int)
+        return np.concatenate(out)
+
+
+class GridIndex(object):
+    """
+    Rows grouped by the cell of a uniform grid over two columns.
+
+    The rows in cell `k` are `order[offsets[k]:offsets[k+1]]`, with cells
+    numbered along `x` first. Rows with missing values are stored after the
+    last cell, and never returned::
+
+        >>> x = np.append(np.arange(16.), np.nan)
+        >>> index = GridIndex.build(x, x, rows=1)
+        >>> index.size
+        4
+        >>> index.candidates(4.5, 7.5, 4.5, 7.5)
+        array([ 4,  5,  6,  7,  8,  9, 10, 11])
+
+    """
+    def __init__(self, extent, size, order, offsets):
+        self.extent = extent
+        self.size = size
+        self.order = order
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, x, y, rows=BUCKET_ROWS):
+        valid = np.ones(len(x), bool)
+        for column in [x, y]:
+            if column.dtype.kind in 'fc':
+                valid &= ~np.isnan(column)
+        if valid.any():
+            extent = (x[valid].min(), x[valid].max(),
+                    y[valid].min(), y[valid].max())
+        else:
+            extent = (0, 0, 0, 0)
+
+        size = max(1, int(np.sqrt(valid.sum() / rows)))
+        index = cls(extent, size, None, None)
+        i = index._cells(np.where(valid, x, extent[0]), *extent[:2])
+        j = index._cells(np.where(valid, y, extent[2]), *extent[2:])
+        cells = j * size + i
+        cells[~valid] = size * size
+
+        index.order = np.argsort(cells, kind='mergesort')
+        index.offsets = cells[index.order].searchsorted(np.arange(size*size + 1))
+        return index
+
+    def save(self, filename):
+        np.savez(filename, extent=self.extent, size=self.size,
+                order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(tuple(data['extent']), int(data['size']),
+                data['order'], data['offsets'])
+
+    def _cells(self, values, low, high):
+        if high > low:
+            values = np.floor((values - low) * (self.size / float(high - low)))
+        else:
+            values = np.zeros_like(values)
+        return np.clip(values, 0, self.size - 1).astype(int)
+
+    def candidates(self, xmin, xmax, ymin, ymax):
+        """
+        Return the sorted rows in the cells overlapping a box.
+
+        Rows inside the box are a subset of these, which still need to be
+        checked.
+
+        """
+        x0, x1, y0, y1 = self.extent
+        if xmax < x0 or xmin > x1 or ymax < y0 or ymin > y1:
+            return np.array([], int)
+
+        i0, i1 = self._cells(np.array([xmin, xmax]), x0, x1)
+        j0, j1 = self._cells(np.array([ymin, ymax]), y0, y1)
+        if i0 > i1 or j0 > j1:
+            return np.array([], int)
+        rows = np.concatenate([
+            self.order[self.offsets[j*self.size + i0]:self.offsets[j*self.size + i1 + 1]]
+            for j in range(j0, j1 + 1)])
+        rows.sort()
+        return rows
+
+
+def intersect(rows1, rows2):
+    """
+    Return the rows present in both selections, as returned by indexes.
+
+        >>> intersect(slice(2, 8), slice(5, 10))
+        slice(5, 8, None)
+        >>> intersect(slice(2, 8), np.array([1, 3, 9]))
+        array([3])
+
+    """
+    if isinstance(rows1, slice) and isinstance(rows2, slice):
+        start = max(rows1.start, rows2.start)
+        return slice(start, max(start, min(rows1.stop, rows2.stop)))
+    elif isinstance(rows1, slice):
+        return rows2[(rows2 >= rows1.start) & (rows2 < rows1.stop)]
+    elif isinstance(rows2, slice):
+        return intersect(rows2, rows1)
+    return np.intersect1d(rows1, rows2)
+
+
+def relative_rows(rows, current):
+    """
+    Return the positions of `rows` in the rows currently selected.
+
+    `current` is `None` for all rows, a `(start, stop, step)` tuple or an
+    array of row indexes, like the index of `ColumnData`::
+
+        >>> relative_rows(slice(2, 5), (0, 10, 2))
+        array([1, 2])
+
+    """
+    if current is None:
+        return rows
+    if isinstance(current, tuple):
+        current = np.arange(*current)
+    if isinstance(rows, slice):
+        return np.flatnonzero((current >= rows.start) & (current < rows.stop))
+    return np.flatnonzero(np.in1d(current, rows))
+
+
+def is_sorted(column):
+    with np.errstate(invalid='ignore'):
+        return bool((column[1:] >= column[:-1]).all())
+
+
+def attach(data, index, name=None):
+    """
+    Attach an index to the column `name` of `data`.
+
+    `data` can be a structured array or the columns of a `ColumnData`, in
+    which case `name` is the column, or the column itself. Passing `None`
+    as the index disables indexing. Indexes of data that has been freed are
+    never returned, and are eventually evicted from the cache.
+
+    """
+    # no callback removes the entry when the data is freed: the garbage
+    # collector may run it while the cache lock is held by this thread
+    indexes[id(data), name] = weakref.ref(data), index
+
+
+def cached_index(data, name, build):
+    """
+    Return the index stored for `data` and `name`, or one built by `build`.
+
+    """
+    cached = indexes.get((id(data), name))
+    if cached is not None and cached[0]() is data:
+        return cached[1]
+
+    index = build()
+    try:
+        attach(data, index, name)
+    except TypeError:
+        # data can't be referenced weakly
+        pass
+    return index
+
+
+def find_index(data, name=None):
+    """
+    Return the index for a column, building it if necessary.
+
+    Returns `None` for small columns, and for those that can't be indexed.
+
+    """
+    def build():
+        column = data if name is None else data[name]
+        if len(column) < CHUNK_ROWS or column.ndim != 1:
+            return None
+        elif is_sorted(column):
+            return SortedIndex()
+        try:
+            return ZoneMap.build(column)
+        except TypeError:
+            # no minimum or maximum, eg, for strings
+            return None
+
+    return cached_index(data, name, build)
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == "__main__":
+    _test()
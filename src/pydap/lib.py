@@ -2,12 +2,20 @@ import sys
 import urllib
 import itertools
 import operator
+from fractions import gcd
+from collections import OrderedDict
+from threading import Lock
 
+import numpy as np
 import pkg_resources
 
 from pydap.exceptions import ConstraintExpressionError
 
 
+# size in bytes of the blocks read when iterating over lazy slices
+BLOCK_SIZE = 2**24
+
+
 __dap__ = '2.15'
 __version__ = pkg_resources.get_distribution("pydap_pdp").version
 
@@ -169,6 +177,18 @@ def combine_slices(slice1, slice2):
 
         x[ combine_slices(s1, s2) ] == x[s1][s2]
 
+        >>> import numpy as np
+        >>> x = np.arange(20)
+        >>> s1, s2 = (slice(2, 15, 2),), (slice(1, 4),)
+        >>> print combine_slices(s1, s2)
+        (slice(4, 10, 2),)
+        >>> assert (x[combine_slices(s1, s2)] == x[s1][s2]).all()
+        >>> s1, s2 = (slice(2, None, 3),), (slice(1, None, 2),)
+        >>> assert (x[combine_slices(s1, s2)] == x[s1][s2]).all()
+
+    Slices should have no negative indexes; they can be normalized with
+    `fix_slice`.
+
     """
     out = []
     for exp1, exp2 in itertools.izip_longest(slice1, slice2, fillvalue=slice(None)):
@@ -177,22 +197,138 @@ def combine_slices(slice1, slice2):
         if isinstance(exp2, int):
             exp2 = slice(exp2, exp2+1)
 
-        start = (exp1.start or 0) + (exp2.start or 0)
-        step = (exp1.step or 1) * (exp2.step or 1)
+        start1 = exp1.start or 0
+        step1 = exp1.step or 1
+        start = start1 + step1 * (exp2.start or 0)
+        step = step1 * (exp2.step or 1)
 
-        if exp1.stop is None and exp2.stop is None:
-            stop = None
-        elif exp1.stop is not None:
+        if exp2.stop is None:
             stop = exp1.stop
-        elif exp2.stop is not None:
-            stop = (exp1.start or 0) + exp2.stop
         else:
-            stop = min(exp1.stop, (exp1.start or 0) + exp2.stop)
+            stop = start1 + step1 * exp2.stop
+            if exp1.stop is not None:
+                stop = min(exp1.stop, stop)
 
         out.append(slice(start, stop, step))
     return tuple(out)
 
 
+def lazy_slice(data, slice_):
+    """
+    Slice array-like data, deferring the read when possible.
+
+    Slices with positive steps return a `LazySlice`, which reports its shape
+    without reading any data; other indexes are applied immediately::
+
+        >>> x = np.arange(20).reshape(4, 5)
+        >>> view = lazy_slice(x, (slice(1, None), slice(2, 3)))
+        >>> view = lazy_slice(view, slice(None, None, 2))
+        >>> view.shape
+        (2, 1)
+        >>> view.slice
+        (slice(1, 4, 2), slice(2, 3, 1))
+        >>> print view[:]
+        [[ 7]
+         [17]]
+        >>> print lazy_slice(x, 1)
+        [5 6 7 8 9]
+
+    """
+    if not isinstance(slice_, tuple):
+        slice_ = (slice_,)
+    shape = getattr(data, 'shape', None)
+
+    # integers remove dimensions, so only slices are applied lazily
+    lazy = shape is not None and len(
+        [s for s in slice_ if s is not Ellipsis]) <= len(shape)
+    for s in slice_:
+        if not (s is Ellipsis or
+                (isinstance(s, slice) and (s.step is None or s.step > 0))):
+            lazy = False
+    if not lazy:
+        return data[slice_]
+
+    slice_ = fix_slice_bounds(slice_, shape)
+    if isinstance(data, LazySlice):
+        return LazySlice(data.data, combine_slices(data.slice, slice_))
+    return LazySlice(data, slice_)
+
+
+def fix_slice_bounds(slice_, shape):
+    """
+    Normalize a slice with `fix_slice`, limiting its bounds to `shape`.
+
+    """
+    out = []
+    for s, n in zip(fix_slice(slice_, shape), shape):
+        start = min(s.start, n)
+        out.append(slice(start, max(start, min(s.stop, n)), s.step))
+    return tuple(out)
+
+
+class LazySlice(object):
+    """
+    A slice of array-like data, read only when needed.
+
+    The data is read when the object is indexed or converted to an array,
+    or a block at a time when iterating over it. New lazy slices are created
+    with `lazy_slice`.
+
+    """
+    def __init__(self, data, slice_):
+        self.data = data
+        self.slice = slice_
+
+    def __repr__(self):
+        return 'LazySlice(%r, %r)' % (self.data, self.slice)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def shape(self):
+        return tuple(len(xrange(s.start, s.stop, s.step)) for s in self.slice)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self):
+        return np.asarray(self.data[self.slice])
+
+    def __array__(self, dtype=None):
+        out = self.read()
+        return out if dtype is None else out.astype(dtype)
+
+    def __getitem__(self, key):
+        out = lazy_slice(self, key)
+        return out.read() if isinstance(out, LazySlice) else out
+
+    def blocks(self, size=None):
+        """
+        Read the data in blocks of about `size` bytes along the first axis.
+
+        """
+        if not self.slice:
+            yield self.read()
+            return
+
+        size = size or BLOCK_SIZE
+        first, rest = self.slice[0], self.slice[1:]
+        rowsize = self.dtype.itemsize * int(np.prod(self.shape[1:]))
+        step = max(1, size // max(1, rowsize))
+        for i in xrange(0, len(self), step):
+            start = first.start + i * first.step
+            stop = min(first.stop, start + step * first.step)
+            block = (slice(start, stop, first.step),) + rest
+            yield np.asarray(self.data[block])
+
+    def __iter__(self):
+        for block in self.blocks():
+            for row in block:
+                yield row
+
+
 def hyperslab(slice_):
     """
     Build an Opendap representation of a multidimensional slice.
@@ -210,6 +346,106 @@ def hyperslab(slice_):
         s.start or 0, s.step or 1, (s.stop or sys.maxint)-1) for s in slice_)
 
 
+def bounding_slab(slabs):
+    """
+    Return the smallest hyperslab containing all the given hyperslabs.
+
+    Hyperslabs should be normalized by `combine_slices`, with positive steps::
+
+        >>> print bounding_slab([
+        ...     (slice(0, 1, 1), slice(2, 8, 2)),
+        ...     (slice(3, 4, 1), slice(4, 10, 2))])
+        (slice(0, 4, 3), slice(2, 9, 2))
+
+    """
+    out = []
+    for dim in zip(*slabs):
+        start = min(s.start for s in dim)
+        stop = max(s.start + s.step * (len(xrange(s.start, s.stop, s.step)) - 1)
+                for s in dim) + 1
+        # the step must hit all values requested
+        step = reduce(gcd, [s.step for s in dim if s.stop - s.start > s.step] +
+                [s.start - start for s in dim], 0)
+        out.append(slice(start, stop, step or 1))
+    return tuple(out)
+
+
+def slab_size(slab):
+    """
+    Return the number of values in a hyperslab.
+
+    """
+    size = 1
+    for s in slab:
+        size *= len(xrange(s.start, s.stop, s.step))
+    return size
+
+
+def coalesce(slabs, waste=0.5):
+    """
+    Merge hyperslabs from the same array into bounding hyperslabs.
+
+    Hyperslabs are merged while the fraction of values in the bounding
+    hyperslab that were not requested is at most `waste`. Returns a list of
+    bounding hyperslabs, each with the positions of the hyperslabs it
+    contains::
+
+        >>> slabs = [(slice(1, 2, 1),), (slice(0, 1, 1),), (slice(9, 10, 1),)]
+        >>> for box, members in coalesce(slabs):
+        ...     print box, members
+        (slice(0, 2, 1),) [1, 0]
+        (slice(9, 10, 1),) [2]
+        >>> len(coalesce(slabs, waste=0.8))
+        1
+
+    Identical hyperslabs are requested only once. Overlapping hyperslabs are
+    counted fully, so waste is never overestimated.
+
+    """
+    order = sorted(range(len(slabs)), key=lambda i: [s.start for s in slabs[i]])
+
+    out = []
+    for i in order:
+        slab = slabs[i]
+        # hyperslabs with negative steps or no data are never merged
+        if any(s.step < 1 for s in slab) or not slab_size(slab):
+            out.append((slab, [i], []))
+            continue
+
+        # since hyperslabs are sorted, try to merge with the last group
+        if out and out[-1][2]:
+            box, members, unique = out[-1]
+            if slab in unique:
+                members.append(i)
+                continue
+            candidate = bounding_slab([box, slab])
+            useful = sum(slab_size(s) for s in unique) + slab_size(slab)
+            if useful >= (1 - waste) * slab_size(candidate):
+                out[-1] = (candidate, members + [i], unique + [slab])
+                continue
+        out.append((slab, [i], [slab]))
+
+    return [group[:2] for group in out]
+
+
+def subslab(box, slab):
+    """
+    Return the index of a hyperslab in the data of a bounding hyperslab.
+
+        >>> box = (slice(0, 10, 2),)
+        >>> print subslab(box, (slice(4, 10, 4),))
+        (slice(2, 6, 2),)
+
+    """
+    out = []
+    for b, s in zip(box, slab):
+        n = len(xrange(s.start, s.stop, s.step))
+        # the step of a single value may not be a multiple of the box step
+        offset, step = (s.start - b.start) // b.step, max(1, s.step // b.step)
+        out.append(slice(offset, offset + n * step, step))
+    return tuple(out)
+
+
 def walk(var, type=object):
     """
     Yield all variables of a given type from a dataset.
@@ -232,9 +468,10 @@ def fix_shorthand(projection, dataset):
     the "shorthand notation", and it has to be fixed.
 
     """
+    keys = set(dataset.keys())
     out = []
     for var in projection:
-        if len(var) == 1 and var[0][0] not in dataset.keys():
+        if len(var) == 1 and var[0][0] not in keys:
             token, slice_ = var.pop(0)
             for child in walk(dataset):
                 if token == child.name:
@@ -255,6 +492,90 @@ def get_var(dataset, id_):
     return reduce(operator.getitem, [dataset] + tokens)
 
 
+def field_view(data, names):
+    """
+    Select fields from sequence data, without copying structured arrays.
+
+    Structured arrays return a view with only the requested fields, keeping
+    their offsets and the record size::
+
+        >>> data = np.array([(1, 2., 'a'), (3, 4., 'b')],
+        ...     dtype=[('x', 'i4'), ('y', 'f8'), ('z', 'S1')])
+        >>> view = field_view(data, ['z', 'x'])
+        >>> view.tolist()
+        [('a', 1), ('b', 3)]
+        >>> view.base is data
+        True
+
+    Other data objects are indexed with the list of names.
+
+    """
+    names = list(names)
+    if not isinstance(data, np.ndarray) or data.dtype.names is None:
+        return data[names]
+
+    fields = data.dtype.fields
+    dtype = np.dtype({
+        'names': names,
+        'formats': [fields[name][0] for name in names],
+        'offsets': [fields[name][1] for name in names],
+        'itemsize': data.dtype.itemsize,
+    })
+    return data.view(dtype)
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping keeping only the `maxsize` most recently used items.
+
+        >>> cache = LRUCache(2)
+        >>> cache['a'] = 1
+        >>> cache['b'] = 2
+        >>> cache.get('a')
+        1
+        >>> cache['c'] = 3
+        >>> print cache.get('b')
+        None
+        >>> sorted(cache.keys())
+        ['a', 'c']
+
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+            self.items[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.items.pop(key, default)
+
+    def __len__(self):
+        return len(self.items)
+
+    def keys(self):
+        return self.items.keys()
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
 def _test():
     import doctest
     doctest.testmod()
@@ -119,7 +119,7 @@ except ImportError:
 
 import numpy as np
 
-from pydap.lib import quote
+from pydap.lib import quote, field_view
 
 
 __all__ = ['DapType', 'BaseType', 'StructureType', 'DatasetType', 'SequenceType', 'GridType']
@@ -131,29 +131,73 @@ class DapType(object):
     
     This is a base class, defining common methods and attributes for all other 
     classes in the data model.
+
+    Datasets can have hundreds of thousands of variables, so the classes use
+    `__slots__` for their own attributes. Names are interned, and empty
+    attributes are only allocated when `attributes` is accessed. Instances
+    still have a `__dict__`, allocated only when used, so that handlers can
+    set their own attributes, and can be referenced weakly.
+
+    Variables keep a reference to their parent, so that ids are computed when
+    needed instead of being rewritten through the whole subtree every time a
+    container is added to another.
     
     """
+    __slots__ = ('name', '_attributes', '_id', '_parent', 'descr',
+            '__dict__', '__weakref__')
+
     def __init__(self, name, attributes=None, **kwargs):
-        self.name = quote(name)
-        self.attributes = attributes or {}
-        self.attributes.update(kwargs)
-        
-        # Set the id to the name.
-        self._id = self.name
+        name = quote(name)
+        self.name = intern(name) if type(name) is str else name
+        if kwargs:
+            attributes = attributes or {}
+            attributes.update(kwargs)
+        self._attributes = attributes or None
+
+        # The id is derived from the name and the parent, unless set.
+        self._id = None
+        self._parent = None
+
+        # The DAP description of the variable, set when parsing a DDS.
+        self.descr = None
 
     def __repr__(self):
         return 'DapType(%s)' % ', '.join(map(repr, [self.name, self.attributes]))
+
+    def _get_attributes(self):
+        if self._attributes is None:
+            self._attributes = {}
+        return self._attributes
+
+    def _set_attributes(self, attributes):
+        self._attributes = attributes
+
+    attributes = property(_get_attributes, _set_attributes)
+
+    # Pickling must not go through `__getattr__`, since the instance is empty
+    # when it's unpickled.
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in self.__class__.__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if slot not in ('__dict__', '__weakref__'):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
         
     # The id.
     def _set_id(self, id):
         self._id = id
             
-        # Update children id.
-        for child in self.children():
-            child.id = '%s.%s' % (id, child.name)
-            
     def _get_id(self):
-        return self._id
+        if self._id is not None:
+            return self._id
+        elif self._parent is None:
+            return self.name
+        return self._parent._child_id(self.name)
         
     id = property(_get_id, _set_id)
     
@@ -171,8 +215,11 @@ class DapType(object):
             bar
             
         """
+        if attr == '_attributes':
+            # not initialized yet, eg, while unpickling
+            raise AttributeError(attr)
         try:
-            return self.attributes[attr]
+            return self._attributes[attr]
         except (KeyError, TypeError):
             raise AttributeError(
                 "'%s' object has no attribute '%s'"
@@ -191,6 +238,8 @@ class BaseType(DapType):
     A thin wrapper over Numpy arrays.
     
     """
+    __slots__ = ('data', 'dimensions')
+
     def __init__(self, name, data=None, dimensions=None, attributes=None, **kwargs):
         DapType.__init__(self, name, attributes, **kwargs)
         self.data = data
@@ -215,8 +264,10 @@ class BaseType(DapType):
         same name, and a view of the data.
         
         """
-        out = self.__class__(self.name, self.data, self.dimensions[:], self.attributes.copy())
+        out = self.__class__(self.name, self.data, self.dimensions[:],
+                self._attributes and self._attributes.copy())
         out.id = self.id
+        out.descr = self.descr
         return out
 
     # Comparisons are passed to the data.
@@ -234,33 +285,33 @@ class BaseType(DapType):
 
 
 class StructureType(DapType):
+    __slots__ = ('_children',)
+
     def __init__(self, name, attributes=None, **kwargs):
         DapType.__init__(self, name, attributes, **kwargs)
-
-        # emulate a simple ordered dict
-        self._keys = []
-        self._dict = {}
+        self._children = OrderedDict()
         
     def __repr__(self):
         return '<%s with children %s>' % (self.__class__.__name__, 
             ', '.join(map(repr, self.keys())))
 
     def __contains__(self, child):
-        return self._dict.__contains__(child)
+        return self._children.__contains__(child)
         
     def __getattr__(self, attr):
         """
         Lazy shortcut for accessing children.
         
         """
+        if attr == '_children':
+            raise AttributeError(attr)
         try:
             return self[attr]
         except:
             return DapType.__getattr__(self, attr)
             
     def __iter__(self):
-        for key in self._keys:
-            yield self._dict[key]
+        return self._children.itervalues()
     children = __iter__
     
     def __setitem__(self, key, item):
@@ -269,23 +320,25 @@ class StructureType(DapType):
             raise KeyError('Key "%s" is different from variable name "%s"!' %
                 (key, item.name))
 
-        if key in self._keys:
-            self._keys.pop(self._keys.index(key))
-        self._keys.append(key)
-        self._dict[key] = item
+        # replaced children are moved to the end
+        self._children.pop(key, None)
+        self._children[key] = item
         
-        # Set item id.
-        item.id = '%s.%s' % (self.id, item.name)
+        # The item id is now derived from ours.
+        item._id = None
+        item._parent = self
+
+    def _child_id(self, name):
+        return '%s.%s' % (self.id, name)
 
     def __getitem__(self, key):
-        return self._dict[key]
+        return self._children[key]
 
     def __delitem__(self, key):
-        self._dict.__delitem__(key)
-        self._keys.remove(key)
+        del self._children[key]
 
     def keys(self):
-        return self._keys[:]
+        return self._children.keys()
 
     def _get_data(self):
         return [var.data for var in self.children()]
@@ -295,8 +348,10 @@ class StructureType(DapType):
     data = property(_get_data, _set_data)
     
     def clone(self):
-        out = self.__class__(self.name, self.attributes.copy())
+        out = self.__class__(self.name,
+                self._attributes and self._attributes.copy())
         out.id = self.id
+        out.descr = self.descr
         
         # Clone children too.
         for child in self.children():
@@ -312,19 +367,9 @@ class DatasetType(StructureType):
                 (key, item.name))
         StructureType.__setitem__(self, key, item)
         
+    def _child_id(self, name):
         # The dataset name does not goes into the children ids.
-        item.id = item.name
-        
-    def _set_id(self, id):
-        """
-        The method must be implemented so that the dataset name is not included
-        in the children ids.
-        
-        """
-        self._id = id
-        
-        for child in self.children():
-            child.id = child.name
+        return name
             
             
 class SequenceType(StructureType):
@@ -413,6 +458,7 @@ class SequenceType(StructureType):
         Kodiak_Trail
 
     """
+    __slots__ = ('_data',)
 
     def __init__(self, name, data=None, attributes=None, **kwargs):
         StructureType.__init__(self, name, attributes, **kwargs)
@@ -442,10 +488,11 @@ class SequenceType(StructureType):
             
         # If it's a tuple, return a new `SequenceType` with selected children.
         elif isinstance(key, tuple):
-            out = SequenceType(self.name, self.data, self.attributes.copy())
+            out = SequenceType(self.name, self.data,
+                    self._attributes and self._attributes.copy())
             for name in key:
                 out[name] = StructureType.__getitem__(self, name).clone()
-            out.data = self.data[list(key)]
+            out.data = field_view(self.data, key)
             return out
             
         # Else return a new `SequenceType` with the data sliced.
@@ -455,8 +502,10 @@ class SequenceType(StructureType):
             return out
 
     def clone(self):
-        out = self.__class__(self.name, self.data, self.attributes.copy())
+        out = self.__class__(self.name, self.data,
+                self._attributes and self._attributes.copy())
         out.id = self.id
+        out.descr = self.descr
         
         # Clone children too.
         for child in self.children():
@@ -466,6 +515,8 @@ class SequenceType(StructureType):
 
 
 class GridType(StructureType):
+    __slots__ = ()
+
     def __repr__(self):
         return '<%s with array %s and maps %s>' % (self.__class__.__name__, 
             repr(self.keys()[0]), ', '.join(map(repr, self.keys()[1:])))
@@ -488,15 +539,17 @@ class GridType(StructureType):
 
     @property
     def array(self):
-        return self[self.keys()[0]]
+        for child in self.children():
+            return child
+        raise IndexError('Grid "%s" has no array.' % self.id)
 
     @property
     def maps(self):
-        return OrderedDict((k, self[k]) for k in self.keys()[1:])
+        return OrderedDict(itertools.islice(self._children.iteritems(), 1, None))
 
     @property
     def dimensions(self):
-        return tuple(self.keys()[1:])
+        return tuple(itertools.islice(self._children, 1, None))
 
 
 def pack_rows(data, level):
@@ -0,0 +1,286 @@
+"""
+Precomputed overviews of large grids.
+
+Overviews are block averaged copies of a grid at decreasing resolutions,
+each coarser than the previous one by a `factor` along the last two axes,
+until these have at most `minimum` values. They're built with `build`, or
+the `overviews` command::
+
+    $ overviews data.nc sst
+
+and stored beside the file, in the `data.nc.overviews` directory, as `.npy`
+files that are read lazily. Overviews are ignored once the file is
+modified, until they're built again.
+
+The `overview` server-side function returns the coarsest overview with at
+least a given number of values along each axis, eg::
+
+    http://server.example.com/data.nc.dods?overview(sst,1,180,360)
+
+The function finds the overviews of grids whose datasets were passed to
+`register`, together with their file; the Pydap server does this for the
+files it serves when `overviews: true` is set in its configuration.
+
+"""
+
+import os
+import marshal
+import weakref
+from threading import current_thread
+
+import numpy as np
+
+from pydap.model import *
+from pydap.lib import walk, LRUCache
+from pydap.exceptions import ConstraintExpressionError
+from pydap.wsgi.functions import (block_mean, missing_values, parse_factors,
+        coarsen, reduced_attributes)
+
+
+# increased when the format changes, invalidating old overviews
+VERSION = 1
+
+# default ratio between the resolution of consecutive levels, and size of
+# the coarsest level
+FACTOR = 2
+MINIMUM_SIZE = 256
+
+# number of files and grids whose overviews are remembered
+CACHE_SIZE = 1024
+
+# the overviews of each file, keyed by path
+indexes = LRUCache(CACHE_SIZE)
+
+# the file and id of registered grids, keyed by the id of their data; since
+# datasets are cloned for each request, the data is shared between requests
+registry = LRUCache(CACHE_SIZE)
+
+
+def directory(filepath):
+    return filepath + '.overviews'
+
+
+def build(filepath, dataset, names=None, factor=FACTOR, minimum=MINIMUM_SIZE):
+    """
+    Build overviews for grids of a dataset read from `filepath`.
+
+    `names` are the ids of the grids, by default all of them. Returns the
+    shape of the levels built for each grid.
+
+    """
+    mtime = os.stat(filepath).st_mtime
+    path = directory(filepath)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    index = {}
+    for grid in walk(dataset, GridType):
+        if names is None or grid.id in names:
+            index[grid.id] = build_levels(path, grid, factor, minimum)
+
+    replace(os.path.join(path, 'index'),
+            lambda fp: marshal.dump((VERSION, filepath, mtime, index), fp, 2))
+    return index
+
+
+def build_levels(path, grid, factor, minimum):
+    """
+    Build the overviews of a grid, each from the previous one.
+
+    """
+    array = grid.array
+    data, missing = array.data, missing_values(array.attributes)
+    maps = [map_.data for map_ in grid.maps.values()]
+    shape = array.shape
+    axes = range(len(shape))[-2:]
+
+    levels = []
+    while any(shape[i] > minimum for i in axes):
+        factors = tuple(factor if i in axes else 1 for i in range(len(shape)))
+        shape = tuple(-(-n // f) for n, f in zip(shape, factors))
+        dtype = data.dtype if data.dtype.kind == 'f' else np.dtype('f8')
+        filename = os.path.join(path, '%s.%d.npy' % (grid.id, len(levels) + 1))
+
+        def write(fp):
+            out = np.lib.format.open_memmap(fp.name, 'w+', dtype, shape)
+            block_mean(data, factors, missing, out=out)
+            out.flush()
+        replace(filename, write)
+        data, missing = np.load(filename, mmap_mode='r'), ()
+
+        maps = [block_mean(map_, (f,)) if f > 1 else np.asarray(map_)
+                for map_, f in zip(maps, factors)]
+        for name, map_ in zip(grid.maps, maps):
+            replace(os.path.join(path, '%s.%d.%s.npy' % (grid.id, len(levels) + 1, name)),
+                    lambda fp: np.save(fp, map_))
+        levels.append(shape)
+    return levels
+
+
+def replace(filename, write):
+    """
+    Write a file atomically, so that readers never see it incomplete.
+
+    """
+    tmp = '%s.%d.%s' % (filename, os.getpid(), current_thread().ident)
+    try:
+        with open(tmp, 'wb') as fp:
+            write(fp)
+        os.rename(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def load_index(filepath):
+    """
+    Return the overviews of a file, or `None` if they're missing or outdated.
+
+    """
+    filename = os.path.join(directory(filepath), 'index')
+    try:
+        mtime = os.stat(filepath).st_mtime
+        modified = os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+    cached = indexes.get(filepath)
+    if cached is not None and cached[:2] == (mtime, modified):
+        return cached[2]
+
+    try:
+        with open(filename, 'rb') as fp:
+            version, path, built, index = marshal.load(fp)
+        if (version, path, built) != (VERSION, filepath, mtime):
+            index = None
+    except Exception:
+        # invalid index
+        index = None
+    indexes[filepath] = mtime, modified, index
+    return index
+
+
+def register(dataset, filepath):
+    """
+    Register the grids of a dataset read from `filepath` that have overviews.
+
+    """
+    index = load_index(filepath)
+    if not index:
+        return
+    for grid in walk(dataset, GridType):
+        if grid.id in index:
+            data = grid.array.data
+            try:
+                # entries are not removed when the data is freed, since the
+                # garbage collector may do it while the registry is locked
+                registry[id(data)] = weakref.ref(data), filepath, grid.id
+            except TypeError:
+                # data can't be referenced weakly
+                pass
+
+
+def find_levels(grid):
+    """
+    Return the file, id and shape of the levels of the overviews of a grid.
+
+    Returns `None` if the grid was not registered, or its overviews are
+    outdated.
+
+    """
+    data = grid.array.data
+    cached = registry.get(id(data))
+    if cached is None or cached[0]() is not data:
+        return None
+    filepath, id_ = cached[1:]
+    index = load_index(filepath)
+    if not index or id_ not in index:
+        return None
+    return filepath, id_, index[id_]
+
+
+def load_level(grid, filepath, id_, level):
+    """
+    Return a grid with the data of an overview level.
+
+    """
+    path = directory(filepath)
+    out = GridType(name=grid.name, attributes=grid.attributes)
+    array = grid.array
+    out[array.name] = BaseType(name=array.name,
+            data=np.load(os.path.join(path, '%s.%d.npy' % (id_, level)), mmap_mode='r'),
+            dimensions=array.dimensions,
+            attributes=reduced_attributes('mean', array.attributes))
+    for map_ in grid.maps.values():
+        out[map_.name] = BaseType(name=map_.name,
+                data=np.load(os.path.join(path, '%s.%d.%s.npy' % (id_, level, map_.name))),
+                dimensions=map_.dimensions,
+                attributes=reduced_attributes('mean', map_.attributes))
+    return out
+
+
+def overview(dataset, var, *shape):
+    """
+    Version 1.0
+
+    Returns the coarsest overview of a grid with at least the given number
+    of values along each axis, eg:
+
+        http://server.example.com/dataset.dods?overview(sst,1,180,360)
+
+    Missing sizes are 1. When no overview is fine enough the grid is
+    returned, and when it has no overviews, or they're outdated, its last
+    two axes are averaged on the fly, like the overviews.
+
+    """
+    if not isinstance(var, GridType):
+        raise ConstraintExpressionError('Function "overview" should be used on a grid.')
+    shape = parse_factors('overview', var, shape)
+
+    found = find_levels(var)
+    if found is not None:
+        filepath, id_, levels = found
+        for level in range(len(levels), 0, -1):
+            if all(n >= m for n, m in zip(levels[level-1], shape)):
+                return load_level(var, filepath, id_, level)
+        return var
+
+    factors = [max(1, n // m) for n, m in zip(var.array.shape, shape)]
+    factors[:-2] = [1] * len(factors[:-2])
+    if any(factor > 1 for factor in factors):
+        return coarsen(dataset, var, *factors)
+    return var
+
+
+def main(argv=None):
+    """
+    Build overviews for the grids in a file served by a Pydap handler.
+
+    """
+    import argparse
+    from pydap.handlers.lib import get_handler
+
+    parser = argparse.ArgumentParser(
+        description='Build overviews of the grids in a file.')
+    parser.add_argument('filepath', help='file with the data')
+    parser.add_argument('names', nargs='*',
+        help='ids of the grids (default: all)')
+    parser.add_argument('-f', '--factor', type=int, default=FACTOR,
+        help='ratio between the resolution of levels (default: %(default)s)')
+    parser.add_argument('-m', '--minimum', type=int, default=MINIMUM_SIZE,
+        help='size of the coarsest level (default: %(default)s)')
+    parser.add_argument('--force', action='store_true',
+        help='rebuild overviews that are up to date')
+    args = parser.parse_args(argv)
+
+    index = load_index(args.filepath)
+    if index and not args.force and all(name in index for name in args.names):
+        print 'Overviews are up to date.'
+        return
+
+    dataset = get_handler(args.filepath).dataset
+    index = build(args.filepath, dataset, args.names or None,
+            args.factor, args.minimum)
+    for id_, levels in sorted(index.items()):
+        print '%s: %s' % (id_, ', '.join(
+            'x'.join(str(n) for n in shape) for shape in levels))
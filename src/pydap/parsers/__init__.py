@@ -130,32 +130,56 @@ class SimpleParser(object):
     """
     A very simple parser.
 
+    The input is scanned by position, without copying the remaining buffer,
+    and regular expressions are compiled only once. If `whitespace` is true
+    white space after each token is skipped.
+
     """
-    def __init__(self, input, flags=0):
+
+    # compiled patterns, shared by all parsers
+    patterns = {}
+
+    def __init__(self, input, flags=0, whitespace=False):
         self.buffer = input
         self.flags = flags
+        self.whitespace = whitespace
+        self.pos = 0
+
+    def compile(self, regexp):
+        key = regexp, self.flags, self.whitespace
+        try:
+            return self.patterns[key]
+        except KeyError:
+            # verbose patterns may end in a comment
+            if self.flags & re.VERBOSE:
+                regexp += '\n'
+            if self.whitespace:
+                regexp = r'(%s)\s*' % regexp
+            else:
+                regexp = r'(%s)' % regexp
+            p = self.patterns[key] = re.compile(regexp, self.flags)
+            return p
 
     def peek(self, regexp):
-        p = re.compile(regexp, self.flags)
-        m = p.match(self.buffer)
+        m = self.compile(regexp).match(self.buffer, self.pos)
         if m: 
-            token = m.group()
+            token = m.group(1)
         else:
             token = ''
         return token
 
     def consume(self, regexp):
-        p = re.compile(regexp, self.flags)
-        m = p.match(self.buffer)
+        m = self.compile(regexp).match(self.buffer, self.pos)
         if m: 
-            token = m.group()
-            self.buffer = self.buffer[len(token):]
+            token = m.group(1)
+            self.pos = m.end()
         else:
-            raise Exception("Unable to parse token: %s" % self.buffer[:10])
+            raise Exception(
+                "Unable to parse token: %s" % self.buffer[self.pos:self.pos+10])
         return token
 
     def __nonzero__(self):
-        return len(self.buffer)
+        return len(self.buffer) > self.pos
 
 
 def _test():
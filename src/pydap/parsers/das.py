@@ -1,6 +1,7 @@
 import re
 import ast
-import operator
+
+import numpy as np
 
 from pydap.parsers import SimpleParser
 from pydap.model import *
@@ -9,19 +10,24 @@ from pydap.lib import walk
 
 atomic = ('byte', 'int', 'uint', 'int16', 'uint16', 'int32', 'uint32', 'float32', 'float64', 'string', 'url')
 
+# dtypes for numeric attributes, parsed in bulk
+numeric = {
+    'byte'    : np.uint8,
+    'int'     : np.int32,
+    'uint'    : np.uint32,
+    'int16'   : np.int16,
+    'uint16'  : np.uint16,
+    'int32'   : np.int32,
+    'uint32'  : np.uint32,
+    'float32' : np.float32,
+    'float64' : np.float64,
+    }
+
 
 class DASParser(SimpleParser):
     def __init__(self, das):
-        super(DASParser, self).__init__(das, re.IGNORECASE | re.VERBOSE | re.DOTALL)
-
-    def consume(self, regexp):
-        """
-        Ignore white space when consuming tokens.
-
-        """
-        token = super(DASParser, self).consume(regexp)
-        self.buffer = self.buffer.lstrip()
-        return token
+        super(DASParser, self).__init__(das, re.IGNORECASE | re.VERBOSE | re.DOTALL,
+                whitespace=True)
 
     def parse(self):
         out = {}
@@ -45,6 +51,9 @@ class DASParser(SimpleParser):
         type = self.consume('[^\s]+')
         name = self.consume('[^\s]+')
 
+        if type.lower() in numeric:
+            return name, self.numbers(numeric[type.lower()])
+
         values = []
         while not self.peek(';'):
             value = self.consume(
@@ -75,6 +84,71 @@ class DASParser(SimpleParser):
 
         return name, values
 
+    def numbers(self, dtype):
+        """
+        Parse numeric values.
+
+        Several values are converted in bulk to a Numpy array of the declared
+        type; single values are returned as Python numbers.
+
+        """
+        text = self.consume('[^;]*')
+        self.consume(';')
+
+        tokens = [token for token in text.split(',') if token.strip()]
+        if len(tokens) > 1:
+            values = np.fromstring(text, np.float64, sep=',')
+            if len(values) == len(tokens) and fits(values, dtype):
+                return values.astype(dtype)
+
+        # values that Numpy can't parse, like hexadecimal integers; those
+        # that don't fit the declared type are kept as Python numbers
+        values = [parse_number(token) for token in tokens]
+        if len(values) == 1:
+            return values[0]
+        elif values and fits(np.array(values, np.float64), dtype):
+            return np.array(values, dtype)
+        return values
+
+
+def fits(values, dtype):
+    """
+    Check if float64 values can be converted to a type unchanged.
+
+        >>> fits(np.array([1., 255.]), np.uint8)
+        True
+        >>> fits(np.array([1.5, 256.]), np.uint8)
+        False
+        >>> fits(np.array([1e40]), np.float32)
+        False
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        with np.errstate(invalid='ignore'):
+            return bool(((values == np.floor(values)) &
+                    (values >= info.min) & (values <= info.max)).all())
+    with np.errstate(over='ignore'):
+        converted = values.astype(dtype)
+    return not (np.isinf(converted) & np.isfinite(values)).any()
+
+
+def parse_number(token):
+    """
+    Parse a single numeric value.
+
+        >>> parse_number(' 0x10')
+        16
+        >>> parse_number('NaN.')
+        nan
+
+    """
+    token = token.strip()
+    if token.lower() in ['nan', 'nan.']:
+        return float('nan')
+    return ast.literal_eval(token)
+
 
 def parse_das(das):
     """
@@ -97,20 +171,46 @@ def add_attributes(dataset, attributes):
         if k not in dataset:
             dataset.attributes[k] = v
 
+    index = index_attributes(attributes)
     for var in walk(dataset):
-        # attributes can be flat, eg, "foo.bar" : {...}
-        if var.id in attributes:
-            var.attributes.update(attributes[var.id])
-        # or nested, eg, "foo" : { "bar" : {...} }
-        try:
-            var.attributes.update(
-                    reduce(operator.getitem, [attributes] + var.id.split('.')))
-        except KeyError:
-            pass
+        for container in index.get(var.id, []):
+            var.attributes.update(container)
 
     return dataset
 
 
+def index_attributes(attributes):
+    """
+    Map ids to the attribute containers that apply to them.
+
+    Attributes can be flat, eg, "foo.bar" : {...}, or nested, eg, "foo" :
+    { "bar" : {...} }; flat attributes come first::
+
+        >>> index = index_attributes({'a.b': {'x': 1}, 'a': {'b': {'y': 2}}})
+        >>> index['a.b']
+        [{'x': 1}, {'y': 2}]
+
+    """
+    index = {}
+    for key, value in attributes.items():
+        if isinstance(value, dict):
+            index.setdefault(key, []).append(value)
+
+    # nested attributes, breadth first
+    containers = [(key, value) for key, value in attributes.items()
+            if isinstance(value, dict)]
+    while containers:
+        children = []
+        for id_, container in containers:
+            for key, value in container.items():
+                if isinstance(value, dict):
+                    path = '%s.%s' % (id_, key)
+                    index.setdefault(path, []).append(value)
+                    children.append((path, value))
+        containers = children
+
+    return index
+
 
 if __name__ == '__main__':
     import sys
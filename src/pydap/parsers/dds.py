@@ -26,14 +26,9 @@ name_regexp = '[\w%!~"\'\*-]+'
 
 class DDSParser(SimpleParser):
     def __init__(self, dds):
-        super(DDSParser, self).__init__(dds, re.IGNORECASE)
+        super(DDSParser, self).__init__(dds, re.IGNORECASE, whitespace=True)
         self.dds = dds
 
-    def consume(self, regexp):
-        token = super(DDSParser, self).consume(regexp)
-        self.buffer = self.buffer.lstrip()
-        return token
-
     def parse(self):
         dataset = DatasetType('nameless')
 
@@ -45,7 +40,6 @@ class DDSParser(SimpleParser):
         self.consume('}')
 
         dataset.name = quote(self.consume('[^;]+'))
-        dataset._set_id(dataset.name)
         self.consume(';')
 
         dataset.descr = dataset.name, [c.descr for c in dataset.children()], ()
@@ -3,7 +3,7 @@ from collections import Iterable
 import numpy as np
 
 from pydap.model import *
-from pydap.lib import walk, START_OF_SEQUENCE, END_OF_SEQUENCE
+from pydap.lib import walk, LazySlice, START_OF_SEQUENCE, END_OF_SEQUENCE
 from pydap.responses.lib import BaseResponse
 from pydap.responses.dds import dispatch as dds_dispatch
 
@@ -153,7 +153,9 @@ def base(var):
     else:
         # make data iterable; 1D arrays must be converted to 2D, since iteration
         # over 1D yields scalars which are not properly cast to big endian
-        if len(data.shape) < 2:
+        if isinstance(data, LazySlice):
+            data = data.blocks()
+        elif len(data.shape) < 2:
             try:
                 data = data.reshape(1, -1)
             except:
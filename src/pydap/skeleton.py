@@ -0,0 +1,200 @@
+"""
+Compact serialization of the structure of datasets.
+
+A skeleton has the variables of a dataset, with their types, dimensions,
+attributes, `descr`, and the dtype and shape of their data, but not the
+data itself. Skeletons are encoded with `marshal`, so they're fast to load::
+
+    >>> dataset = DatasetType('test', history='created')
+    >>> dataset['x'] = BaseType('x', np.arange(3.), units='m',
+    ...     valid_range=np.array([0, 10], 'f'))
+    >>> out = loads(dumps(dataset))
+    >>> out.x.units
+    'm'
+    >>> out.x.valid_range
+    array([ 0., 10.], dtype=float32)
+    >>> out.x.dtype, out.x.shape
+    (dtype('float64'), (3,))
+
+Since there's no data, variables loaded from a skeleton have a `Placeholder`
+instead, with the same dtype and shape. Handlers can use `load` to store the
+skeleton of a file next to it, rebuilding it only when the file changes.
+
+"""
+
+import os
+import marshal
+from hashlib import sha1
+from threading import current_thread
+
+import numpy as np
+
+from pydap.model import *
+from pydap.handlers.lib import IterData
+
+
+# increased when the format changes, invalidating old skeletons
+VERSION = 1
+
+# tags for values that marshal can't encode
+ARRAY = '\0ndarray'
+SCALAR = '\0scalar'
+TUPLE = '\0tuple'
+
+types = dict((cls.__name__, cls) for cls in
+        [BaseType, StructureType, DatasetType, SequenceType, GridType])
+
+
+class Placeholder(object):
+    """
+    Stand-in for the data of a variable loaded from a skeleton.
+
+    """
+    def __init__(self, dtype, shape):
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+
+    def __repr__(self):
+        return 'Placeholder(%r, %r)' % (self.dtype, self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        raise ValueError('Variables loaded from a skeleton have no data.')
+
+
+def dumps(var):
+    """
+    Return the skeleton of a variable, usually a dataset, as a string.
+
+    """
+    return marshal.dumps((VERSION, var.id, encode_var(var)), 2)
+
+
+def loads(data):
+    """
+    Build a variable from its skeleton.
+
+    """
+    version, id_, skeleton = marshal.loads(data)
+    if version != VERSION:
+        raise ValueError('Unsupported skeleton version: %s.' % version)
+    var = decode_var(skeleton)
+    var.id = id_
+    return var
+
+
+def load(filepath, build, directory=None):
+    """
+    Return the dataset for a file, from its skeleton if it's up to date.
+
+    The skeleton is stored in `filepath + '.skel'` or, if `directory` is given,
+    in a file named after the path. When the file has been modified since
+    the skeleton was saved the dataset is rebuilt by calling `build` with the
+    path, and the skeleton updated; errors writing it are ignored.
+
+    """
+    if directory is None:
+        filename = filepath + '.skel'
+    else:
+        filename = os.path.join(directory, sha1(filepath).hexdigest())
+    mtime = os.stat(filepath).st_mtime
+
+    try:
+        with open(filename, 'rb') as fp:
+            version, path, modified, data = marshal.load(fp)
+        if (version, path, modified) == (VERSION, filepath, mtime):
+            return loads(data)
+    except Exception:
+        # missing, invalid or outdated skeleton
+        pass
+
+    dataset = build(filepath)
+    tmp = '%s.%d.%s' % (filename, os.getpid(), current_thread().ident)
+    try:
+        with open(tmp, 'wb') as fp:
+            marshal.dump((VERSION, filepath, mtime, dumps(dataset)), fp, 2)
+        os.rename(tmp, filename)
+    except (IOError, OSError):
+        pass
+    return dataset
+
+
+def encode_var(var):
+    attributes = encode_value(var._attributes or {})
+    if isinstance(var, StructureType):
+        return (var.__class__.__name__, var.name, attributes, var.descr,
+                [encode_var(child) for child in var.children()])
+
+    # the dtype of iterable data can only be found by reading it
+    dtype = shape = None
+    if not isinstance(var.data, IterData):
+        dtype = getattr(var.data, 'dtype', None)
+        shape = getattr(var.data, 'shape', None)
+    return (var.__class__.__name__, var.name, attributes, var.descr,
+            tuple(var.dimensions), dtype.str if dtype is not None else None,
+            shape)
+
+
+def decode_var(skeleton):
+    type_, name, attributes, descr = skeleton[:4]
+    attributes = decode_value(attributes)
+    if issubclass(types[type_], StructureType):
+        var = types[type_](name, attributes)
+        for child in skeleton[4]:
+            child = decode_var(child)
+            var[child.name] = child
+    else:
+        dimensions, dtype, shape = skeleton[4:]
+        data = Placeholder(dtype, shape) if dtype is not None else None
+        var = types[type_](name, data, dimensions, attributes)
+
+    if descr is not None:
+        var.descr = descr
+    return var
+
+
+def encode_value(value):
+    """
+    Encode attribute values, converting those that marshal can't handle.
+
+    """
+    if isinstance(value, dict):
+        return dict((k, encode_value(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [encode_value(v) for v in value]
+    elif isinstance(value, tuple):
+        return (TUPLE,) + tuple(encode_value(v) for v in value)
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return encode_value(value.tolist())
+        return (ARRAY, value.dtype.str, value.shape, value.tostring())
+    elif isinstance(value, np.generic):
+        return (SCALAR, value.dtype.str, value.tostring())
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        return dict((k, decode_value(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [decode_value(v) for v in value]
+    elif isinstance(value, tuple):
+        if value[0] == ARRAY:
+            dtype, shape, data = value[1:]
+            return np.fromstring(data, dtype).reshape(shape)
+        elif value[0] == SCALAR:
+            dtype, data = value[1:]
+            return np.fromstring(data, dtype)[0]
+        return tuple(decode_value(v) for v in value[1:])
+    return value
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == "__main__":
+    _test()
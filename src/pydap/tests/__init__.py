@@ -1,3 +1,12 @@
+from io import BytesIO
+
+from webob import Request
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
 def requests_intercept(app, location):
     """
     Intercept WSGI requests and pass them to `webtest.TestApp`.
@@ -5,7 +14,7 @@ def requests_intercept(app, location):
     """
     def new_get(url, **kwargs):
         path = url[len(location):]
-        response = app.get('/%s' % path)
+        response = app.get('/%s' % path, headers=kwargs.get('headers') or {})
         return MockResponse(response)
     return new_get
 
@@ -23,10 +32,48 @@ class MockResponse(object):
 
         self.text = response.body
         self.content = response.body
+        self.status_code = response.status_int
+        self.headers = response.headers
+        self.closed = False
 
     def raise_for_status(self):
         pass
 
+    def close(self):
+        self.closed = True
+
     def iter_content(self, blocksize):
         return iter(self.content)
 
+
+class WSGIAdapter(BaseAdapter):
+    """
+    A `requests` transport adapter that sends requests to a WSGI app.
+
+    This allows testing the client with a `requests.Session`::
+
+        >>> session = requests.Session()  # doctest: +SKIP
+        >>> session.mount('http://localhost:8001/', WSGIAdapter(app))  # doctest: +SKIP
+
+    """
+    def __init__(self, app):
+        super(WSGIAdapter, self).__init__()
+        self.app = app
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+            cert=None, proxies=None):
+        req = Request.blank(request.path_url, headers=dict(request.headers))
+        res = req.get_response(self.app)
+
+        response = Response()
+        response.status_code = res.status_int
+        response.reason = res.status.split(' ', 1)[-1]
+        response.headers = CaseInsensitiveDict(res.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = BytesIO(res.body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
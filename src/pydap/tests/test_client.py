@@ -1,4 +1,7 @@
 import os
+import shutil
+import tempfile
+import threading
 import unittest                                                                 
 
 import numpy as np
@@ -7,8 +10,11 @@ import requests
                                                                                 
 from pydap.model import *                                                       
 from pydap.handlers.lib import BaseHandler                                      
-from pydap.client import open_url, open_dods, open_file, Functions
-from pydap.tests import requests_intercept
+from pydap.client import (open_url, open_dods, open_file, fetch, Functions,
+    MetadataCache, AsyncClient, Batch)
+from pydap.handlers.dap import SequenceProxy
+from pydap.tests import requests_intercept, WSGIAdapter
+from pydap.exceptions import ClientError
 from pydap.wsgi.ssf import ServerSideFunctions
 
 
@@ -43,6 +49,64 @@ class Test_open_file(unittest.TestCase):
             "MetOcean WOCE/OCM")
 
 
+class Test_open_file_lazy(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test')
+        rain = dataset['rain'] = GridType('rain')
+        rain['rain'] = BaseType('rain', np.arange(6.).reshape(2, 3), dimensions=('y', 'x'))
+        rain['x'] = BaseType('x', np.arange(3), units='degrees_east')
+        rain['y'] = BaseType('y', np.arange(2), units='degrees_north')
+        dataset['cast'] = SequenceType('cast')
+        dataset['cast']['depth'] = BaseType('depth')
+        dataset['cast']['temperature'] = BaseType('temperature')
+        dataset['cast'].data = np.rec.fromrecords(
+            [(10., 17.), (20., 15.)], names=['depth', 'temperature'])
+        dataset['Drifters'] = SequenceType('Drifters')
+        dataset['Drifters']['instrument_id'] = BaseType('instrument_id')
+        dataset['Drifters']['location'] = BaseType('location')
+        dataset['Drifters']['latitude'] = BaseType('latitude')
+        dataset['Drifters']['longitude'] = BaseType('longitude')
+        dataset.Drifters.data = np.rec.fromrecords(
+            DATA, names=dataset.Drifters.keys())
+
+        fd, self.path = tempfile.mkstemp(suffix='.dods')
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(TestApp(BaseHandler(dataset)).get('/.dods').body)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_arrays(self):
+        dataset = open_file(self.path, lazy=True)
+        self.assertIsInstance(dataset.rain.rain.data, np.ndarray)
+        np.testing.assert_array_equal(dataset.rain.rain[1, 1:], [4., 5.])
+        np.testing.assert_array_equal(dataset.rain.x.data, [0, 1, 2])
+
+    def test_sequences(self):
+        dataset = open_file(self.path, lazy=True)
+        self.assertEqual(map(tuple, dataset.cast), [(10., 17.), (20., 15.)])
+        np.testing.assert_array_equal(dataset.cast.depth.data, [10., 20.])
+        self.assertEqual(map(tuple, dataset.Drifters), DATA)
+        self.assertEqual(list(dataset.Drifters['latitude'].data),
+            [row[2] for row in DATA])
+
+    def test_simple_types(self):
+        dataset = open_file(DODS, lazy=True)
+        self.assertEqual(dataset.i32.data, 1)
+        self.assertEqual(dataset.f64.data, 1000.0)
+        self.assertEqual(dataset.s.data[...],
+            'This is a data test string (pass 0).')
+
+    def test_truncated(self):
+        # a file without the data marker is not a DODS response
+        with open(self.path, 'rb') as fp:
+            dds = fp.read().split('\nData:\n')[0]
+        with open(self.path, 'wb') as fp:
+            fp.write(dds)
+        self.assertRaises(ClientError, open_file, self.path, lazy=True)
+        self.assertRaises(ClientError, open_file, self.path)
+
+
 class Test_open_dods(unittest.TestCase):
     def setUp(self):                                                            
         # create dataset                                                        
@@ -86,6 +150,335 @@ class Test_open_dods(unittest.TestCase):
         self.assertEqual(dataset.attributes['type'], "Drifters")
 
 
+class Test_MetadataCache(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('EOSDB.DBO', type='Drifters')
+        dataset['Drifters'] = SequenceType('Drifters')
+        dataset['Drifters']['instrument_id'] = BaseType('instrument_id')
+        dataset['Drifters']['location'] = BaseType('location')
+        dataset['Drifters']['latitude'] = BaseType('latitude')
+        dataset['Drifters']['longitude'] = BaseType('longitude')
+        dataset.Drifters.data = np.rec.fromrecords(
+            DATA, names=dataset.Drifters.keys())
+        self.app = TestApp(BaseHandler(dataset))
+
+        # intercept HTTP requests, keeping track of the urls
+        self.urls = []
+        get = requests_intercept(self.app, 'http://localhost:8001/')
+        def new_get(url, **kwargs):
+            self.urls.append(url)
+            return get(url, **kwargs)
+        self.requests_get = requests.get
+        requests.get = new_get
+
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        requests.get = self.requests_get
+        shutil.rmtree(self.path)
+
+    def test_fresh(self):
+        cache = MetadataCache(self.path)
+        open_url('http://localhost:8001/', cache=cache)
+        self.assertEqual(sorted(self.urls),
+            ['http://localhost:8001/.das', 'http://localhost:8001/.dds'])
+
+        self.urls = []
+        dataset = open_url('http://localhost:8001/', cache=cache)
+        self.assertEqual(self.urls, [])
+        self.assertEqual(dataset.attributes['type'], "Drifters")
+        np.testing.assert_array_equal(DATA, list(dataset.Drifters.data))
+
+    def test_stale(self):
+        cache = MetadataCache(self.path, ttl=0)
+        open_url('http://localhost:8001/', cache=cache)
+
+        self.urls = []
+        dataset = open_url('http://localhost:8001/', cache=cache)
+        self.assertEqual(len(self.urls), 2)
+        self.assertEqual(dataset.Drifters.keys(),
+            ['instrument_id', 'location', 'latitude', 'longitude'])
+
+
+class ValidatingApp(object):
+    """
+    Send an ETag with the DDS and DAS, answering conditional requests.
+
+    """
+    def __init__(self, app):
+        self.app = app
+        self.etags = {'.dds': '"1"', '.das': '"1"'}
+
+    def __call__(self, environ, start_response):
+        etag = self.etags.get(environ['PATH_INFO'][-4:])
+        if etag is None:
+            return self.app(environ, start_response)
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', [('ETag', etag)])
+            return []
+
+        def add_etag(status, headers, exc_info=None):
+            return start_response(status, headers + [('ETag', etag)], exc_info)
+        return self.app(environ, add_etag)
+
+
+class Test_revalidation(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test', history='created')
+        dataset['temp'] = BaseType('temp', np.arange(20.), units='K')
+        self.app = ValidatingApp(BaseHandler(dataset))
+
+        # intercept HTTP requests, keeping track of the status codes
+        self.statuses = []
+        get = requests_intercept(TestApp(self.app), 'http://localhost:8001/')
+        def new_get(url, **kwargs):
+            r = get(url, **kwargs)
+            self.statuses.append((url[-3:], r.status_code))
+            return r
+        self.requests_get = requests.get
+        requests.get = new_get
+
+        self.path = tempfile.mkdtemp()
+        self.cache = MetadataCache(self.path, ttl=0)
+        open_url('http://localhost:8001/', cache=self.cache)
+        self.statuses = []
+
+    def tearDown(self):
+        requests.get = self.requests_get
+        shutil.rmtree(self.path)
+
+    def test_not_modified(self):
+        dataset = open_url('http://localhost:8001/', cache=self.cache)
+        self.assertEqual(sorted(self.statuses), [('das', 304), ('dds', 304)])
+        self.assertEqual(dataset.attributes['history'], 'created')
+        self.assertEqual(dataset.temp.units, 'K')
+        self.assertEqual(dataset.temp.shape, (20,))
+
+    def test_modified(self):
+        # the DAS is downloaded again, since it's needed to rebuild the dataset
+        self.app.etags['.dds'] = '"2"'
+        dataset = open_url('http://localhost:8001/', cache=self.cache)
+        self.assertEqual(sorted(self.statuses),
+            [('das', 200), ('das', 304), ('dds', 200)])
+        self.assertEqual(dataset.temp.units, 'K')
+
+        self.statuses = []
+        open_url('http://localhost:8001/', cache=self.cache)
+        self.assertEqual(sorted(self.statuses), [('das', 304), ('dds', 304)])
+
+
+class Test_fetch(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test')
+        rain = dataset['rain'] = GridType('rain')
+        rain['rain'] = BaseType('rain', np.arange(6).reshape(2, 3), dimensions=('y', 'x'))
+        rain['x'] = BaseType('x', np.arange(3), units='degrees_east')
+        rain['y'] = BaseType('y', np.arange(2), units='degrees_north')
+        dataset['temp'] = BaseType('temp', np.arange(20.))
+        self.app = TestApp(BaseHandler(dataset))
+
+        # intercept HTTP requests, keeping track of the urls
+        self.urls = []
+        get = requests_intercept(self.app, 'http://localhost:8001/')
+        def new_get(url, **kwargs):
+            self.urls.append(url)
+            return get(url, **kwargs)
+        self.requests_get = requests.get
+        requests.get = new_get
+
+    def tearDown(self):
+        requests.get = self.requests_get
+
+    def test_fetch(self):
+        dataset = open_url('http://localhost:8001/')
+        self.urls = []
+        data = fetch(dataset, {
+            dataset.rain.rain: (1, slice(0, 2)),
+            dataset.rain.x: slice(0, 2),
+            'temp': slice(10, 15),
+        })
+        self.assertEqual(len(self.urls), 1)
+        np.testing.assert_array_equal(data[dataset.rain.rain], [[3, 4]])
+        np.testing.assert_array_equal(data[dataset.rain.x], [0, 1])
+        np.testing.assert_array_equal(data['temp'], np.arange(10., 15.))
+
+    def test_url_length(self):
+        import pydap.client
+        dataset = open_url('http://localhost:8001/')
+        self.urls = []
+        max_url_length, pydap.client.MAX_URL_LENGTH = pydap.client.MAX_URL_LENGTH, 50
+        try:
+            data = fetch(dataset, {dataset.rain.x: 0, dataset.rain.y: 1})
+        finally:
+            pydap.client.MAX_URL_LENGTH = max_url_length
+        self.assertEqual(len(self.urls), 2)
+        np.testing.assert_array_equal(data[dataset.rain.x], [0])
+        np.testing.assert_array_equal(data[dataset.rain.y], [1])
+
+    def test_sessions(self):
+        # each dataset is only reachable through its own session
+        datasets = []
+        for location in ['http://localhost:8002/', 'http://localhost:8003/']:
+            session = requests.Session()
+            session.mount(location, WSGIAdapter(self.app.app))
+            datasets.append(open_url(location, session=session))
+        self.urls = []
+        data = fetch(datasets[0], {
+            datasets[0].temp: slice(0, 2),
+            datasets[1].temp: slice(2, 4),
+        })
+        self.assertEqual(self.urls, [])
+        np.testing.assert_array_equal(data[datasets[0].temp], [0., 1.])
+        np.testing.assert_array_equal(data[datasets[1].temp], [2., 3.])
+
+
+class Test_Batch(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test')
+        dataset['temp'] = BaseType('temp', np.arange(20.))
+        dataset['rain'] = BaseType('rain', np.arange(60).reshape(6, 10))
+        self.app = TestApp(BaseHandler(dataset))
+
+        # intercept HTTP requests, keeping track of the urls
+        self.urls = []
+        get = requests_intercept(self.app, 'http://localhost:8001/')
+        def new_get(url, **kwargs):
+            self.urls.append(url)
+            return get(url, **kwargs)
+        self.requests_get = requests.get
+        requests.get = new_get
+
+    def tearDown(self):
+        requests.get = self.requests_get
+
+    def test_adjacent(self):
+        dataset = open_url('http://localhost:8001/')
+        self.urls = []
+        with Batch() as batch:
+            rows = [batch.read(dataset.rain, i) for i in range(4)]
+            window = batch.read(dataset.rain, (slice(1, 3), slice(2, 8, 2)))
+            temp = batch.read(dataset.temp, slice(5, 10))
+        self.assertEqual(len(self.urls), 1)
+        self.assertIn('rain[0:1:3][0:1:9]', self.urls[0])
+        for i, row in enumerate(rows):
+            np.testing.assert_array_equal(row.get(),
+                np.arange(60).reshape(6, 10)[i:i+1])
+        np.testing.assert_array_equal(window.get(),
+            np.arange(60).reshape(6, 10)[1:3, 2:8:2])
+        np.testing.assert_array_equal(temp.get(), np.arange(5., 10.))
+
+    def test_waste(self):
+        dataset = open_url('http://localhost:8001/')
+        self.urls = []
+        batch = Batch(waste=0.5)
+        first = batch.read(dataset.temp, 0)
+        second = batch.read(dataset.temp, 1)
+        last = batch.read(dataset.temp, 19)
+        same = batch.read(dataset.temp, 0)
+        self.assertEqual(last.get(), [19.])
+        self.assertEqual(first.get(), [0.])
+        self.assertEqual(second.get(), [1.])
+        self.assertEqual(same.get(), [0.])
+
+        # the last value is too far apart, so it's requested separately
+        self.assertEqual(len(self.urls), 2)
+
+        self.urls = []
+        with Batch(waste=0.9) as batch:
+            first = batch.read(dataset.temp, 0)
+            second = batch.read(dataset.temp, 1)
+            last = batch.read(dataset.temp, 19)
+        self.assertEqual(len(self.urls), 1)
+        self.assertEqual(last.get(), [19.])
+
+    def test_strided(self):
+        dataset = open_url('http://localhost:8001/')
+        self.urls = []
+        with Batch(waste=0) as batch:
+            values = [batch.read(dataset.temp, i) for i in (0, 5, 10)]
+        self.assertEqual(len(self.urls), 1)
+        self.assertIn('temp[0:5:10]', self.urls[0])
+        self.assertEqual([value.get() for value in values], [0., 5., 10.])
+
+    def test_errors(self):
+        batch = Batch()
+        self.assertRaises(ClientError, batch.read, np.arange(3))
+        self.assertRaises(ClientError, batch.read, BaseType('x', np.arange(3)))
+
+        dataset = open_url('http://localhost:8001/')
+        def get(url, **kwargs):
+            raise IOError('Connection refused')
+        requests.get = get
+        first = batch.read(dataset.temp, 0)
+        second = batch.read(dataset.temp, 1)
+        self.assertRaises(IOError, first.get)
+        self.assertRaises(IOError, second.get)
+
+
+class Test_AsyncClient(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('EOSDB.DBO', type='Drifters')
+        dataset['Drifters'] = SequenceType('Drifters')
+        dataset['Drifters']['instrument_id'] = BaseType('instrument_id')
+        dataset['Drifters']['location'] = BaseType('location')
+        dataset['Drifters']['latitude'] = BaseType('latitude')
+        dataset['Drifters']['longitude'] = BaseType('longitude')
+        dataset.Drifters.data = np.rec.fromrecords(
+            DATA, names=dataset.Drifters.keys())
+        dataset['temp'] = BaseType('temp', np.arange(20.))
+
+        # send requests to the app through a session
+        self.session = requests.Session()
+        self.session.mount('http://localhost:8001/',
+            WSGIAdapter(BaseHandler(dataset)))
+
+    def test_open_url(self):
+        with AsyncClient(4, self.session) as client:
+            results = [client.open_url('http://localhost:8001/')
+                for i in range(8)]
+            datasets = [result.get() for result in results]
+        self.assertEqual(len(datasets), 8)
+        self.assertEqual(datasets[0].attributes['type'], "Drifters")
+
+    def test_read(self):
+        with AsyncClient(4, self.session) as client:
+            dataset = client.open_url('http://localhost:8001/').get()
+            results = [client.read(dataset.temp, slice(i, i+2))
+                for i in range(0, 20, 2)]
+            sequence = client.read(dataset.Drifters)
+            np.testing.assert_array_equal(
+                np.concatenate([result.get() for result in results]),
+                np.arange(20.))
+            self.assertEqual(sequence.get(), DATA)
+
+    def test_iterate(self):
+        with AsyncClient(4, self.session) as client:
+            dataset = client.open_url('http://localhost:8001/').get()
+            records = client.iterate(dataset.Drifters, slice(1, 3))
+            self.assertEqual(next(records), DATA[1])
+            self.assertEqual(list(records), DATA[2:3])
+            self.assertRaises(ClientError, client.iterate, dataset.temp)
+
+    def test_iterate_pool(self):
+        # records are downloaded by the threads of the client
+        threads = []
+        batches = SequenceProxy.batches
+        def new_batches(proxy):
+            threads.append(threading.current_thread())
+            for batch in batches(proxy):
+                yield batch
+        SequenceProxy.batches = new_batches
+        try:
+            with AsyncClient(1, self.session) as client:
+                dataset = client.open_url('http://localhost:8001/').get()
+                records = client.iterate(dataset.Drifters)
+                self.assertEqual(list(records), DATA)
+                worker = client.pool.apply_async(threading.current_thread).get()
+        finally:
+            SequenceProxy.batches = batches
+        self.assertEqual(threads, [worker])
+
+
 class Test_Functions(unittest.TestCase):
     def setUp(self):                                                            
         # create dataset                                                        
@@ -135,4 +528,12 @@ class Test_Functions(unittest.TestCase):
         np.testing.assert_array_equal(dataset.rain.rain.data,
             np.array(2.5))
 
-
+    def test_session(self):
+        session = requests.Session()
+        session.mount('http://localhost:8002/', WSGIAdapter(self.app.app))
+        dataset = open_url('http://localhost:8002/', session=session)
+        def get(url, **kwargs):
+            raise AssertionError('Request not sent through the session.')
+        requests.get = get
+        out = dataset.functions.mean(dataset.rain, 0)
+        np.testing.assert_array_equal(out.rain.rain.data, [1.5, 2.5, 3.5])
@@ -4,7 +4,10 @@ import numpy as np
                                                                                 
 from pydap.model import *                                                       
 from pydap.parsers import parse_ce
-from pydap.handlers.lib import BaseHandler
+from pydap.lib import lazy_slice
+from pydap.handlers import lib
+from pydap.handlers.lib import BaseHandler, compile_ce, ColumnData
+from webtest import TestApp
 
 
 DATA = zip(
@@ -41,3 +44,229 @@ class Test_constrain(unittest.TestCase):
         projection, selection = parse_ce('Drifters.longitude<999')
         dataset = BaseHandler(self.dataset).parse(projection, selection)
         np.testing.assert_array_equal(filtered, dataset.Drifters.data)
+
+    def test_shorthand(self):
+        data = np.rec.fromrecords(DATA, names=self.dataset.Drifters.keys())
+
+        ce = compile_ce('latitude&Drifters.longitude<999', self.dataset)
+        dataset = BaseHandler(self.dataset).parse(ce.projection(), ce.selection)
+        self.assertEqual(dataset.Drifters.keys(), ['latitude'])
+        np.testing.assert_array_equal(
+            data[ data['longitude'] < 999 ]['latitude'],
+            dataset.Drifters.latitude.data)
+
+    def test_field_view(self):
+        projection, selection = parse_ce('Drifters.latitude,Drifters.location')
+        dataset = BaseHandler(self.dataset).parse(projection, selection)
+        data = dataset.Drifters.data
+        self.assertEqual(data.dtype.names, ('latitude', 'location'))
+        self.assertTrue(np.may_share_memory(data, self.dataset.Drifters.data))
+        self.assertEqual(data.tolist(), [(rec[2], rec[1]) for rec in DATA])
+
+    def test_template_unchanged(self):
+        projection, selection = parse_ce('Drifters.latitude')
+        dataset = BaseHandler(self.dataset).parse(projection, selection)
+        self.assertEqual(dataset.Drifters.keys(), ['latitude'])
+        self.assertEqual(self.dataset.Drifters.keys(),
+            ['instrument_id', 'location', 'latitude', 'longitude'])
+
+    def test_descr(self):
+        self.dataset.Drifters.descr = ('Drifters', [], ())
+        projection, selection = parse_ce('Drifters.latitude')
+        dataset = BaseHandler(self.dataset).parse(projection, selection)
+        self.assertEqual(dataset.Drifters.descr, ('Drifters', [], ()))
+
+
+class Test_compile_ce(unittest.TestCase):
+    def setUp(self):
+        self.dataset = DatasetType('test')
+        self.dataset['seq'] = SequenceType('seq')
+        self.dataset['seq']['a'] = BaseType('a')
+        self.dataset['seq']['b'] = BaseType('b')
+        self.dataset.seq.data = np.rec.fromrecords(
+            [(1, 10), (2, 20), (3, 30)], names=['a', 'b'])
+
+    def test_cache(self):
+        ce = compile_ce('b&seq.a>1', self.dataset)
+        self.assertIs(compile_ce('b&seq.a>1', self.dataset), ce)
+        self.assertEqual(ce.projection(), [[('seq', ()), ('b', ())]])
+
+        # a different dataset is never served a cached expression
+        other = self.dataset.clone()
+        self.assertIsNot(compile_ce('b&seq.a>1', other), ce)
+
+    def test_projection_copy(self):
+        ce = compile_ce('seq.a,seq.b', self.dataset)
+        ce.projection()[0].pop(0)
+        self.assertEqual(ce.projection(),
+            [[('seq', ()), ('a', ())], [('seq', ()), ('b', ())]])
+
+    def test_repeated_requests(self):
+        app = TestApp(BaseHandler(self.dataset))
+        calls = []
+        fix_shorthand = lib.fix_shorthand
+        def counted(projection, dataset):
+            calls.append(projection)
+            return fix_shorthand(projection, dataset)
+        lib.fix_shorthand = counted
+        try:
+            for i in range(3):
+                res = app.get('/.asc?b&seq.a>1')
+                self.assertIn('20', res.body)
+                self.assertNotIn('10', res.body)
+        finally:
+            lib.fix_shorthand = fix_shorthand
+
+        # the shorthand is only resolved when the expression is compiled
+        self.assertEqual(len(calls), 1)
+
+    def test_parse_override(self):
+        class Handler(BaseHandler):
+            def parse(self, projection, selection, buffer_size=None):
+                return BaseHandler.parse(self, projection, selection)
+
+        res = TestApp(Handler(self.dataset)).get('/.asc?b&seq.a>1')
+        self.assertIn('20', res.body)
+        self.assertNotIn('10', res.body)
+
+
+class Test_ColumnData(unittest.TestCase):
+    def setUp(self):
+        self.columns = [
+            ('index', np.arange(10)),
+            ('temperature', np.arange(10) * 0.5),
+            ('site', np.array(['site_%d' % i for i in range(10)])),
+        ]
+        self.records = np.rec.fromarrays(
+            [col for name, col in self.columns],
+            names=[name for name, col in self.columns])
+
+        self.dataset = DatasetType('test')
+        self.dataset['cast'] = SequenceType('cast')
+        for name, col in self.columns:
+            self.dataset['cast'][name] = BaseType(name)
+        self.dataset.cast.data = ColumnData(self.columns)
+
+    def test_children(self):
+        cast = self.dataset.cast
+        self.assertIsInstance(cast.temperature.data, ColumnData)
+        self.assertEqual(cast.temperature.dtype, np.dtype(float))
+        self.assertEqual(cast.site.shape, (10,))
+        self.assertEqual(list(cast.index), range(10))
+        self.assertEqual(cast.data[-1], (9, 4.5, 'site_9'))
+
+    def test_compose(self):
+        cast = self.dataset.cast
+        out = cast[ cast.index > 2 ][::3]['site', 'index'][1:]
+        expected = self.records[ self.records['index'] > 2 ][::3][1:]
+        self.assertEqual(list(out), zip(expected['site'], expected['index']))
+
+        # the columns themselves are never copied
+        for name, col in self.columns:
+            self.assertIs(out.data.columns[name], col)
+
+    def test_slices(self):
+        data = self.dataset.cast.data['index']
+        for first, second in [
+                (slice(None), slice(2, 8, 2)),
+                (slice(1, 9, 2), slice(None, None, -1)),
+                (slice(None, None, -1), slice(1, None, 3)),
+                (slice(9, 0, -2), slice(-2, None))]:
+            self.assertEqual(list(data[first][second]),
+                range(10)[first][second])
+            self.assertEqual(list(data[np.arange(1, 10, 2)][first]),
+                [1, 3, 5, 7, 9][first])
+
+    def test_array(self):
+        np.testing.assert_array_equal(
+            np.asarray(self.dataset.cast.data[2:5]), self.records[2:5])
+
+    def test_response(self):
+        app = TestApp(BaseHandler(self.dataset))
+        res = app.get('/.asc?cast.site,cast.temperature&cast.index>=7')
+        self.assertEqual(res.body, 'cast\nsite, temperature\n'
+            'site_7, 3.5\nsite_8, 4.0\nsite_9, 4.5\n')
+
+        expected = self.dataset.clone()
+        expected.cast.data = self.records
+        self.assertEqual(app.get('/.dods?cast[2:1:5]&cast.index!=3').body,
+            TestApp(BaseHandler(expected)).get(
+                '/.dods?cast[2:1:5]&cast.index!=3').body)
+
+
+class CountingArray(object):
+    """
+    An array that records the slices read from it.
+
+    """
+    def __init__(self, data):
+        self.array = data
+        self.reads = []
+
+    dtype = property(lambda self: self.array.dtype)
+    shape = property(lambda self: self.array.shape)
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return self.array[key]
+
+
+class Test_lazy_slice(unittest.TestCase):
+    def setUp(self):
+        self.data = CountingArray(np.arange(60, dtype='>i').reshape(6, 10))
+        self.x = CountingArray(np.arange(10, dtype='>i'))
+        self.dataset = DatasetType('test')
+        rain = self.dataset['rain'] = GridType('rain')
+        rain['rain'] = BaseType('rain', self.data, dimensions=('y', 'x'))
+        rain['y'] = BaseType('y', np.arange(6, dtype='>i'))
+        rain['x'] = BaseType('x', self.x)
+        self.dataset['x'] = BaseType('x', self.x)
+
+    def test_compose(self):
+        view = lazy_slice(lazy_slice(self.data, (slice(1, 5), slice(None, None, 3))),
+                (slice(1, None), slice(1, None)))
+        self.assertEqual(view.shape, (3, 3))
+        self.assertEqual(self.data.reads, [])
+        np.testing.assert_array_equal(view[:], self.data.array[1:5, ::3][1:, 1:])
+        self.assertEqual(self.data.reads, [(slice(2, 5, 1), slice(3, 10, 3))])
+
+    def test_grid(self):
+        # grids sliced directly hold arrays
+        grid = self.dataset.rain[1:5, ::3][1:, 1:]
+        self.assertEqual(grid.rain.shape, (3, 3))
+        np.testing.assert_array_equal(grid.rain.data,
+            self.data.array[1:5, ::3][1:, 1:])
+        np.testing.assert_array_equal(grid.x > 4, [False, True, True])
+        np.testing.assert_array_equal(grid.x.data == 6, [False, True, False])
+        np.testing.assert_array_equal(grid.x.data + 1, [4, 7, 10])
+        self.assertEqual(grid.rain.data.mean(), 36)
+        self.assertEqual(grid.rain.data.reshape(-1).shape, (9,))
+
+    def test_projection(self):
+        projection, selection = parse_ce('rain[1:1:4][0:2:9],x[2:4]')
+        dataset = BaseHandler(self.dataset).parse(projection, selection)
+        self.assertEqual(dataset.rain.rain.shape, (4, 5))
+        self.assertEqual(dataset.x.shape, (3,))
+        self.assertEqual(self.data.reads + self.x.reads, [])
+
+    def test_response(self):
+        app = TestApp(BaseHandler(self.dataset))
+        body = app.get('/.dods?rain[1:1:4][0:2:9],x[2:4]').body
+
+        expected = DatasetType('test')
+        rain = expected['rain'] = GridType('rain')
+        rain['rain'] = BaseType('rain', self.data.array, dimensions=('y', 'x'))
+        rain['y'] = BaseType('y', np.arange(6, dtype='>i'))
+        rain['x'] = BaseType('x', self.x.array)
+        expected['x'] = BaseType('x', self.x.array)
+        self.assertEqual(body, TestApp(BaseHandler(expected)).get(
+            '/.dods?rain[1:1:4][0:2:9],x[2:4]').body)
+
+    def test_blocks(self):
+        view = BaseHandler(self.dataset).parse(*parse_ce('rain.rain[1:1:4]'))
+        data = view.rain.rain.data
+        blocks = list(data.blocks(size=2 * 4 * 10))
+        self.assertEqual([block.shape for block in blocks], [(2, 10), (2, 10)])
+        self.assertEqual(self.data.reads, [
+            (slice(1, 3, 1), slice(0, 10, 1)),
+            (slice(3, 5, 1), slice(0, 10, 1))])
@@ -0,0 +1,326 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from webtest import TestApp
+import requests
+
+from pydap.model import *
+from pydap.handlers.lib import BaseHandler
+import pydap.handlers.dap
+from pydap.handlers.dap import (StreamReader, unpack_sequence, unpack_batches,
+    prefetch, dump, iter_blocks, print_data)
+from pydap.parsers.dds import build_dataset
+from pydap.responses.dods import dispatch
+from pydap.client import open_url
+from pydap.tests import requests_intercept
+from pydap.exceptions import ClientError
+
+
+DATA = np.rec.fromrecords(
+    [(i, i*0.5, 1000-i) for i in range(100)],
+    names=['index', 'temperature', 'depth'],
+    formats=['>i', '>f', '>d'])
+
+
+class Test_unpack_sequence(unittest.TestCase):
+    def setUp(self):
+        self.sequence = SequenceType('cast')
+        self.sequence['index'] = BaseType('index')
+        self.sequence['temperature'] = BaseType('temperature')
+        self.sequence['depth'] = BaseType('depth')
+        self.sequence.data = DATA
+        self.descr = ('cast', [
+            ('index', '>i', ()), ('temperature', '>f', ()), ('depth', '>d', ())], ())
+
+    def test_batches(self):
+        xdrdata = ''.join(dispatch(self.sequence))
+        batches = list(unpack_batches(StreamReader(iter([xdrdata])), self.descr))
+        self.assertEqual(len(batches), 1)
+        np.testing.assert_array_equal(batches[0], DATA)
+
+    def test_stream(self):
+        # pass the data in small chunks, followed by more data
+        xdrdata = ''.join(dispatch(self.sequence)) + 'more'
+        chunks = (xdrdata[i:i+7] for i in range(0, len(xdrdata), 7))
+        buf = StreamReader(chunks)
+        self.assertEqual(list(unpack_sequence(buf, self.descr)), list(DATA))
+        self.assertEqual(buf.read(4), 'more')
+
+    def test_child(self):
+        xdrdata = ''.join(dispatch(self.sequence['depth', 'index']))
+        rows = unpack_sequence(StreamReader(iter([xdrdata])),
+            ('cast', [('depth', '>d', ()), ('index', '>i', ())], ()))
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            zip(DATA['depth'], DATA['index']))
+
+    def test_empty(self):
+        xdrdata = ''.join(dispatch(self.sequence[:0]))
+        rows = unpack_sequence(StreamReader(iter([xdrdata])), self.descr)
+        self.assertEqual(list(rows), [])
+
+
+class Test_SequenceProxy(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test')
+        dataset['cast'] = SequenceType('cast')
+        dataset['cast']['index'] = BaseType('index')
+        dataset['cast']['temperature'] = BaseType('temperature')
+        dataset['cast']['depth'] = BaseType('depth')
+        dataset.cast.data = DATA
+
+        self.app = TestApp(BaseHandler(dataset))
+
+        # intercept HTTP requests, keeping track of the urls
+        self.urls = []
+        get = requests_intercept(self.app, 'http://localhost:8001/')
+        def new_get(url, **kwargs):
+            self.urls.append(url)
+            return get(url, **kwargs)
+        self.requests_get = requests.get
+        requests.get = new_get
+
+    def tearDown(self):
+        requests.get = self.requests_get
+
+    def test_data(self):
+        dataset = open_url('http://localhost:8001/')
+        self.assertEqual(list(dataset.cast), list(DATA))
+
+    def test_slice(self):
+        dataset = open_url('http://localhost:8001/')
+        self.assertEqual(list(dataset.cast[10:20:3]), list(DATA[10:20:3]))
+        self.assertEqual(list(dataset.cast.data['depth'][5:8]),
+            list(DATA['depth'][5:8]))
+
+    def test_paged(self):
+        dataset = open_url('http://localhost:8001/')
+        self.urls = []
+        self.assertEqual(list(dataset.cast.data.paged(30, workers=1)),
+            list(DATA))
+        # the fourth page is short, so no more pages are requested
+        self.assertEqual(len(self.urls), 4)
+        self.assertIn('cast[90:1:119].index', self.urls[-1])
+
+    def test_paged_concurrent(self):
+        dataset = open_url('http://localhost:8001/')
+        cast = dataset.cast.data
+        self.assertEqual(list(cast.paged(7, workers=4)), list(DATA))
+        self.assertEqual(list(cast[10:50:2].paged(4, workers=3)),
+            list(DATA[10:50:2]))
+        self.assertEqual(list(cast[dataset.cast.index > 90].paged(2)),
+            list(DATA[DATA['index'] > 90]))
+
+    def test_paged_early_exit(self):
+        dataset = open_url('http://localhost:8001/')
+        pools = []
+        class Pool(ThreadPool):
+            def terminate(self):
+                pools.append(self)
+                ThreadPool.terminate(self)
+        pydap.handlers.dap.ThreadPool = Pool
+        try:
+            records = dataset.cast.data.paged(2, workers=4)
+            self.assertEqual(next(records), DATA[0])
+            records.close()
+        finally:
+            pydap.handlers.dap.ThreadPool = ThreadPool
+
+        # pending pages are abandoned
+        self.assertEqual(len(pools), 1)
+
+    def test_child(self):
+        dataset = open_url('http://localhost:8001/')
+        np.testing.assert_array_equal(
+            list(dataset.cast.data['depth']), DATA['depth'])
+
+    def test_partial_iteration(self):
+        dataset = open_url('http://localhost:8001/')
+        for i, rec in enumerate(dataset.cast):
+            if i == 10:
+                break
+        self.assertEqual(rec, DATA[10])
+
+    def test_filtering(self):
+        dataset = open_url('http://localhost:8001/')
+        cast = dataset.cast
+        self.assertEqual(
+            list(cast[ cast.index > 90 ]), list(DATA[ DATA['index'] > 90 ]))
+
+
+class Test_BaseProxy(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test')
+        rain = dataset['rain'] = GridType('rain')
+        rain['rain'] = BaseType('rain', np.arange(60, dtype='f').reshape(6, 10),
+            dimensions=('y', 'x'))
+        rain['x'] = BaseType('x', np.arange(10), units='degrees_east')
+        rain['y'] = BaseType('y', np.arange(6), units='degrees_north')
+        dataset['scalar'] = BaseType('scalar', np.array(42, 'd'))
+
+        self.app = TestApp(BaseHandler(dataset))
+        self.requests_get = requests.get
+        requests.get = requests_intercept(self.app, 'http://localhost:8001/')
+
+    def tearDown(self):
+        requests.get = self.requests_get
+
+    def test_array(self):
+        dataset = open_url('http://localhost:8001/')
+        data = dataset.rain.rain[:]
+        self.assertEqual(data.dtype, np.dtype('>f'))
+        np.testing.assert_array_equal(data,
+            np.arange(60, dtype='f').reshape(6, 10))
+
+    def test_slice(self):
+        dataset = open_url('http://localhost:8001/')
+        np.testing.assert_array_equal(dataset.rain.rain[1:3, 0:10:3],
+            np.arange(60).reshape(6, 10)[1:3, 0:10:3])
+        np.testing.assert_array_equal(dataset.rain.x[2:5], [2, 3, 4])
+
+    def test_iteration(self):
+        dataset = open_url('http://localhost:8001/')
+        window_size = pydap.handlers.dap.WINDOW_SIZE
+        pydap.handlers.dap.WINDOW_SIZE = 80  # two rows
+        try:
+            rows = list(dataset.rain.rain)
+        finally:
+            pydap.handlers.dap.WINDOW_SIZE = window_size
+        np.testing.assert_array_equal(rows, np.arange(60).reshape(6, 10))
+
+    def test_scalar(self):
+        dataset = open_url('http://localhost:8001/')
+        self.assertEqual(dataset.scalar[...], 42)
+
+    def test_close(self):
+        dataset = open_url('http://localhost:8001/')
+        responses = []
+        get = requests.get
+        def new_get(url, **kwargs):
+            responses.append(get(url, **kwargs))
+            return responses[-1]
+        requests.get = new_get
+
+        # the connection is released even when the payload is not read
+        # until the end, or when the response is incomplete
+        dataset.rain.x[2:5]
+        dataset.rain.rain.data.dtype = np.dtype('>d')
+        self.assertRaises(ClientError, lambda: dataset.rain.rain[:])
+        self.assertEqual([r.closed for r in responses], [True, True])
+
+
+class Test_prefetch(unittest.TestCase):
+    def test_error(self):
+        def gen():
+            yield 1
+            raise ValueError('failed')
+        data = prefetch(gen())
+        self.assertEqual(next(data), 1)
+        self.assertRaises(ValueError, next, data)
+
+
+class Test_dump(unittest.TestCase):
+    def setUp(self):
+        dataset = DatasetType('test')
+        rain = dataset['rain'] = GridType('rain')
+        rain['rain'] = BaseType('rain', np.arange(6, dtype='i').reshape(2, 3),
+            dimensions=('y', 'x'))
+        rain['x'] = BaseType('x', np.arange(3, dtype='i'))
+        rain['y'] = BaseType('y', np.arange(2, dtype='i'))
+        dataset['name'] = BaseType('name', np.array(['pydap', 'dap']))
+        dataset['cast'] = SequenceType('cast')
+        dataset['cast']['index'] = BaseType('index')
+        dataset['cast']['temperature'] = BaseType('temperature')
+        dataset['cast']['depth'] = BaseType('depth')
+        dataset.cast.data = DATA
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.dods')
+        with open(self.path, 'wb') as fp:
+            fp.write(TestApp(BaseHandler(dataset)).get('/.dods').body)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_dump(self, *args):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            dump([self.path] + list(args))
+            return sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+
+    def test_data(self):
+        lines = self.run_dump()
+        self.assertEqual(lines[:3], ['rain.rain', '    0, 1, 2', '    3, 4, 5'])
+        self.assertEqual(lines[lines.index('name') + 1], "    'pydap', 'dap'")
+        start = lines.index('cast')
+        self.assertEqual(len(lines) - start - 1, len(DATA))
+        self.assertEqual(lines[start + 1], '    (0, 0.0, 1000.0)')
+
+    def test_summary(self):
+        lines = self.run_dump('--summary')
+        self.assertEqual(lines[0], 'rain.rain: shape (2, 3), >i4, range 0..5')
+        self.assertEqual(lines[3], "name: shape (2,), string")
+        self.assertEqual(lines[4],
+            'cast: 100 records; index 0..99; temperature 0.0..49.5; '
+            'depth 901.0..1000.0')
+
+    def test_npz(self):
+        output = os.path.join(self.tmpdir, 'test.npz')
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.run_dump('--output', output)
+            self.assertEqual(sys.stderr.getvalue(),
+                'Skipping name: not supported in .npz files\n')
+        finally:
+            sys.stderr = stderr
+        data = np.load(output)
+        self.assertEqual(sorted(data.keys()),
+            ['cast', 'rain.rain', 'rain.x', 'rain.y'])
+        np.testing.assert_array_equal(data['rain.rain'],
+            np.arange(6).reshape(2, 3))
+        np.testing.assert_array_equal(data['cast'], DATA)
+
+    def test_npy_error(self):
+        output = os.path.join(self.tmpdir, 'name.npy')
+        self.path = os.path.join(self.tmpdir, 'name.dods')
+        dataset = DatasetType('test')
+        dataset['name'] = BaseType('name', np.array(['pydap', 'dap']))
+        with open(self.path, 'wb') as fp:
+            fp.write(TestApp(BaseHandler(dataset)).get('/.dods').body)
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertRaises(SystemExit, self.run_dump, '--output', output)
+        finally:
+            sys.stderr = stderr
+        self.assertFalse(os.path.exists(output))
+
+    def test_string_blocks(self):
+        words = np.array([['word%d' % (i * 3 + j) for j in range(3)]
+            for i in range(4)])
+        dataset = DatasetType('test')
+        dataset['words'] = BaseType('words', words, dimensions=('y', 'x'))
+        body = TestApp(BaseHandler(dataset)).get('/.dods').body
+        dds, data = body.split('\nData:\n', 1)
+        var = build_dataset(dds).words
+
+        blocks = list(iter_blocks(StreamReader(iter([data])), var, size=8))
+        self.assertGreater(len(blocks), 1)
+        self.assertTrue(all(len(block) % 3 == 0 for block in blocks))
+        np.testing.assert_array_equal(np.concatenate(blocks), words.ravel())
+
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            print_data(var, iter_blocks(StreamReader(iter([data])), var, size=8))
+            lines = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(lines[1:], ['    ' + ', '.join(map(repr, row))
+            for row in words.tolist()])
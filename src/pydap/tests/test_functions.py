@@ -0,0 +1,347 @@
+import unittest
+
+import numpy as np
+import requests
+from webtest import TestApp
+
+from pydap.model import *
+from pydap.handlers.lib import BaseHandler, ColumnData
+from pydap.exceptions import ConstraintExpressionError
+from pydap.client import open_url, Functions
+from pydap.wsgi.ssf import ServerSideFunctions
+from pydap.wsgi import functions
+from pydap.wsgi.functions import (subset, monotonic_cache, bounds,
+        time_range, time_cache, mean, min_, max_, sum_, std, count,
+        decimate, coarsen)
+from pydap.responses.dods import dispatch
+from pydap.tests.test_constrain import CountingArray
+from pydap import indexes
+from pydap.tests import requests_intercept
+
+
+class Test_subset(unittest.TestCase):
+    def setUp(self):
+        self.dataset = DatasetType('test')
+        sst = self.dataset['sst'] = GridType('sst')
+        sst['sst'] = BaseType('sst', np.arange(120.).reshape(3, 5, 8),
+            dimensions=('time', 'lat', 'lon'))
+        sst['time'] = BaseType('time', np.array([0, 5, 3]))
+        sst['lat'] = BaseType('lat', np.array([40., 20., 0., -20., -40.]))
+        sst['lon'] = BaseType('lon', np.arange(0., 360., 45.))
+
+    def test_increasing(self):
+        out = subset(self.dataset, self.dataset.sst, 'lon', 40, 100)
+        self.assertEqual(out.sst.shape, (3, 5, 2))
+        np.testing.assert_array_equal(out.lon[:], [45, 90])
+        np.testing.assert_array_equal(out.sst[:],
+            self.dataset.sst.sst[:, :, 1:3])
+
+    def test_decreasing(self):
+        sst = self.dataset.sst
+        out = subset(self.dataset, sst, sst.lat, 30, -20, 'lon', 90, 90)
+        np.testing.assert_array_equal(out.lat[:], [20, 0, -20])
+        np.testing.assert_array_equal(out.lon[:], [90])
+        np.testing.assert_array_equal(out.sst[:], sst.sst[:, 1:4, 2:3])
+
+    def test_not_monotonic(self):
+        out = subset(self.dataset, self.dataset.sst, 'time', 4, 6)
+        np.testing.assert_array_equal(out.time[:], [5])
+
+    def test_empty(self):
+        out = subset(self.dataset, self.dataset.sst, 'lat', 50, 60)
+        self.assertEqual(out.sst.shape, (3, 0, 8))
+
+    def test_lazy(self):
+        data = CountingArray(self.dataset.sst.sst.data)
+        self.dataset.sst.sst.data = data
+        out = subset(self.dataset, self.dataset.sst, 'lat', -30, 30)
+        self.assertEqual(data.reads, [])
+        self.assertEqual(out.sst.shape, (3, 3, 8))
+
+        # the grid is read when encoded
+        ''.join(dispatch(out))
+        self.assertEqual(data.reads, [(slice(0, 3, 1), slice(1, 4, 1), slice(0, 8, 1))])
+
+    def test_cached(self):
+        lon = self.dataset.sst.lon.data
+        subset(self.dataset, self.dataset.sst, 'lon', 0, 90)
+        self.assertEqual(monotonic_cache.get(id(lon))[1], 1)
+
+        # a cloned dataset shares the data, and the cached monotonicity
+        clone = self.dataset.clone()
+        self.assertIs(clone.sst.lon.data, lon)
+
+    def test_errors(self):
+        sst = self.dataset.sst
+        self.assertRaises(ConstraintExpressionError,
+            subset, self.dataset, sst.sst, 'lat', 0, 1)
+        self.assertRaises(ConstraintExpressionError,
+            subset, self.dataset, sst, 'lat', 0)
+        self.assertRaises(ConstraintExpressionError,
+            subset, self.dataset, sst, 'depth', 0, 1)
+
+    def test_request(self):
+        functions = dict(ServerSideFunctions.functions, subset=subset)
+        app = ServerSideFunctions(BaseHandler(self.dataset))
+        app.functions = functions
+        requests_get = requests.get
+        requests.get = requests_intercept(TestApp(app), 'http://localhost:8001/')
+        try:
+            dataset = open_url('http://localhost:8001/')
+            out = Functions('http://localhost:8001/').subset(
+                dataset.sst, 'lat', -30, 30, 'lon', 180, 270)
+            np.testing.assert_array_equal(out.sst.lat.data, [20, 0, -20])
+            np.testing.assert_array_equal(out.sst.sst.data,
+                self.dataset.sst.sst[:, 1:4, 4:7])
+        finally:
+            requests.get = requests_get
+
+
+class Test_bounds(unittest.TestCase):
+    def setUp(self):
+        n = indexes.CHUNK_ROWS * 2
+        rng = np.random.RandomState(0)
+        self.lon = rng.uniform(0, 360, n)
+        self.lat = rng.uniform(-90, 90, n)
+        self.lat[::1000] = np.nan
+        self.depth = rng.randint(0, 10, n) * 100.
+        self.time = np.arange(n) * 3600.
+
+        self.dataset = DatasetType('test')
+        seq = self.dataset['cast'] = SequenceType('cast')
+        seq['lon'] = BaseType('lon', axis='X')
+        seq['lat'] = BaseType('lat', axis='Y')
+        seq['depth'] = BaseType('depth', axis='Z')
+        seq['time'] = BaseType('time', axis='T',
+            units='seconds since 1970-01-01', grads_step='6hr')
+        self.columns = [('lon', self.lon), ('lat', self.lat),
+            ('depth', self.depth), ('time', self.time)]
+
+    def check(self, data, args, mask):
+        self.dataset.cast.data = data
+        dataset = self.dataset.clone()
+        bounds(dataset, *args)
+        np.testing.assert_array_equal(
+            np.asarray(dataset.cast.time.data), self.time[mask])
+        np.testing.assert_array_equal(
+            np.asarray(dataset.cast.lat.data), self.lat[mask])
+
+    def test_bounds(self):
+        args = (10, 50.5, -20, 20, 0, 500, '00Z01JAN1970', '00Z01MAR1970')
+        mask = ((self.lon >= 10) & (self.lon <= 50.5) &
+                (self.lat >= -20) & (self.lat <= 20) & (self.depth <= 500) &
+                (self.time <= 59 * 86400))
+        records = np.rec.fromarrays([self.lon, self.lat, self.depth, self.time],
+            names=['lon', 'lat', 'depth', 'time'])
+        for data in [ColumnData(self.columns), records]:
+            self.check(data, args, mask)
+
+    def test_inverted(self):
+        args = (10, 50.5, 20, -20, 0, 500, '00Z01JAN1970', '00Z01MAR1970')
+        records = np.rec.fromarrays([self.lon, self.lat, self.depth, self.time],
+            names=['lon', 'lat', 'depth', 'time'])
+        for data in [ColumnData(self.columns), records]:
+            self.check(data, args, np.zeros(len(self.time), bool))
+
+    def test_selected(self):
+        data = ColumnData(self.columns)[::-2]
+        selected = np.zeros(len(self.time), bool)
+        selected[::-2] = True
+        args = (0, 360, -90, 90, 100, 100, '00Z02JAN1970', '00Z02JAN1970')
+        mask = ((self.depth == 100) & (self.time >= 86400) &
+                (self.time < 86400 + 6 * 3600) & ~np.isnan(self.lat))
+        self.dataset.cast.data = data
+        dataset = self.dataset.clone()
+        bounds(dataset, *args)
+        np.testing.assert_array_equal(
+            np.asarray(dataset.cast.time.data), self.time[mask & selected][::-1])
+
+    def test_time_range(self):
+        time_cache.clear()
+        self.assertEqual(
+            time_range('12Z01JAN1970', '00Z02JAN1970', 'days since 1970-01-01'),
+            (0.5, 1.0, True))
+        self.assertEqual(len(time_cache), 1)
+        self.assertEqual(
+            time_range('00Z01JAN1970', '00Z01JAN1970', 'days since 1970-01-01', '1dy'),
+            (0.0, 1.0, False))
+
+    def test_errors(self):
+        self.assertRaises(ConstraintExpressionError, bounds, DatasetType('empty'),
+            0, 1, 0, 1, 0, 1, '00Z01JAN1970', '00Z01JAN1970')
+
+
+class Test_reductions(unittest.TestCase):
+    def setUp(self):
+        data = np.arange(60, dtype='i2').reshape(3, 4, 5)
+        data[0, 0, :] = -999
+        data[:, 1, 1] = -999
+        self.data = CountingArray(data)
+        self.masked = np.ma.masked_equal(data, -999).astype('d')
+
+        self.dataset = DatasetType('test')
+        grid = self.dataset['temp'] = GridType('temp')
+        grid['temp'] = BaseType('temp', self.data,
+            dimensions=('time', 'lat', 'lon'), _FillValue=-999, units='K')
+        grid['time'] = BaseType('time', np.arange(3))
+        grid['lat'] = BaseType('lat', np.arange(4))
+        grid['lon'] = BaseType('lon', np.arange(5))
+
+        self.block_size = functions.BLOCK_SIZE
+        functions.BLOCK_SIZE = 8 * 5 * 2
+
+    def tearDown(self):
+        functions.BLOCK_SIZE = self.block_size
+        functions.REDUCTION_THREADS = 1
+
+    def check(self, axis):
+        grid = self.dataset.temp
+        for function, expected in [
+                (mean, self.masked.mean(axis).filled(np.nan)),
+                (min_, self.masked.min(axis).filled(np.nan)),
+                (max_, self.masked.max(axis).filled(np.nan)),
+                (sum_, self.masked.sum(axis).filled(0)),
+                (std, self.masked.std(axis).filled(np.nan)),
+                (count, self.masked.count(axis))]:
+            out = function(self.dataset, grid, axis)
+            self.assertEqual(out.temp.dimensions,
+                tuple(dim for i, dim in enumerate(grid.dimensions) if i != axis))
+            self.assertEqual(out.keys(), ['temp'] + list(out.temp.dimensions))
+            np.testing.assert_allclose(out.temp.data, expected)
+
+    def test_grid(self):
+        for axis in range(3):
+            self.check(axis)
+
+    def test_blocks(self):
+        mean(self.dataset, self.dataset.temp, 1)
+        for key in self.data.reads:
+            size = np.prod([len(xrange(*k.indices(n)))
+                for k, n in zip(key, self.data.shape)])
+            self.assertLessEqual(8 * size, functions.BLOCK_SIZE)
+        self.assertGreater(len(self.data.reads), 1)
+
+    def test_threads(self):
+        functions.REDUCTION_THREADS = 4
+        for axis in range(3):
+            self.check(axis)
+
+    def test_array(self):
+        out = count(self.dataset, self.dataset.temp.temp, 0)
+        self.assertIsInstance(out, BaseType)
+        self.assertEqual(out.data.dtype, np.int32)
+        np.testing.assert_array_equal(out.data, self.masked.count(0))
+
+        nans = BaseType('x', np.array([np.nan, 1., 2.]))
+        self.assertEqual(mean(self.dataset, nans).data, 1.5)
+
+    def test_attributes(self):
+        packed = BaseType('t', np.array([[1, 2], [3, -999]], 'i2'),
+            scale_factor=0.5, add_offset=273.15, units='K', _FillValue=-999)
+        unpacked = np.ma.masked_equal(packed.data, -999) * 0.5 + 273.15
+
+        out = count(self.dataset, packed, 0)
+        self.assertEqual(out.attributes, {})
+        out = std(self.dataset, packed, 0)
+        self.assertEqual(out.attributes, {'scale_factor': 0.5, 'units': 'K'})
+        np.testing.assert_allclose(out.data * 0.5, unpacked.std(0))
+        out = sum_(self.dataset, packed, 0)
+        self.assertEqual(out.attributes, {'scale_factor': 0.5, 'units': 'K'})
+        np.testing.assert_allclose(out.data * 0.5, unpacked.sum(0))
+        out = mean(self.dataset, packed, 0)
+        self.assertEqual(out.attributes,
+            {'scale_factor': 0.5, 'add_offset': 273.15, 'units': 'K'})
+        np.testing.assert_allclose(out.data * 0.5 + 273.15, unpacked.mean(0))
+
+    def test_dtype(self):
+        out = min_(self.dataset, self.dataset.temp, 1)
+        self.assertEqual(out.temp.data.dtype, np.int16)
+        np.testing.assert_array_equal(out.temp.data, self.masked.min(1))
+        # missing results are NaN
+        out = max_(self.dataset, self.dataset.temp, 0)
+        self.assertEqual(out.temp.data.dtype, np.float64)
+
+    def test_errors(self):
+        self.assertRaises(ConstraintExpressionError,
+            mean, self.dataset, self.dataset, 0)
+        self.assertRaises(ConstraintExpressionError,
+            std, self.dataset, self.dataset.temp, 3)
+
+
+class Test_resampling(unittest.TestCase):
+    def setUp(self):
+        data = np.arange(42.).reshape(6, 7)
+        data[0, 0] = -1
+        self.data = CountingArray(data)
+        self.dataset = DatasetType('test')
+        grid = self.dataset['sst'] = GridType('sst')
+        grid['sst'] = BaseType('sst', self.data, dimensions=('lat', 'lon'),
+            missing_value=-1)
+        grid['lat'] = BaseType('lat', np.arange(6) * 10)
+        grid['lon'] = BaseType('lon', np.arange(7) * 10)
+
+    def test_decimate(self):
+        out = decimate(self.dataset, self.dataset.sst, 2, 3)
+        self.assertEqual(self.data.reads, [])
+        self.assertEqual(out.sst.shape, (3, 3))
+        np.testing.assert_array_equal(out.sst.data, self.data.array[::2, ::3])
+        np.testing.assert_array_equal(out.lat.data, [0, 20, 40])
+        np.testing.assert_array_equal(out.lon.data, [0, 30, 60])
+        self.assertEqual(self.data.reads, [(slice(0, 6, 2), slice(0, 7, 3))])
+
+    def test_decimate_array(self):
+        out = decimate(self.dataset, self.dataset.sst.sst, 4)
+        self.assertIsInstance(out, BaseType)
+        np.testing.assert_array_equal(out.data, self.data.array[::4])
+
+    def test_coarsen(self):
+        out = coarsen(self.dataset, self.dataset.sst, 2, 3)
+        self.assertEqual(out.sst.shape, (3, 3))
+        np.testing.assert_array_equal(out.lat.data, [5, 25, 45])
+        np.testing.assert_array_equal(out.lon.data, [10, 40, 60])
+        expected = np.ma.masked_equal(self.data.array, -1)
+        self.assertEqual(out.sst.data[0, 0], expected[:2, :3].mean())
+        self.assertEqual(out.sst.data[2, 2], expected[4:, 6:].mean())
+
+        # missing values are NaN
+        self.assertNotIn('missing_value', out.sst.attributes)
+        out = coarsen(self.dataset, self.dataset.sst.sst, 2)
+        self.assertNotIn('missing_value', out.attributes)
+
+    def test_blocks(self):
+        block_size = functions.BLOCK_SIZE
+        functions.BLOCK_SIZE = 8 * 2 * 7
+        try:
+            out = coarsen(self.dataset, self.dataset.sst.sst, 2)
+        finally:
+            functions.BLOCK_SIZE = block_size
+        self.assertEqual(self.data.reads,
+            [(slice(0, 2),), (slice(2, 4),), (slice(4, 6),)])
+        np.testing.assert_array_equal(out.data[1:],
+            (self.data.array[2::2] + self.data.array[3::2]) / 2)
+
+    def test_errors(self):
+        for function in [decimate, coarsen]:
+            self.assertRaises(ConstraintExpressionError,
+                function, self.dataset, self.dataset.sst, 1, 1, 1)
+            self.assertRaises(ConstraintExpressionError,
+                function, self.dataset, self.dataset.sst, 0)
+            self.assertRaises(ConstraintExpressionError,
+                function, self.dataset, self.dataset, 2)
+
+    def test_request(self):
+        app = ServerSideFunctions(BaseHandler(self.dataset))
+        app.functions = dict(ServerSideFunctions.functions,
+            decimate=decimate, coarsen=coarsen)
+        requests_get = requests.get
+        requests.get = requests_intercept(TestApp(app), 'http://localhost:8001/')
+        try:
+            dataset = open_url('http://localhost:8001/')
+            out = Functions('http://localhost:8001/').coarsen(dataset.sst, 3, 7)
+            np.testing.assert_array_equal(out.sst.sst.data,
+                [[np.mean(self.data.array[:3].ravel()[1:])],
+                 [self.data.array[3:].mean()]])
+            out = Functions('http://localhost:8001/').decimate(dataset.sst, 5)
+            np.testing.assert_array_equal(out.sst.lat.data, [0, 50])
+        finally:
+            requests.get = requests_get
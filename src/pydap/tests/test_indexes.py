@@ -0,0 +1,264 @@
+import gc
+import os
+import shutil
+import operator
+import tempfile
+import threading
+import unittest
+import warnings
+
+import numpy as np
+
+from pydap.model import *
+from pydap.parsers import parse_ce
+from pydap.handlers.lib import BaseHandler, ColumnData
+from pydap import indexes
+from pydap.lib import LRUCache
+from pydap.indexes import (SortedIndex, ZoneMap, GridIndex, attach,
+        find_index, intersect, relative_rows)
+
+
+class Columns(dict):
+    """
+    Columns that can be referenced weakly.
+
+    """
+
+
+OPS = [operator.gt, operator.ge, operator.lt, operator.le, operator.eq]
+
+
+def expected_rows(column, op, value):
+    with np.errstate(invalid='ignore'):
+        return np.flatnonzero(op(column, value))
+
+
+def as_rows(rows):
+    if isinstance(rows, slice):
+        return np.arange(rows.start, rows.stop)
+    return rows
+
+
+class Test_indexes(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.sorted = np.sort(rng.randint(0, 100, 1000))
+        self.random = rng.randint(0, 100, 1000)
+
+    def test_sorted(self):
+        index = SortedIndex.build(self.sorted)
+        self.assertIsNone(index.order)
+        for op in OPS:
+            rows = index.rows(self.sorted, op, 50)
+            self.assertIsInstance(rows, slice)
+            np.testing.assert_array_equal(
+                as_rows(rows), expected_rows(self.sorted, op, 50))
+
+    def test_permuted(self):
+        index = SortedIndex.build(self.random)
+        for op in OPS:
+            np.testing.assert_array_equal(index.rows(self.random, op, 50),
+                expected_rows(self.random, op, 50))
+
+    def test_nan(self):
+        column = self.random.astype('d')
+        column[::7] = np.nan
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            index = SortedIndex.build(column)
+            for op in OPS:
+                np.testing.assert_array_equal(index.rows(column, op, 50),
+                    expected_rows(column, op, 50))
+            zones = ZoneMap.build(column, chunk=64)
+            zones.rows(column, operator.gt, 50)
+
+    def test_zone_map(self):
+        column = np.concatenate([self.sorted, self.random]).astype('d')
+        column[5] = np.nan
+        index = ZoneMap.build(column, chunk=64)
+        for op in OPS:
+            for value in [-1, 0, 50, 99, 100]:
+                np.testing.assert_array_equal(index.rows(column, op, value),
+                    expected_rows(column, op, value))
+
+    def test_between(self):
+        for column in [self.sorted, self.random]:
+            index = SortedIndex.build(column)
+            np.testing.assert_array_equal(as_rows(index.between(column, 10, 20)),
+                np.flatnonzero((column >= 10) & (column <= 20)))
+            np.testing.assert_array_equal(
+                as_rows(index.between(column, 10, 20, False)),
+                np.flatnonzero((column >= 10) & (column < 20)))
+            self.assertEqual(len(as_rows(index.between(column, 20, 10))), 0)
+
+    def test_grid(self):
+        rng = np.random.RandomState(1)
+        x, y = rng.uniform(0, 360, 10000), rng.uniform(-90, 90, 10000)
+        x[::7] = np.nan
+        index = GridIndex.build(x, y, rows=16)
+        for box in [(10, 20, -5, 5), (0, 360, -90, 90), (400, 500, 0, 1),
+                (100, 100, -90, 90)]:
+            rows = index.candidates(*box)
+            self.assertTrue((np.diff(rows) > 0).all())
+            inside = np.flatnonzero((x >= box[0]) & (x <= box[1]) &
+                (y >= box[2]) & (y <= box[3]))
+            self.assertTrue(np.in1d(inside, rows).all())
+        self.assertLess(len(index.candidates(10, 20, -5, 5)), 500)
+
+        # inverted boxes are empty
+        self.assertEqual(len(index.candidates(20, 10, -5, 5)), 0)
+        self.assertEqual(len(index.candidates(10, 20, 5, -5)), 0)
+
+    def test_relative_rows(self):
+        self.assertIs(relative_rows(slice(1, 3), None).__class__, slice)
+        np.testing.assert_array_equal(
+            relative_rows(np.array([2, 5]), np.array([5, 3, 2])), [0, 2])
+
+    def test_unsupported(self):
+        self.assertIsNone(SortedIndex().rows(self.sorted, operator.ne, 1))
+        self.assertIsNone(ZoneMap.build(self.random).rows(
+            self.random, operator.ne, 1))
+
+    def test_intersect(self):
+        self.assertEqual(intersect(slice(5, 10), slice(20, 30)), slice(20, 20))
+        np.testing.assert_array_equal(
+            intersect(np.array([1, 2, 3]), np.array([2, 3, 4])), [2, 3])
+        np.testing.assert_array_equal(
+            intersect(np.array([1, 6, 9]), slice(5, 10)), [6, 9])
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'index.npz')
+            ZoneMap.build(self.random, chunk=64).save(filename)
+            index = ZoneMap.load(filename)
+            self.assertEqual(index.chunk, 64)
+            np.testing.assert_array_equal(index.rows(self.random, operator.lt, 10),
+                expected_rows(self.random, operator.lt, 10))
+
+            x = self.random.astype('d')
+            GridIndex.build(x, x[::-1], rows=16).save(filename)
+            index = GridIndex.load(filename)
+            np.testing.assert_array_equal(index.candidates(10, 20, 10, 20),
+                GridIndex.build(x, x[::-1], rows=16).candidates(10, 20, 10, 20))
+
+            SortedIndex.build(self.random).save(filename)
+            index = SortedIndex.load(filename)
+            np.testing.assert_array_equal(index.rows(self.random, operator.eq, 10),
+                expected_rows(self.random, operator.eq, 10))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_find_index(self):
+        small = np.arange(10)
+        self.assertIsNone(find_index(small))
+
+        column = np.arange(indexes.CHUNK_ROWS)
+        self.assertIsInstance(find_index(column), SortedIndex)
+        self.assertIs(find_index(column), find_index(column))
+        self.assertIsInstance(find_index(column[::-1].copy()), ZoneMap)
+        self.assertIsNone(find_index(column.astype('S4')))
+
+    def test_attach(self):
+        column = np.arange(indexes.CHUNK_ROWS)
+        attach(column, None)
+        self.assertIsNone(find_index(column))
+        index = SortedIndex.build(column)
+        attach(column, index)
+        self.assertIs(find_index(column), index)
+
+        # indexes are not served for new data reusing the id
+        del column
+        other = np.arange(indexes.CHUNK_ROWS)[::-1].copy()
+        self.assertIsInstance(find_index(other), ZoneMap)
+
+    def test_collect(self):
+        # columns in reference cycles are freed by the garbage collector,
+        # which can run while the cache lock is held
+        cache = indexes.indexes
+        indexes.indexes = LRUCache(indexes.INDEX_CACHE_SIZE)
+        try:
+            for i in range(3):
+                columns = Columns(a=np.arange(10))
+                columns['self'] = columns
+                attach(columns, None, 'a')
+                del columns
+
+            def collect():
+                with indexes.indexes.lock:
+                    gc.collect()
+            thread = threading.Thread(target=collect)
+            thread.daemon = True
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            indexes.indexes = cache
+
+
+class Test_selection(unittest.TestCase):
+    def setUp(self):
+        n = indexes.CHUNK_ROWS * 3
+        rng = np.random.RandomState(0)
+        self.time = np.arange(n, dtype='d')
+        self.depth = rng.uniform(0, 1000, n)
+        self.depth[:indexes.CHUNK_ROWS] = 0
+        self.name = np.array(['a', 'b'] * (n // 2))
+
+        self.dataset = DatasetType('test')
+        self.dataset['cast'] = SequenceType('cast')
+        for name in ['time', 'depth', 'name']:
+            self.dataset['cast'][name] = BaseType(name)
+
+    def check(self, ce, mask):
+        """
+        Compare a request on different kinds of data with a mask.
+
+        """
+        columns = [('time', self.time), ('depth', self.depth), ('name', self.name)]
+        records = np.rec.fromarrays([self.time, self.depth, self.name],
+                names=['time', 'depth', 'name'])
+        sliced = np.zeros(len(mask), bool)
+        sliced[10:-10] = True
+        for data, rows in [
+                (ColumnData(columns), mask),
+                (ColumnData(columns)[10:-10], mask & sliced),
+                (records, mask)]:
+            self.dataset.cast.data = data
+            dataset = BaseHandler(self.dataset).parse(*parse_ce(ce))
+            np.testing.assert_array_equal(
+                np.asarray(dataset.cast.time.data), self.time[rows])
+            np.testing.assert_array_equal(
+                np.asarray(dataset.cast.depth.data), self.depth[rows])
+
+    def test_sorted(self):
+        self.check('cast.time,cast.depth&cast.time>100000', self.time > 100000)
+        self.check('cast.time,cast.depth&cast.time<=10', self.time <= 10)
+
+    def test_zone_map(self):
+        self.check('cast.time,cast.depth&cast.depth<1', self.depth < 1)
+
+    def test_multiple(self):
+        self.check('cast.time,cast.depth&cast.time>=1000&cast.time<150000'
+                '&cast.depth>500&cast.name="a"',
+                (self.time >= 1000) & (self.time < 150000) &
+                (self.depth > 500) & (self.name == 'a'))
+
+    def test_attached_nan(self):
+        self.depth[::7] = np.nan
+        data = ColumnData([('time', self.time), ('depth', self.depth)])
+        attach(data.columns, SortedIndex.build(self.depth), 'depth')
+        self.dataset.cast.data = data
+        dataset = BaseHandler(self.dataset).parse(
+            *parse_ce('cast.time&cast.depth>500'))
+        with np.errstate(invalid='ignore'):
+            expected = self.time[self.depth > 500]
+        np.testing.assert_array_equal(
+            np.asarray(dataset.cast.time.data), expected)
+
+    def test_not_indexed(self):
+        self.check('cast.time,cast.depth&cast.time!=5', self.time != 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,8 @@
 import unittest 
+import weakref
+import cPickle as pickle
+
+import numpy as np
 
 from pydap.model import *
 from pydap.model import DapType
@@ -34,6 +38,51 @@ class Test_attributes(unittest.TestCase):
         self.assertEqual(self.var.attributes['bar'], self.var.bar)
         self.assertEqual(self.var.attributes['baz'], self.var.baz)
 
+    def test_empty(self):
+        var = BaseType('foo')
+        self.assertRaises(AttributeError, getattr, var, 'units')
+        var.attributes['units'] = 'm'
+        self.assertEqual(var.units, 'm')
+
+    def test_shared(self):
+        # an attributes dictionary passed explicitly is not copied
+        attributes = {'bar': 1}
+        var = StructureType('foo', attributes)
+        self.assertIs(var.attributes, attributes)
+
+
+class Test_compact(unittest.TestCase):
+    def test_slots(self):
+        for var in [BaseType('a'), StructureType('b'), SequenceType('c'),
+                GridType('d')]:
+            self.assertIn('name', DapType.__slots__)
+            # handlers can still set their own attributes
+            var.foo = 1
+            self.assertEqual(var.foo, 1)
+            self.assertIs(weakref.ref(var)(), var)
+            out = pickle.loads(pickle.dumps(var, pickle.HIGHEST_PROTOCOL))
+            self.assertEqual(out.foo, 1)
+
+    def test_empty_grid(self):
+        self.assertRaises(IndexError, getattr, GridType('grid'), 'array')
+
+    def test_interned(self):
+        a = BaseType(''.join(['ti', 'me']))
+        self.assertIs(a.name, BaseType('time').name)
+
+    def test_pickle(self):
+        dataset = DatasetType('test', history='created')
+        dataset['cast'] = SequenceType('cast')
+        dataset['cast']['a'] = BaseType('a', units='m')
+        dataset['x'] = BaseType('x', np.arange(3), dimensions=('x',))
+        out = pickle.loads(pickle.dumps(dataset, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(out.history, 'created')
+        self.assertEqual(out.keys(), ['cast', 'x'])
+        self.assertEqual(out.cast.a.units, 'm')
+        self.assertEqual(out.cast.a.id, 'cast.a')
+        self.assertEqual(out.x.dimensions, ('x',))
+        np.testing.assert_array_equal(out.x.data, [0, 1, 2])
+
 
 class Test_id(unittest.TestCase):
     def setUp(self):
@@ -48,6 +97,49 @@ class Test_id(unittest.TestCase):
         self.assertEqual(self.dataset['one'].id, 'one')
         self.assertEqual(self.dataset['one']['two'].id, 'one.two')
 
+    def test_bottom_up(self):
+        # ids follow when containers are added after their children
+        three = StructureType('three')
+        three['four'] = BaseType('four')
+        self.dataset['one']['three'] = three
+        self.assertEqual(three.four.id, 'one.three.four')
+
+    def test_explicit(self):
+        two = self.dataset.one.two.clone()
+        self.assertEqual(two.id, 'one.two')
+        self.dataset['other'] = StructureType('other')
+        self.dataset['other']['two'] = two
+        self.assertEqual(two.id, 'other.two')
+
+    def test_rename(self):
+        self.dataset.name = 'renamed'
+        self.assertEqual(self.dataset.id, 'renamed')
+        self.assertEqual(self.dataset['one']['two'].id, 'one.two')
+
+
+class Test_children(unittest.TestCase):
+    def setUp(self):
+        self.var = StructureType('s')
+        for name in 'abc':
+            self.var[name] = BaseType(name)
+
+    def test_order(self):
+        self.assertEqual(self.var.keys(), ['a', 'b', 'c'])
+        self.assertEqual([c.name for c in self.var.children()], ['a', 'b', 'c'])
+
+    def test_replace(self):
+        # replaced children are moved to the end
+        self.var['a'] = BaseType('a')
+        self.assertEqual(self.var.keys(), ['b', 'c', 'a'])
+
+    def test_delete(self):
+        del self.var['b']
+        self.assertEqual(self.var.keys(), ['a', 'c'])
+        self.assertNotIn('b', self.var)
+
+    def test_shortcut(self):
+        self.assertIs(self.var.b, self.var['b'])
+
 
 class Test_dataset(unittest.TestCase):
     pass
@@ -0,0 +1,161 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import requests
+from webtest import TestApp
+
+from pydap.model import *
+from pydap.lib import LRUCache
+from pydap.handlers.lib import BaseHandler, get_handler
+from pydap.client import open_url, Functions
+from pydap.wsgi.ssf import ServerSideFunctions
+from pydap.wsgi.functions import block_mean, coarsen
+from pydap.exceptions import ConstraintExpressionError
+from pydap import overviews
+from pydap.overviews import (build, load_index, register, find_levels,
+        overview, main)
+from pydap.tests import requests_intercept
+
+
+def make_dataset():
+    dataset = DatasetType('test')
+    sst = dataset['sst'] = GridType('sst')
+    data = np.arange(3 * 40 * 80, dtype='f4').reshape(3, 40, 80)
+    data[0, 0, 0] = -1
+    sst['sst'] = BaseType('sst', data, dimensions=('time', 'lat', 'lon'),
+        _FillValue=-1)
+    sst['time'] = BaseType('time', np.arange(3))
+    sst['lat'] = BaseType('lat', np.linspace(-90, 90, 40))
+    sst['lon'] = BaseType('lon', np.linspace(0, 360, 80, endpoint=False))
+    return dataset
+
+
+class FileHandler(BaseHandler):
+    extensions = r'.*\.test$'
+
+    def __init__(self, filepath):
+        BaseHandler.__init__(self, make_dataset())
+
+
+class Test_overviews(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'data.test')
+        with open(self.filepath, 'w') as fp:
+            fp.write('data')
+        self.dataset = make_dataset()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build(self):
+        index = build(self.filepath, self.dataset, minimum=10)
+        self.assertEqual(index, {'sst': [(3, 20, 40), (3, 10, 20), (3, 5, 10)]})
+        self.assertEqual(load_index(self.filepath), index)
+
+        level = np.load(os.path.join(self.filepath + '.overviews', 'sst.1.npy'))
+        self.assertEqual(level.dtype, np.float32)
+        expected = block_mean(self.dataset.sst.sst.data, (1, 2, 2), [-1])
+        np.testing.assert_array_equal(level, expected)
+        level = np.load(os.path.join(self.filepath + '.overviews', 'sst.2.npy'))
+        np.testing.assert_array_equal(level, block_mean(expected, (1, 2, 2)))
+
+    def test_overview(self):
+        build(self.filepath, self.dataset, minimum=10)
+        register(self.dataset, self.filepath)
+        sst = self.dataset.sst
+
+        out = overview(self.dataset, sst, 1, 10, 10)
+        self.assertEqual(out.sst.shape, (3, 10, 20))
+        self.assertEqual(out.lon.shape, (20,))
+        self.assertNotIn('_FillValue', out.sst.attributes)
+        np.testing.assert_allclose(out.lat.data,
+            block_mean(sst.lat.data, (4,)))
+        self.assertEqual(overview(self.dataset, sst).sst.shape, (3, 5, 10))
+        self.assertIs(overview(self.dataset, sst, 3, 30, 30), sst)
+
+        # grids are found through clones of the dataset
+        clone = self.dataset.clone()
+        self.assertEqual(overview(clone, clone.sst, 1, 20).sst.shape, (3, 20, 40))
+
+    def test_outdated(self):
+        build(self.filepath, self.dataset, minimum=10)
+        register(self.dataset, self.filepath)
+        mtime = os.stat(self.filepath).st_mtime
+        os.utime(self.filepath, (mtime + 10, mtime + 10))
+        self.assertIsNone(load_index(self.filepath))
+
+        # the grid is averaged on the fly
+        out = overview(self.dataset, self.dataset.sst, 1, 10, 10)
+        self.assertEqual(out.sst.shape, (3, 10, 10))
+        np.testing.assert_array_equal(out.sst.data,
+            coarsen(self.dataset, self.dataset.sst, 1, 4, 8).sst.data)
+
+        build(self.filepath, self.dataset, minimum=10)
+        self.assertEqual(overview(self.dataset, self.dataset.sst, 1, 10, 10).sst.shape,
+            (3, 10, 20))
+
+    def test_collect(self):
+        # datasets are freed by the garbage collector, since parents and
+        # children reference each other, and it can run while the registry
+        # is locked
+        build(self.filepath, self.dataset, minimum=10)
+        registry = overviews.registry
+        overviews.registry = LRUCache(overviews.CACHE_SIZE)
+        try:
+            for i in range(3):
+                register(make_dataset(), self.filepath)
+
+            def collect():
+                with overviews.registry.lock:
+                    gc.collect()
+            thread = threading.Thread(target=collect)
+            thread.daemon = True
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            overviews.registry = registry
+
+    def test_errors(self):
+        self.assertRaises(ConstraintExpressionError,
+            overview, self.dataset, self.dataset.sst.sst, 10)
+        self.assertRaises(ConstraintExpressionError,
+            overview, self.dataset, self.dataset.sst, 1, 2, 3, 4)
+
+    def test_request(self):
+        build(self.filepath, self.dataset, minimum=10)
+        handler = get_handler(self.filepath, [FileHandler])
+        self.assertIsNone(find_levels(handler.dataset.sst))
+        register(handler.dataset, self.filepath)
+        app = ServerSideFunctions(handler)
+        app.functions = dict(ServerSideFunctions.functions, overview=overview)
+        requests_get = requests.get
+        requests.get = requests_intercept(TestApp(app), 'http://localhost:8001/')
+        try:
+            dataset = open_url('http://localhost:8001/')
+            out = Functions('http://localhost:8001/').overview(dataset.sst, 1, 8, 8)
+            self.assertEqual(out.sst.sst.shape, (3, 10, 20))
+            np.testing.assert_array_equal(out.sst.sst.data, np.load(
+                os.path.join(self.filepath + '.overviews', 'sst.2.npy')))
+
+            body = TestApp(app).get('/.asc?overview(sst,1,5,5)').body
+            self.assertTrue(body.startswith('sst.sst'))
+            self.assertEqual(body.count('[['), 3)
+        finally:
+            requests.get = requests_get
+
+    def test_main(self):
+        from pydap.handlers import lib
+        original = lib.load_handlers
+        lib.load_handlers = lambda: [FileHandler]
+        try:
+            main([self.filepath, '--minimum', '40'])
+            self.assertEqual(load_index(self.filepath), {'sst': [(3, 20, 40)]})
+        finally:
+            lib.load_handlers = original
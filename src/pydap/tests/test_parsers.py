@@ -0,0 +1,138 @@
+import unittest
+
+import numpy as np
+
+from pydap.model import *
+from pydap.parsers import SimpleParser
+from pydap.parsers.dds import build_dataset
+from pydap.parsers.das import parse_das, add_attributes
+
+
+DDS = """Dataset {
+    Int32 index;
+    Float32 temp[time = 3][ lat=2 ];
+    Grid {
+      ARRAY:
+        Float64 salt[time = 3];
+      MAPS:
+        Float64 time[time = 3];
+    } salt;
+    Sequence {
+        String station;
+        Structure {
+            Byte flag;
+        } qc;
+    } cast;
+} my dataset;"""
+
+
+class Test_SimpleParser(unittest.TestCase):
+    def test_position(self):
+        parser = SimpleParser('abc 123')
+        self.assertEqual(parser.peek('\w+'), 'abc')
+        self.assertEqual(parser.consume('\w+'), 'abc')
+        self.assertEqual(parser.consume('\s+'), ' ')
+        self.assertEqual(parser.buffer, 'abc 123')
+        self.assertTrue(parser)
+        self.assertEqual(parser.consume('\d+'), '123')
+        self.assertFalse(parser)
+
+    def test_whitespace(self):
+        parser = SimpleParser('abc \n 123', whitespace=True)
+        self.assertEqual(parser.consume('\w+'), 'abc')
+        self.assertEqual(parser.peek('\d+'), '123')
+
+    def test_error(self):
+        parser = SimpleParser('abc')
+        self.assertRaises(Exception, parser.consume, '\d+')
+
+
+class Test_DDSParser(unittest.TestCase):
+    def test_tree(self):
+        dataset = build_dataset(DDS)
+        self.assertEqual(dataset.name, 'my%20dataset')
+        self.assertEqual(dataset.keys(), ['index', 'temp', 'salt', 'cast'])
+        self.assertIsInstance(dataset.salt, GridType)
+        self.assertIsInstance(dataset.cast, SequenceType)
+        self.assertIsInstance(dataset.cast.qc, StructureType)
+        self.assertEqual(dataset.cast.qc.flag.id, 'cast.qc.flag')
+        self.assertEqual(dataset.temp.dimensions, ('time', 'lat'))
+
+    def test_descr(self):
+        dataset = build_dataset(DDS)
+        self.assertEqual(dataset.temp.descr, ('temp', '>f', (3, 2)))
+        self.assertEqual(dataset.salt.descr, ('salt', [
+            ('salt', '>d', (3,)), ('time', '>d', (3,))], ()))
+        self.assertEqual(dataset.cast.descr, ('cast', [
+            ('station', '|S1', ()),
+            ('qc', [('flag', 'B', ())], ())], ()))
+
+    def test_large(self):
+        dds = 'Dataset {\n%s\n} large;' % '\n'.join(
+            '    Float32 var_%d[x = %d];' % (i, i+1) for i in range(5000))
+        dataset = build_dataset(dds)
+        self.assertEqual(len(dataset.keys()), 5000)
+        self.assertEqual(dataset.var_4999.descr, ('var_4999', '>f', (5000,)))
+
+
+DAS = """Attributes {
+    NC_GLOBAL {
+        String title "A \\"test\\"; dataset";
+        Int32 version 2;
+    }
+    temp {
+        Float32 valid_range -2.5, 40;
+        Int16 flag_values 0x1, 0x2, 4;
+        Float64 missing_value NaN;
+        Byte bytes 1, 2, 255;
+    }
+    cast.station {
+        String long_name "Station";
+    }
+    cast {
+        station {
+            String units "none";
+        }
+    }
+}"""
+
+
+class Test_DASParser(unittest.TestCase):
+    def test_strings(self):
+        attributes = parse_das(DAS)
+        self.assertEqual(attributes['NC_GLOBAL']['title'],
+            'A \\"test\\"; dataset')
+        self.assertEqual(attributes['NC_GLOBAL']['version'], 2)
+
+    def test_numbers(self):
+        attributes = parse_das(DAS)['temp']
+        self.assertEqual(attributes['valid_range'].dtype, np.float32)
+        np.testing.assert_array_equal(attributes['valid_range'], [-2.5, 40])
+        self.assertEqual(attributes['flag_values'].dtype, np.int16)
+        np.testing.assert_array_equal(attributes['flag_values'], [1, 2, 4])
+        self.assertTrue(np.isnan(attributes['missing_value']))
+        self.assertEqual(attributes['bytes'].dtype, np.uint8)
+        np.testing.assert_array_equal(attributes['bytes'], [1, 2, 255])
+
+    def test_out_of_range(self):
+        attributes = parse_das('''Attributes {
+    temp {
+        Int16 truncated 1.5, 2.5;
+        Byte wrapped 1, 256;
+        Float32 overflow 1, 1e40;
+        Int16 hex 0x1, 0x2;
+    }
+}''')['temp']
+        self.assertEqual(attributes['truncated'], [1.5, 2.5])
+        self.assertEqual(attributes['wrapped'], [1, 256])
+        self.assertEqual(attributes['overflow'], [1, 1e40])
+        self.assertEqual(attributes['hex'].dtype, np.int16)
+        np.testing.assert_array_equal(attributes['hex'], [1, 2])
+
+    def test_add_attributes(self):
+        dataset = build_dataset(DDS)
+        add_attributes(dataset, parse_das(DAS))
+        self.assertEqual(dataset.attributes['NC_GLOBAL']['version'], 2)
+        self.assertEqual(dataset.temp.attributes['flag_values'].tolist(), [1, 2, 4])
+        self.assertEqual(dataset.cast.station.attributes,
+            {'long_name': 'Station', 'units': 'none'})
@@ -0,0 +1,110 @@
+import os
+import marshal
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pydap.model import *
+from pydap.parsers.dds import build_dataset
+from pydap import skeleton
+from pydap.skeleton import dumps, loads, Placeholder
+
+
+class Test_skeleton(unittest.TestCase):
+    def setUp(self):
+        dataset = self.dataset = DatasetType('test',
+            NC_GLOBAL={'history': 'created', 'version': (1, 2)})
+        rain = dataset['rain'] = GridType('rain', units='mm')
+        rain['rain'] = BaseType('rain', np.arange(6, dtype='i').reshape(2, 3),
+            dimensions=('y', 'x'), valid_range=np.array([0, 10], 'f'),
+            missing_value=np.float32(-1))
+        rain['x'] = BaseType('x', np.arange(3.))
+        rain['y'] = BaseType('y', np.arange(2.))
+        dataset['cast'] = SequenceType('cast')
+        dataset['cast']['index'] = BaseType('index', flags=['a', 'b'])
+        dataset['cast']['depth'] = BaseType('depth')
+
+    def test_structure(self):
+        out = loads(dumps(self.dataset))
+        self.assertEqual(out.keys(), ['rain', 'cast'])
+        self.assertIsInstance(out.rain, GridType)
+        self.assertIsInstance(out.cast, SequenceType)
+        self.assertEqual(out.cast.keys(), ['index', 'depth'])
+        self.assertEqual(out.cast.depth.id, 'cast.depth')
+        self.assertEqual(out.rain.rain.dimensions, ('y', 'x'))
+
+    def test_attributes(self):
+        out = loads(dumps(self.dataset))
+        self.assertEqual(out.attributes['NC_GLOBAL'],
+            {'history': 'created', 'version': (1, 2)})
+        self.assertEqual(out.rain.units, 'mm')
+        self.assertEqual(out.cast.index.flags, ['a', 'b'])
+        self.assertEqual(out.rain.rain.valid_range.dtype, np.float32)
+        np.testing.assert_array_equal(out.rain.rain.valid_range, [0, 10])
+        self.assertEqual(out.rain.rain.missing_value, -1)
+        self.assertIsInstance(out.rain.rain.missing_value, np.float32)
+
+    def test_placeholder(self):
+        out = loads(dumps(self.dataset))
+        data = out.rain.rain.data
+        self.assertIsInstance(data, Placeholder)
+        self.assertEqual((data.dtype, data.shape), (np.dtype('i'), (2, 3)))
+        self.assertRaises(ValueError, data.__getitem__, 0)
+        self.assertRaises(ValueError, list, data)
+        self.assertIs(out.cast.depth.data, None)
+
+    def test_descr(self):
+        dataset = build_dataset(
+            'Dataset { Float32 temp[time = 3][lat = 2]; } test;')
+        out = loads(dumps(dataset))
+        self.assertEqual(out.temp.descr, ('temp', '>f', (3, 2)))
+
+    def test_version(self):
+        data = dumps(self.dataset).replace(marshal.dumps(skeleton.VERSION),
+            marshal.dumps(skeleton.VERSION + 1), 1)
+        self.assertRaises(ValueError, loads, data)
+
+
+class Test_load(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.dds')
+        with open(self.path, 'w') as fp:
+            fp.write('Dataset { Int32 a; } test;')
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, filepath):
+        self.builds.append(filepath)
+        with open(filepath) as fp:
+            return build_dataset(fp.read())
+
+    def test_reuse(self):
+        skeleton.load(self.path, self.build)
+        self.assertTrue(os.path.exists(self.path + '.skel'))
+        dataset = skeleton.load(self.path, self.build)
+        self.assertEqual(self.builds, [self.path])
+        self.assertEqual(dataset.keys(), ['a'])
+
+    def test_modified(self):
+        skeleton.load(self.path, self.build)
+        with open(self.path, 'w') as fp:
+            fp.write('Dataset { Int32 b; } test;')
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        dataset = skeleton.load(self.path, self.build)
+        self.assertEqual(len(self.builds), 2)
+        self.assertEqual(dataset.keys(), ['b'])
+
+    def test_directory(self):
+        directory = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(directory)
+        skeleton.load(self.path, self.build, directory)
+        skeleton.load(self.path, self.build, directory)
+        self.assertEqual(len(self.builds), 1)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertFalse(os.path.exists(self.path + '.skel'))
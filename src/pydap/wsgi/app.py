@@ -25,6 +25,9 @@ In the example above the dataset defined in the `file.sql` will be available
 at http://localhost:8001/pirata. All files in the `/path/to/files` directory
 will be available under the /model path.
 
+Adding `overviews: true` registers the datasets served, so that the
+`overview` server-side function can find their precomputed overviews.
+
 A listing of all served files can be found in http://localhost:8001/catalog.json
 
 """
@@ -77,11 +80,11 @@ class DapServer(object):
                 if re.search(pattern, req.path):
                     try:
                         if 'file' in handler:
-                            res = get_handler(handler['file'])
+                            res = self.get_handler(handler['file'])
                         elif 'dir' in handler:
                             path = req.path_info.lstrip('/').rsplit('.', 1)[0]
                             filepath = os.path.join(handler['dir'], path)
-                            res = get_handler(filepath)
+                            res = self.get_handler(filepath)
                     except OpenFileError as e:
                         res = Response(status='404 Not Found', body=e.value)
                     break
@@ -90,6 +93,18 @@ class DapServer(object):
 
         return res(environ, start_response)
 
+    def get_handler(self, filepath):
+        """
+        Return the handler for a file, registering its overviews if enabled.
+
+        """
+        handler = get_handler(filepath)
+        if (self.config.get('overviews') and
+                getattr(handler, 'dataset', None) is not None):
+            from pydap.overviews import register
+            register(handler.dataset, filepath)
+        return handler
+
     def catalog(self, req):
         """
         Return a JSON listing of the datasets served.
@@ -1,14 +1,38 @@
 from datetime import datetime, timedelta
 import re
+import operator
+import weakref
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import coards
 
 from pydap.model import *
-from pydap.lib import walk
+from pydap.lib import walk, lazy_slice, LRUCache, BLOCK_SIZE
+from pydap.handlers.lib import ColumnData, lazy_grid
+from pydap.indexes import (CHUNK_ROWS, GridIndex, SortedIndex, cached_index,
+        intersect, relative_rows)
 from pydap.exceptions import ConstraintExpressionError
 
 
+# number of maps whose monotonicity is remembered
+MONOTONIC_CACHE_SIZE = 1024
+
+# direction of monotonic maps, keyed by the id of their data; since datasets
+# are cloned for each request, the data is shared between requests
+monotonic_cache = LRUCache(MONOTONIC_CACHE_SIZE)
+
+# number of threads used to reduce independent blocks of data; with 1 the
+# blocks are reduced in the calling thread
+REDUCTION_THREADS = 1
+
+# number of GrADS time bounds whose conversion is remembered
+TIME_CACHE_SIZE = 1024
+
+# GrADS time bounds converted to COARDS values, keyed by times and units
+time_cache = LRUCache(TIME_CACHE_SIZE)
+
+
 def bounds(dataset, xmin, xmax, ymin, ymax, zmin, zmax, tmin, tmax):
     """
     Version 1.0
@@ -26,42 +50,122 @@ def bounds(dataset, xmin, xmax, ymin, ymax, zmin, zmax, tmin, tmax):
     else:
         raise ConstraintExpressionError('Function "bounds" should be used on a Sequence.')
 
+    # find the range of values for each axis
+    ranges = []
     for child in sequence.children():
-        if child.attributes.get('axis', '').lower() == 'x':
-            if xmin == xmax:
-                sequence.data = sequence[ child == xmin ].data
-            else:
-                sequence.data = sequence[ (child >= xmin) & (child <= xmax) ].data
-        elif child.attributes.get('axis', '').lower() == 'y':
-            if ymin == ymax:
-                sequence.data = sequence[ child == ymin ].data
-            else:
-                sequence.data = sequence[ (child >= ymin) & (child <= ymax) ].data
-        elif child.attributes.get('axis', '').lower() == 'z':
-            if zmin == zmax:
-                sequence.data = sequence[ child == zmin ].data
-            else:
-                sequence.data = sequence[ (child >= zmin) & (child <= zmax) ].data
-        elif child.attributes.get('axis', '').lower() == 't':
-            start = datetime.strptime(tmin, '%HZ%d%b%Y')
-            end = datetime.strptime(tmax, '%HZ%d%b%Y')
+        axis = child.attributes.get('axis', '').lower()
+        if axis == 'x':
+            ranges.append((axis, child, xmin, xmax, True))
+        elif axis == 'y':
+            ranges.append((axis, child, ymin, ymax, True))
+        elif axis == 'z':
+            ranges.append((axis, child, zmin, zmax, True))
+        elif axis == 't':
             units = child.attributes.get('units', 'seconds since 1970-01-01')
+            step = child.attributes.get('grads_step')
+            ranges.append((axis, child) + time_range(tmin, tmax, units, step))
 
-            # if start and end are equal, add the step
-            if start == end and 'grads_step' in child.attributes:
-                dt = parse_step(child.attributes['grads_step'])
-                end = start + dt 
-                tmin = coards.format(start, units)
-                tmax = coards.format(end, units)
-                sequence.data = sequence[ (child >= tmin) & (child < tmax) ].data
-            else:
-                tmin = coards.format(start, units)
-                tmax = coards.format(end, units)
-                sequence.data = sequence[ (child >= tmin) & (child <= tmax) ].data
+    rows = bounds_rows(sequence, ranges)
+    if rows is None:
+        # streamed data is filtered once, with all conditions
+        conditions = [in_range(child, low, high, closed)
+                for axis, child, low, high, closed in ranges]
+        if conditions:
+            rows = reduce(operator.and_, conditions)
+    if rows is not None:
+        sequence.data = sequence[rows].data
 
     return sequence
 
 
+def in_range(values, low, high, closed=True):
+    if closed:
+        return (values >= low) & (values <= high)
+    return (values >= low) & (values < high)
+
+
+def bounds_rows(sequence, ranges):
+    """
+    Return the rows of a sequence within the given ranges.
+
+    Large sequences stored in `ColumnData` are indexed by position, with a
+    `GridIndex` on the x and y axes, and by time, with a `SortedIndex`, so
+    that only candidate rows are checked. Structured arrays, which are often
+    copies made for the request, are scanned instead. Each condition is
+    checked only on the rows that passed the previous ones. Returns `None`
+    for other sequences.
+
+    """
+    data = sequence.data
+    if isinstance(data, ColumnData) and isinstance(data.cols, tuple):
+        columns, names, current = data.columns, data.columns, data.index
+        indexed = data.nrows >= CHUNK_ROWS
+    elif isinstance(data, np.ndarray) and data.dtype.names:
+        columns, names, current = data, data.dtype.names, None
+        indexed = False
+    else:
+        return None
+    if not ranges or any(r[1].name not in names for r in ranges):
+        return None
+    axes = dict((r[0], r[1:]) for r in ranges)
+
+    rows = None
+    if indexed and 'x' in axes and 'y' in axes:
+        x, xmin, xmax, closed = axes['x']
+        y, ymin, ymax, closed = axes['y']
+        index = cached_index(columns, ('grid', x.name, y.name),
+                lambda: GridIndex.build(columns[x.name], columns[y.name]))
+        rows = index.candidates(xmin, xmax, ymin, ymax)
+    if indexed and 't' in axes:
+        t, low, high, closed = axes['t']
+        index = cached_index(columns, ('sorted', t.name),
+                lambda: SortedIndex.build(columns[t.name]))
+        found = index.between(columns[t.name], low, high, closed)
+        rows = found if rows is None else intersect(rows, found)
+
+    if isinstance(rows, slice):
+        rows = np.arange(rows.start, rows.stop)
+    elif rows is None and isinstance(current, tuple):
+        rows = np.arange(*current)
+    elif rows is None:
+        rows = current
+    for axis, child, low, high, closed in ranges:
+        column = columns[child.name]
+        if rows is None:
+            rows = np.flatnonzero(in_range(column, low, high, closed))
+        else:
+            rows = rows[in_range(column[rows], low, high, closed)]
+    return relative_rows(rows, current)
+
+
+def time_range(tmin, tmax, units, step=None):
+    """
+    Convert GrADS times to values in COARDS units.
+
+    Returns the minimum and maximum values, and whether the maximum is
+    included. When both times are equal and a GrADS step is given, the range
+    spans a single step::
+
+        >>> time_range('00Z01JAN1970', '00Z01JAN1970', 'hours since 1970-01-01', '6hr')
+        (0.0, 6.0, False)
+
+    """
+    key = tmin, tmax, units, step
+    cached = time_cache.get(key)
+    if cached is None:
+        start = datetime.strptime(tmin, '%HZ%d%b%Y')
+        end = datetime.strptime(tmax, '%HZ%d%b%Y')
+
+        # if start and end are equal, add the step
+        closed = True
+        if start == end and step is not None:
+            end = start + parse_step(step)
+            closed = False
+        cached = time_cache[key] = (
+                coards.format(start, units), coards.format(end, units), closed)
+    return cached
+
+
 def parse_step(step):
     """
     Parse a GrADS time step into a timedelta.
@@ -87,22 +191,516 @@ def mean(dataset, var, axis=0):
 
     Calculates the mean of an array along a given axis.
 
+    """
+    return reduction('mean', var, axis)
+
+
+def min_(dataset, var, axis=0):
+    """
+    Version 1.0
+
+    Calculates the minimum of an array along a given axis.
+
+    """
+    return reduction('min', var, axis)
+
+
+def max_(dataset, var, axis=0):
+    """
+    Version 1.0
+
+    Calculates the maximum of an array along a given axis.
+
+    """
+    return reduction('max', var, axis)
+
+
+def sum_(dataset, var, axis=0):
+    """
+    Version 1.0
+
+    Calculates the sum of an array along a given axis.
+
+    """
+    return reduction('sum', var, axis)
+
+
+def std(dataset, var, axis=0):
+    """
+    Version 1.0
+
+    Calculates the standard deviation of an array along a given axis.
+
+    """
+    return reduction('std', var, axis)
+
+
+def count(dataset, var, axis=0):
+    """
+    Version 1.0
+
+    Counts the valid values of an array along a given axis.
+
+    """
+    return reduction('count', var, axis)
+
+
+def reduction(name, var, axis):
+    """
+    Reduce an array or grid along an axis, returning a new variable.
+
+    Missing values, given by the `_FillValue` and `missing_value` attributes,
+    and NaNs are ignored.
+
     """
     axis = int(axis)
-    dims = tuple(dim for i, dim in enumerate(var.dimensions) if i != axis)
+    if isinstance(var, BaseType):
+        array = var
+    elif isinstance(var, GridType):
+        array = var.array
+    else:
+        raise ConstraintExpressionError(
+                'Function "%s" should be used on an array or grid.' % name)
+    if not 0 <= axis < len(array.shape):
+        raise ConstraintExpressionError(
+                'Invalid axis %d for function "%s".' % (axis, name))
+
+    attributes = reduced_attributes(name, array.attributes)
+    offset = array.attributes.get('add_offset', 0)
+    names = [name, 'count'] if name == 'sum' and offset else [name]
+    stats = statistics(array.data, axis, names, missing_values(array.attributes))
+    data = getattr(stats, name)()
+    if name == 'sum' and offset:
+        # keep the sum packed with the scale factor only
+        data = data + stats.count() * (offset / array.attributes.get('scale_factor', 1.))
+    elif name in ('min', 'max') and array.dtype.kind in 'iu' and not np.isnan(data).any():
+        data = data.astype(array.dtype)
+    dims = tuple(dim for i, dim in enumerate(array.dimensions) if i != axis)
 
     if isinstance(var, BaseType):
-        return BaseType(name=var.name, data=np.mean(var.data[:], axis=axis),
-                dimensions=dims, attributes=var.attributes)
+        return BaseType(name=var.name, data=data, dimensions=dims,
+                attributes=attributes)
 
-    elif isinstance(var, GridType):
-        out = GridType(name=var.name, attributes=var.attributes)
-        out[var.array.name] = BaseType(name=var.array.name, 
-                data=np.mean(var.array.data[:], axis=axis), 
-                dimensions=dims, attributes=var.array.attributes)
-        for dim in dims:
-            out[dim] = BaseType(name=dim, data=var[dim].data[:],
-                    dimensions=(dim,), attributes=var[dim].attributes)
-        return out
+    out = GridType(name=var.name, attributes=var.attributes)
+    out[var.array.name] = BaseType(name=var.array.name, data=data,
+            dimensions=dims, attributes=attributes)
+    for dim in dims:
+        out[dim] = BaseType(name=dim, data=var[dim].data[:],
+                dimensions=(dim,), attributes=var[dim].attributes)
+    return out
+
+
+def reduced_attributes(name, attributes):
+    """
+    Return the attributes of the result of a reduction.
+
+    Missing results are NaN, so fill values are dropped. Valid ranges and
+    offsets don't apply to sums and standard deviations, and counts have
+    no units or packing.
+
+    """
+    drop = ['_FillValue', 'missing_value']
+    if name in ('sum', 'std', 'count'):
+        drop += ['add_offset', 'valid_range', 'valid_min', 'valid_max']
+    if name == 'count':
+        drop += ['scale_factor', 'units']
+    return dict((k, v) for k, v in attributes.items() if k not in drop)
+
+
+def missing_values(attributes):
+    values = []
+    for key in ['_FillValue', 'missing_value']:
+        if key in attributes:
+            values.extend(np.atleast_1d(attributes[key]).tolist())
+    return values
+
+
+class Statistics(object):
+    """
+    Running statistics of data reduced along an axis, in float64.
+
+    Only the statistics in `names` are computed. Blocks of data are added
+    with `update`, and merged with those already seen; missing values are
+    NaN::
+
+        >>> stats = Statistics((), ['count', 'mean', 'std', 'max'])
+        >>> stats.update(np.array([1., 2., np.nan]), 0)
+        >>> stats.update(np.array([3., 4.]), 0)
+        >>> stats.count(), stats.mean(), stats.std(), stats.max()
+        (4, 2.5, 1.118033988749895, 4.0)
+
+    """
+    # the accumulators needed by each statistic
+    needs = {
+        'count': ['n'],
+        'sum': ['total'],
+        'mean': ['n', 'total'],
+        'std': ['n', 'total', 'm2'],
+        'min': ['minimum'],
+        'max': ['maximum'],
+    }
+
+    def __init__(self, shape, names):
+        self.fields = set(field for name in names for field in self.needs[name])
+        self.n = np.zeros(shape, 'i8')
+        self.total = np.zeros(shape, 'f8')
+        self.m2 = np.zeros(shape, 'f8')
+        self.minimum = np.empty(shape, 'f8')
+        self.minimum.fill(np.nan)
+        self.maximum = self.minimum.copy()
+
+    def update(self, block, axis):
+        valid = ~np.isnan(block) if block.dtype.kind == 'f' else None
+        if valid is not None and valid.all():
+            valid = None
+
+        if 'n' in self.fields:
+            n = block.shape[axis] if valid is None else valid.sum(axis)
+        if 'total' in self.fields:
+            if valid is None:
+                total = block.sum(axis, dtype='f8')
+            else:
+                total = np.where(valid, block, 0).sum(axis, dtype='f8')
+        if 'm2' in self.fields:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / n
+                deviation = block - np.expand_dims(mean, axis)
+                if valid is not None:
+                    deviation = np.where(valid, deviation, 0)
+                m2 = (deviation**2).sum(axis)
+
+                # merge with the previous blocks
+                delta = mean - self.total / self.n
+                correction = delta**2 * self.n * n / (self.n + n)
+                self.m2 = self.m2 + m2 + np.where(self.n * n > 0, correction, 0)
+        if 'n' in self.fields:
+            self.n = self.n + n
+        if 'total' in self.fields:
+            self.total = self.total + total
+
+        if 'minimum' in self.fields:
+            minimum = block.min(axis) if valid is None else np.fmin.reduce(block, axis)
+            self.minimum = np.fmin(self.minimum, minimum)
+        if 'maximum' in self.fields:
+            maximum = block.max(axis) if valid is None else np.fmax.reduce(block, axis)
+            self.maximum = np.fmax(self.maximum, maximum)
+
+    def merge(self, others, axis):
+        """
+        Concatenate statistics for consecutive blocks along an axis.
+
+        """
+        for attr in ['n', 'total', 'm2', 'minimum', 'maximum']:
+            setattr(self, attr, np.concatenate(
+                [getattr(other, attr) for other in others], axis))
+
+    def count(self):
+        return self.n.astype('i4')
+
+    def sum(self):
+        return self.total
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.total / self.n
+
+    def std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.m2 / self.n)
+
+    def min(self):
+        return self.minimum
+
+    def max(self):
+        return self.maximum
+
+
+def statistics(data, axis, names, missing=(), size=None):
+    """
+    Compute statistics of data along an axis, reading it in blocks.
+
+    Blocks have about `size` bytes when converted to float64. They span the
+    first axis not reduced, whose blocks are independent and can be
+    processed in parallel, and chunks of the reduced axis, which are
+    accumulated in order.
+
+    """
+    shape = data.shape
+    size = size or BLOCK_SIZE
+    outer = 1 if axis == 0 else 0
+    if outer >= len(shape):
+        outer = None
+
+    # number of items along the reduced and outer axes in each block
+    cell = 8 * max(1, int(np.prod([n for i, n in enumerate(shape)
+            if i not in (axis, outer)])))
+    step = max(1, min(shape[axis], size // cell))
+    rows = max(1, size // (cell * max(1, shape[axis])))
+
+    # position of the outer axis in the result
+    if outer is not None:
+        position = outer if outer < axis else outer - 1
+
+    def reduce_rows(start, stop):
+        out = shape[:axis] + shape[axis+1:]
+        if outer is not None:
+            out = out[:position] + (stop - start,) + out[position+1:]
+        stats = Statistics(out, names)
+        for i in xrange(0, shape[axis], step):
+            key = [slice(None)] * len(shape)
+            key[axis] = slice(i, i + step)
+            if outer is not None:
+                key[outer] = slice(start, stop)
+            stats.update(read_block(data, tuple(key), missing), axis)
+        return stats
+
+    if outer is None:
+        return reduce_rows(0, 0)
+
+    starts = range(0, shape[outer], rows)
+    blocks = [(start, min(start + rows, shape[outer])) for start in starts]
+    blocks = blocks or [(0, 0)]
+    if REDUCTION_THREADS > 1 and len(blocks) > 1:
+        pool = ThreadPool(min(REDUCTION_THREADS, len(blocks)))
+        try:
+            results = pool.map(lambda block: reduce_rows(*block), blocks)
+        finally:
+            pool.close()
     else:
-        raise ConstraintExpressionError('Function "mean" should be used on an array or grid.')
+        results = [reduce_rows(*block) for block in blocks]
+
+    if len(results) == 1:
+        return results[0]
+    stats = Statistics((), names)
+    stats.merge(results, position)
+    return stats
+
+
+def read_block(data, key, missing):
+    """
+    Read a block of data, replacing missing values with NaN.
+
+    """
+    block = data[key]
+    if isinstance(block, np.ma.MaskedArray):
+        block = block.astype('f8').filled(np.nan)
+    elif missing:
+        block = np.array(block, 'f8')
+    else:
+        return np.asarray(block)
+    for value in missing:
+        block[block == value] = np.nan
+    return block
+
+
+def decimate(dataset, var, *steps):
+    """
+    Version 1.0
+
+    Returns every n-th value of an array or grid along each axis, eg:
+
+        http://server.example.com/dataset.dods?decimate(sst,1,10,10)
+
+    Missing steps are 1. Maps are decimated to match, and only the values
+    returned are read.
+
+    """
+    steps = parse_factors('decimate', var, steps)
+    key = tuple(slice(None, None, step) for step in steps)
+    if isinstance(var, GridType):
+        return lazy_grid(var, key)
+    out = var.clone()
+    out.data = lazy_slice(var.data, key)
+    return out
+
+
+def coarsen(dataset, var, *factors):
+    """
+    Version 1.0
+
+    Averages blocks of values of an array or grid, eg:
+
+        http://server.example.com/dataset.dods?coarsen(sst,1,4,4)
+
+    Each value returned is the mean of the valid values in a block with the
+    given number of values along each axis; missing factors are 1, and
+    blocks at the end of an axis can be smaller. Maps are averaged the same
+    way. Missing values are returned as NaN, so fill values are dropped from
+    the attributes. The data is read a few blocks at a time.
+
+    """
+    factors = parse_factors('coarsen', var, factors)
+    if isinstance(var, BaseType):
+        return BaseType(name=var.name,
+                data=block_mean(var.data, factors, missing_values(var.attributes)),
+                dimensions=var.dimensions,
+                attributes=reduced_attributes('mean', var.attributes))
+
+    out = GridType(name=var.name, attributes=var.attributes)
+    out[var.array.name] = BaseType(name=var.array.name,
+            data=block_mean(var.array.data, factors,
+                missing_values(var.array.attributes)),
+            dimensions=var.array.dimensions,
+            attributes=reduced_attributes('mean', var.array.attributes))
+    for factor, map_ in zip(factors, var.maps.values()):
+        if factor == 1:
+            data, attributes = map_.data, map_.attributes
+        else:
+            data = block_mean(map_.data, (factor,))
+            attributes = reduced_attributes('mean', map_.attributes)
+        out[map_.name] = BaseType(name=map_.name, data=data,
+                dimensions=map_.dimensions, attributes=attributes)
+    return out
+
+
+def parse_factors(name, var, factors):
+    """
+    Return one positive integer factor for each axis of a variable.
+
+    """
+    if isinstance(var, GridType):
+        shape = var.array.shape
+    elif isinstance(var, BaseType):
+        shape = var.shape
+    else:
+        raise ConstraintExpressionError(
+                'Function "%s" should be used on an array or grid.' % name)
+    if not shape or len(factors) > len(shape):
+        raise ConstraintExpressionError(
+                'Function "%s" takes at most one factor for each axis.' % name)
+    try:
+        factors = [int(factor) for factor in factors]
+    except (TypeError, ValueError):
+        factors = [0]
+    if any(factor < 1 for factor in factors):
+        raise ConstraintExpressionError(
+                'Factors for function "%s" should be positive integers.' % name)
+    return tuple(factors) + (1,) * (len(shape) - len(factors))
+
+
+def block_mean(data, factors, missing=(), size=None, out=None):
+    """
+    Average blocks of data, reading a few rows of blocks at a time.
+
+    Means are computed in float64, and returned with the type of the data
+    for floats, or stored in `out`::
+
+        >>> block_mean(np.arange(10).reshape(2, 5), (2, 2))
+        array([[3. , 5. , 6.5]])
+
+    """
+    shape = data.shape
+    if out is None:
+        dtype = data.dtype if data.dtype.kind == 'f' else np.dtype('f8')
+        out = np.empty([-(-n // factor) for n, factor in zip(shape, factors)], dtype)
+
+    # number of rows of blocks read at once, with about `size` bytes
+    rowsize = 8 * factors[0] * int(np.prod(shape[1:]))
+    rows = max(1, (size or BLOCK_SIZE) // max(1, rowsize))
+    for start in xrange(0, len(out), rows):
+        stop = min(start + rows, len(out))
+        key = (slice(start * factors[0], min(stop * factors[0], shape[0])),)
+        block = np.asarray(read_block(data, key, missing), 'f8')
+
+        # pad incomplete blocks with NaN, and split each axis in blocks
+        blocks = (stop - start,) + out.shape[1:]
+        padded = tuple(n * factor for n, factor in zip(blocks, factors))
+        if block.shape != padded:
+            full = np.empty(padded)
+            full.fill(np.nan)
+            full[tuple(slice(0, n) for n in block.shape)] = block
+            block = full
+        split = sum(((n, factor) for n, factor in zip(blocks, factors)), ())
+        block = block.reshape(split)
+
+        axes = tuple(range(1, len(split), 2))
+        valid = ~np.isnan(block)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[start:stop] = (np.where(valid, block, 0).sum(axes) /
+                    valid.sum(axes))
+    return out
+
+
+def subset(dataset, var, *bounds):
+    """
+    Version 1.0
+
+    Subsets a grid by the values of its maps, eg:
+
+        http://server.example.com/dataset.dods?subset(sst,lat,-10,10,lon,0,90)
+
+    Bounds are given as a map followed by the minimum and maximum values;
+    other maps are not constrained. Indexes are found by binary search on
+    monotonic maps, and the grid is only read when the response is sent.
+
+    """
+    if not isinstance(var, GridType):
+        raise ConstraintExpressionError('Function "subset" should be used on a grid.')
+    if len(bounds) % 3:
+        raise ConstraintExpressionError(
+            'Function "subset" takes a grid followed by a map, a minimum and a maximum for each map.')
+
+    ranges = {}
+    for i in range(0, len(bounds), 3):
+        name, start, end = bounds[i:i+3]
+        if isinstance(name, DapType):
+            name = name.name
+        if name not in var.maps:
+            raise ConstraintExpressionError(
+                'Grid "%s" has no map "%s".' % (var.name, name))
+        ranges[name] = min(start, end), max(start, end)
+
+    slice_ = tuple(
+            index_range(var[name].data, *ranges[name])
+            if name in ranges else slice(None)
+            for name in var.maps)
+    return lazy_grid(var, slice_)
+
+
+def index_range(data, start, end):
+    """
+    Return the slice of a map with values between `start` and `end`.
+
+    """
+    values = np.asarray(data)
+    direction = monotonic(data, values)
+    if direction > 0:
+        return slice(
+            values.searchsorted(start, 'left'), values.searchsorted(end, 'right'))
+    elif direction < 0:
+        values = values[::-1]
+        return slice(
+            len(values) - values.searchsorted(end, 'right'),
+            len(values) - values.searchsorted(start, 'left'))
+
+    # not monotonic, return all the values in the range
+    index = np.flatnonzero((values >= start) & (values <= end))
+    if not len(index):
+        return slice(0, 0)
+    return slice(index[0], index[-1] + 1)
+
+
+def monotonic(data, values):
+    """
+    Return 1 if a map is increasing, -1 if decreasing and 0 otherwise.
+
+    """
+    key = id(data)
+    cached = monotonic_cache.get(key)
+    if cached is not None and cached[0]() is data:
+        return cached[1]
+
+    diff = np.diff(values)
+    if (diff > 0).all():
+        direction = 1
+    elif (diff < 0).all():
+        direction = -1
+    else:
+        direction = 0
+
+    try:
+        monotonic_cache[key] = weakref.ref(data), direction
+    except TypeError:
+        # data can't be referenced weakly, so we can't tell if it changes
+        pass
+    return direction
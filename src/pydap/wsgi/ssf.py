@@ -98,7 +98,7 @@ class ServerSideFunctions(object):
                 var = eval_function(dataset, call, self.functions)
                 for child in walk(var):
                     parent = reduce(operator.getitem, [out] + child.id.split('.')[:-1])
-                    if child.name not in parent.keys():
+                    if child.name not in parent:
                         parent[child.name] = child
                         break
             dataset = out